@@ -0,0 +1,15 @@
+#!/usr/bin/env python3
+"""
+Photo Enhancer command-line launcher
+Same options as photo_enhancer.py, but runs the module from its cached bytecode:
+Python compiles a script named on the command line on every start, which is most
+of the start-up time of quick commands such as --list-profiles
+"""
+
+import sys
+
+from photo_enhancer import main
+
+
+if __name__ == "__main__":
+    sys.exit(main())
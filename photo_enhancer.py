@@ -1,429 +1,3902 @@
-#!/usr/bin/env python3
-"""
-Photo Enhancement CLI Tool
-A command-line tool for batch photo enhancement with predefined profiles
-"""
-
-from PIL import Image, ImageEnhance, ImageFilter
-import numpy as np
-from pathlib import Path
-import argparse
-import sys
-
-
-class PhotoProfile:
-    """Define a photo enhancement profile"""
-
-    def __init__(self, name, hdr=0, brightness=0, contrast=0, white_point=0,
-                 shadows=0, saturation=0, warmth=0):
-        self.name = name
-        self.hdr = hdr  # 0-100
-        self.brightness = brightness  # -100 to 100
-        self.contrast = contrast  # -100 to 100
-        self.white_point = white_point  # 0-100
-        self.shadows = shadows  # -100 to 100
-        self.saturation = saturation  # -100 to 100
-        self.warmth = warmth  # -100 to 100
-
-
-# Define your profiles
-PROFILES = {
-    "HDR_Boost": PhotoProfile(
-        name="HDR Boost",
-        hdr=100,
-        brightness=10,
-        contrast=10,
-        white_point=5,
-        shadows=25,
-        saturation=25,
-        warmth=10
-    ),
-    "Natural_Enhance": PhotoProfile(
-        name="Natural Enhance",
-        hdr=30,
-        brightness=5,
-        contrast=5,
-        saturation=15,
-        warmth=5
-    ),
-    "Vibrant": PhotoProfile(
-        name="Vibrant",
-        hdr=50,
-        brightness=8,
-        contrast=15,
-        saturation=40,
-        warmth=0
-    ),
-    "Portrait": PhotoProfile(
-        name="Portrait",
-        hdr=20,
-        brightness=12,
-        shadows=30,
-        saturation=10,
-        warmth=15
-    )
-}
-
-
-def apply_brightness(img, value):
-    """Apply brightness adjustment (-100 to 100)"""
-    factor = 1 + (value / 100)
-    enhancer = ImageEnhance.Brightness(img)
-    return enhancer.enhance(factor)
-
-
-def apply_contrast(img, value):
-    """Apply contrast adjustment (-100 to 100)"""
-    factor = 1 + (value / 100)
-    enhancer = ImageEnhance.Contrast(img)
-    return enhancer.enhance(factor)
-
-
-def apply_saturation(img, value):
-    """Apply saturation adjustment (-100 to 100)"""
-    factor = 1 + (value / 100)
-    enhancer = ImageEnhance.Color(img)
-    return enhancer.enhance(factor)
-
-
-def apply_warmth(img, value):
-    """Apply warmth/temperature adjustment (-100 to 100)"""
-    if value == 0:
-        return img
-
-    img_array = np.array(img, dtype=np.float32)
-
-    # Positive value = warmer (more red/yellow), negative = cooler (more blue)
-    factor = value / 100
-
-    # Adjust red and blue channels
-    img_array[:, :, 0] = np.clip(img_array[:, :, 0] * (1 + factor * 0.3), 0, 255)  # Red
-    img_array[:, :, 2] = np.clip(img_array[:, :, 2] * (1 - factor * 0.3), 0, 255)  # Blue
-
-    return Image.fromarray(img_array.astype(np.uint8))
-
-
-def apply_shadows(img, value):
-    """Lift shadows (-100 to 100)"""
-    if value == 0:
-        return img
-
-    img_array = np.array(img, dtype=np.float32)
-
-    # Create a mask for shadow areas (darker pixels)
-    luminance = 0.299 * img_array[:, :, 0] + 0.587 * img_array[:, :, 1] + 0.114 * img_array[:, :, 2]
-    shadow_mask = np.clip(1 - (luminance / 128), 0, 1)
-
-    # Apply shadow lift based on the mask
-    adjustment = value * 0.5 * shadow_mask[:, :, np.newaxis]
-    img_array = np.clip(img_array + adjustment, 0, 255)
-
-    return Image.fromarray(img_array.astype(np.uint8))
-
-
-def apply_white_point(img, value):
-    """Adjust white point (0-100)"""
-    if value == 0:
-        return img
-
-    img_array = np.array(img, dtype=np.float32)
-
-    # Brighten highlights
-    luminance = 0.299 * img_array[:, :, 0] + 0.587 * img_array[:, :, 1] + 0.114 * img_array[:, :, 2]
-    highlight_mask = np.clip((luminance - 128) / 128, 0, 1)
-
-    adjustment = value * 0.5 * highlight_mask[:, :, np.newaxis]
-    img_array = np.clip(img_array + adjustment, 0, 255)
-
-    return Image.fromarray(img_array.astype(np.uint8))
-
-
-def apply_hdr(img, value):
-    """Apply HDR effect (0-100)"""
-    if value == 0:
-        return img
-
-    # HDR simulation through tone mapping
-    strength = value / 100
-
-    # Apply detail enhancement
-    img_detail = img.filter(ImageFilter.UnsharpMask(radius=2, percent=int(150 * strength)))
-
-    # Reduce contrast slightly to compress dynamic range
-    enhancer = ImageEnhance.Contrast(img_detail)
-    img_compressed = enhancer.enhance(1 - 0.2 * strength)
-
-    # Blend original with processed
-    return Image.blend(img, img_compressed, strength)
-
-
-def enhance_photo(input_path, output_path, profile_name, verbose=True):
-    """Apply a profile to enhance a photo"""
-    if profile_name not in PROFILES:
-        raise ValueError(f"Profile '{profile_name}' not found. Available: {list(PROFILES.keys())}")
-
-    profile = PROFILES[profile_name]
-
-    # Load image
-    img = Image.open(input_path)
-
-    # Handle EXIF orientation to maintain correct rotation
-    try:
-        # Get EXIF data
-        exif = img.getexif()
-
-        # EXIF orientation tag is 274 (0x0112)
-        orientation = exif.get(274)
-
-        # Apply orientation transformations
-        if orientation == 2:
-            img = img.transpose(Image.FLIP_LEFT_RIGHT)
-        elif orientation == 3:
-            img = img.rotate(180, expand=True)
-        elif orientation == 4:
-            img = img.transpose(Image.FLIP_TOP_BOTTOM)
-        elif orientation == 5:
-            img = img.transpose(Image.FLIP_LEFT_RIGHT).rotate(90, expand=True)
-        elif orientation == 6:
-            img = img.rotate(270, expand=True)
-        elif orientation == 7:
-            img = img.transpose(Image.FLIP_LEFT_RIGHT).rotate(270, expand=True)
-        elif orientation == 8:
-            img = img.rotate(90, expand=True)
-    except (AttributeError, KeyError, IndexError):
-        # No EXIF data or orientation info, continue normally
-        pass
-
-    # Convert to RGB if necessary
-    if img.mode != 'RGB':
-        img = img.convert('RGB')
-
-    if verbose:
-        print(f"Applying profile: {profile.name}")
-
-    # Apply adjustments in order
-    if profile.hdr != 0:
-        img = apply_hdr(img, profile.hdr)
-        if verbose:
-            print(f"  - HDR: {profile.hdr}%")
-
-    if profile.brightness != 0:
-        img = apply_brightness(img, profile.brightness)
-        if verbose:
-            print(f"  - Brightness: {profile.brightness:+d}%")
-
-    if profile.contrast != 0:
-        img = apply_contrast(img, profile.contrast)
-        if verbose:
-            print(f"  - Contrast: {profile.contrast:+d}%")
-
-    if profile.white_point != 0:
-        img = apply_white_point(img, profile.white_point)
-        if verbose:
-            print(f"  - White Point: {profile.white_point}%")
-
-    if profile.shadows != 0:
-        img = apply_shadows(img, profile.shadows)
-        if verbose:
-            print(f"  - Shadows: {profile.shadows:+d}%")
-
-    if profile.saturation != 0:
-        img = apply_saturation(img, profile.saturation)
-        if verbose:
-            print(f"  - Saturation: {profile.saturation:+d}%")
-
-    if profile.warmth != 0:
-        img = apply_warmth(img, profile.warmth)
-        if verbose:
-            print(f"  - Warmth: {profile.warmth:+d}%")
-
-    # Preserve EXIF data when saving
-    try:
-        # Get original EXIF data
-        original_img = Image.open(input_path)
-        exif_data = original_img.getexif()
-
-        # Remove orientation tag since we've already applied it
-        if 274 in exif_data:
-            del exif_data[274]
-
-        # Save with preserved EXIF data
-        img.save(output_path, quality=95, exif=exif_data)
-    except Exception:
-        # If EXIF preservation fails, save normally
-        img.save(output_path, quality=95)
-
-    if verbose:
-        print(f"\nSaved to: {output_path}")
-
-
-def list_profiles():
-    """Display all available profiles"""
-    print("\nAvailable Profiles:")
-    print("=" * 60)
-    for name, profile in PROFILES.items():
-        print(f"\n{name}: {profile.name}")
-        print(f"  HDR: {profile.hdr}%, Brightness: {profile.brightness:+d}%")
-        print(f"  Contrast: {profile.contrast:+d}%, Saturation: {profile.saturation:+d}%")
-        print(f"  Shadows: {profile.shadows:+d}%, Warmth: {profile.warmth:+d}%")
-        print(f"  White Point: {profile.white_point}%")
-    print()
-
-
-def enhance_folder(input_folder, output_folder, profile_name, create_subfolder=True, verbose=True):
-    """
-    Apply a profile to all images in a folder
-
-    Args:
-        input_folder: Path to folder containing images
-        output_folder: Path to save enhanced images
-        profile_name: Name of the profile to apply
-        create_subfolder: If True, creates a subfolder named after the profile
-        verbose: If True, prints detailed progress
-    """
-    if profile_name not in PROFILES:
-        raise ValueError(f"Profile '{profile_name}' not found. Available: {list(PROFILES.keys())}")
-
-    input_path = Path(input_folder)
-    output_path = Path(output_folder)
-
-    if not input_path.exists():
-        raise ValueError(f"Input folder '{input_folder}' does not exist")
-
-    # Create output folder
-    if create_subfolder:
-        output_path = output_path / profile_name
-    output_path.mkdir(parents=True, exist_ok=True)
-
-    # Supported image formats
-    image_extensions = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.webp'}
-
-    # Find all images in the folder
-    image_files = []
-    for ext in image_extensions:
-        image_files.extend(input_path.glob(f'*{ext}'))
-        image_files.extend(input_path.glob(f'*{ext.upper()}'))
-
-    if not image_files:
-        print(f"No images found in '{input_folder}'")
-        return
-
-    print(f"\nFound {len(image_files)} images to process")
-    print(f"Profile: {PROFILES[profile_name].name}")
-    print(f"Output folder: {output_path}")
-    print("-" * 60)
-
-    # Process each image
-    success_count = 0
-    for i, img_file in enumerate(image_files, 1):
-        try:
-            output_file = output_path / f"{img_file.stem}_enhanced{img_file.suffix}"
-            print(f"\n[{i}/{len(image_files)}] Processing: {img_file.name}")
-
-            enhance_photo(str(img_file), str(output_file), profile_name, verbose=verbose)
-            success_count += 1
-
-        except Exception as e:
-            print(f"  ERROR: Failed to process {img_file.name}: {str(e)}")
-            continue
-
-    print("\n" + "=" * 60)
-    print(f"Batch processing complete!")
-    print(f"Successfully enhanced: {success_count}/{len(image_files)} images")
-    print(f"Output location: {output_path}")
-
-
-def main():
-    """Main CLI entry point"""
-    parser = argparse.ArgumentParser(
-        description='Photo Enhancement CLI Tool - Enhance photos with predefined profiles',
-        formatter_class=argparse.RawDescriptionHelpFormatter,
-        epilog='''
-Examples:
-  # List all available profiles
-  python photo_enhancer.py --list-profiles
-
-  # Enhance a single photo
-  python photo_enhancer.py -i photo.jpg -o enhanced.jpg -p HDR_Boost
-
-  # Enhance all photos in a folder
-  python photo_enhancer.py -f photos -o enhanced -p HDR_Boost
-
-  # Enhance folder without creating subfolders
-  python photo_enhancer.py -f photos -o enhanced -p Natural_Enhance --no-subfolder
-
-  # Quiet mode (less output)
-  python photo_enhancer.py -f photos -o enhanced -p Vibrant --quiet
-        '''
-    )
-
-    parser.add_argument('-i', '--input',
-                        help='Input image file')
-    parser.add_argument('-o', '--output',
-                        help='Output image file or folder')
-    parser.add_argument('-f', '--folder',
-                        help='Input folder containing images to process')
-    parser.add_argument('-p', '--profile',
-                        choices=list(PROFILES.keys()),
-                        help='Enhancement profile to apply')
-    parser.add_argument('--list-profiles',
-                        action='store_true',
-                        help='List all available profiles')
-    parser.add_argument('--no-subfolder',
-                        action='store_true',
-                        help='Do not create profile subfolders when processing folders')
-    parser.add_argument('-q', '--quiet',
-                        action='store_true',
-                        help='Quiet mode - minimal output')
-
-    args = parser.parse_args()
-
-    # Handle list profiles
-    if args.list_profiles:
-        list_profiles()
-        return 0
-
-    # Validate arguments
-    if args.folder and args.input:
-        print("Error: Cannot use both --input and --folder at the same time")
-        return 1
-
-    if not args.folder and not args.input:
-        print("Error: Must specify either --input or --folder")
-        parser.print_help()
-        return 1
-
-    if not args.profile:
-        print("Error: Must specify --profile")
-        parser.print_help()
-        return 1
-
-    if not args.output:
-        print("Error: Must specify --output")
-        return 1
-
-    verbose = not args.quiet
-
-    try:
-        # Process folder
-        if args.folder:
-            enhance_folder(
-                args.folder,
-                args.output,
-                args.profile,
-                create_subfolder=not args.no_subfolder,
-                verbose=verbose
-            )
-        # Process single file
-        else:
-            enhance_photo(args.input, args.output, args.profile, verbose=verbose)
-
-        return 0
-
-    except Exception as e:
-        print(f"\nError: {str(e)}", file=sys.stderr)
-        return 1
-
-
-if __name__ == "__main__":
+#!/usr/bin/env python3
+"""
+Photo Enhancement CLI Tool
+A command-line tool for batch photo enhancement with predefined profiles
+"""
+
+from pathlib import Path
+import argparse
+import collections
+import contextlib
+import fnmatch
+import importlib
+import io
+import json
+import os
+import queue
+import select
+import signal
+import struct
+import sys
+import threading
+import time
+
+
+class _LazyModule:
+    """
+    Stand-in for a module that is only imported when it is first used
+
+    NumPy, Pillow and the process pools take most of the start-up time, which
+    --help, --list-profiles and argument errors do not need. The first attribute
+    lookup imports the module and puts it in this module's globals in place of
+    the stand-in, so later lookups cost nothing extra.
+    """
+
+    def __init__(self, global_name, module_name):
+        self._global_name = global_name
+        self._module_name = module_name
+
+    def __getattr__(self, name):
+        module = importlib.import_module(self._module_name)
+        globals()[self._global_name] = module
+        return getattr(module, name)
+
+
+np = _LazyModule("np", "numpy")
+Image = _LazyModule("Image", "PIL.Image")
+ImageEnhance = _LazyModule("ImageEnhance", "PIL.ImageEnhance")
+ImageFilter = _LazyModule("ImageFilter", "PIL.ImageFilter")
+futures = _LazyModule("futures", "concurrent.futures")
+# Only needed for hashes and copies of whole files (hashlib loads OpenSSL)
+hashlib = _LazyModule("hashlib", "hashlib")
+shutil = _LazyModule("shutil", "shutil")
+
+
+# How PhotoProfile.hdr works: "unsharp" boosts detail with an unsharp mask and lowers the
+# global contrast, "local" is local tone mapping (see _local_tone_mapper)
+TONE_MAPPINGS = ("unsharp", "local")
+
+
+class PhotoProfile:
+    """Define a photo enhancement profile"""
+
+    def __init__(self, name, hdr=0, brightness=0, contrast=0, white_point=0,
+                 shadows=0, saturation=0, warmth=0, tone_mapping="unsharp"):
+        if tone_mapping not in TONE_MAPPINGS:
+            raise ValueError(f"Tone mapping '{tone_mapping}' not found. Available: {list(TONE_MAPPINGS)}")
+        self.name = name
+        self.hdr = hdr  # 0-100
+        self.tone_mapping = tone_mapping  # How HDR works, see TONE_MAPPINGS
+        self.brightness = brightness  # -100 to 100
+        self.contrast = contrast  # -100 to 100
+        self.white_point = white_point  # 0-100
+        self.shadows = shadows  # -100 to 100
+        self.saturation = saturation  # -100 to 100
+        self.warmth = warmth  # -100 to 100
+
+
+class AutoProfile(PhotoProfile):
+    """Profile whose adjustments are derived from each image it is applied to (see auto_profile)"""
+
+    def __init__(self, name=None, tone_mapping="unsharp", **adjustments):
+        # Adjustments are chosen per image, so any given here (e.g. by vars() copies) are ignored
+        super().__init__(name or AUTO_PROFILE, tone_mapping=tone_mapping)
+
+    def for_image(self, img):
+        """The PhotoProfile for one loaded image (PIL image or uint8 RGB array)"""
+        return auto_profile(img, self.name, self.tone_mapping)
+
+
+# Name of the automatic profile, usable wherever a profile name is (--auto on the command line)
+AUTO_PROFILE = "Auto"
+
+
+# Define your profiles
+PROFILES = {
+    "HDR_Boost": PhotoProfile(
+        name="HDR Boost",
+        hdr=100,
+        brightness=10,
+        contrast=10,
+        white_point=5,
+        shadows=25,
+        saturation=25,
+        warmth=10
+    ),
+    "Natural_Enhance": PhotoProfile(
+        name="Natural Enhance",
+        hdr=30,
+        brightness=5,
+        contrast=5,
+        saturation=15,
+        warmth=5
+    ),
+    "Vibrant": PhotoProfile(
+        name="Vibrant",
+        hdr=50,
+        brightness=8,
+        contrast=15,
+        saturation=40,
+        warmth=0
+    ),
+    "Portrait": PhotoProfile(
+        name="Portrait",
+        hdr=20,
+        brightness=12,
+        shadows=30,
+        saturation=10,
+        warmth=15
+    )
+}
+
+# Adjustments in processing order, with their display name and range
+ADJUSTMENTS = {
+    "hdr": ("HDR", 0, 100),
+    "brightness": ("Brightness", -100, 100),
+    "contrast": ("Contrast", -100, 100),
+    "white_point": ("White Point", 0, 100),
+    "shadows": ("Shadows", -100, 100),
+    "saturation": ("Saturation", -100, 100),
+    "warmth": ("Warmth", -100, 100),
+}
+
+
+def apply_brightness(img, value):
+    """Apply brightness adjustment (-100 to 100)"""
+    factor = 1 + (value / 100)
+    enhancer = ImageEnhance.Brightness(img)
+    return enhancer.enhance(factor)
+
+
+def apply_contrast(img, value):
+    """Apply contrast adjustment (-100 to 100)"""
+    factor = 1 + (value / 100)
+    enhancer = ImageEnhance.Contrast(img)
+    return enhancer.enhance(factor)
+
+
+def apply_saturation(img, value):
+    """Apply saturation adjustment (-100 to 100)"""
+    factor = 1 + (value / 100)
+    enhancer = ImageEnhance.Color(img)
+    return enhancer.enhance(factor)
+
+
+def apply_warmth(img, value):
+    """Apply warmth/temperature adjustment (-100 to 100)"""
+    if value == 0:
+        return img
+
+    img_array = np.array(img, dtype=np.float32)
+
+    # Positive value = warmer (more red/yellow), negative = cooler (more blue)
+    factor = value / 100
+
+    # Adjust red and blue channels
+    img_array[:, :, 0] = np.clip(img_array[:, :, 0] * (1 + factor * 0.3), 0, 255)  # Red
+    img_array[:, :, 2] = np.clip(img_array[:, :, 2] * (1 - factor * 0.3), 0, 255)  # Blue
+
+    return Image.fromarray(img_array.astype(np.uint8))
+
+
+def apply_shadows(img, value):
+    """Lift shadows (-100 to 100)"""
+    if value == 0:
+        return img
+
+    img_array = np.array(img, dtype=np.float32)
+
+    # Create a mask for shadow areas (darker pixels)
+    luminance = 0.299 * img_array[:, :, 0] + 0.587 * img_array[:, :, 1] + 0.114 * img_array[:, :, 2]
+    shadow_mask = np.clip(1 - (luminance / 128), 0, 1)
+
+    # Apply shadow lift based on the mask
+    adjustment = value * 0.5 * shadow_mask[:, :, np.newaxis]
+    img_array = np.clip(img_array + adjustment, 0, 255)
+
+    return Image.fromarray(img_array.astype(np.uint8))
+
+
+def apply_white_point(img, value):
+    """Adjust white point (0-100)"""
+    if value == 0:
+        return img
+
+    img_array = np.array(img, dtype=np.float32)
+
+    # Brighten highlights
+    luminance = 0.299 * img_array[:, :, 0] + 0.587 * img_array[:, :, 1] + 0.114 * img_array[:, :, 2]
+    highlight_mask = np.clip((luminance - 128) / 128, 0, 1)
+
+    adjustment = value * 0.5 * highlight_mask[:, :, np.newaxis]
+    img_array = np.clip(img_array + adjustment, 0, 255)
+
+    return Image.fromarray(img_array.astype(np.uint8))
+
+
+def apply_hdr(img, value):
+    """Apply HDR effect (0-100) with the "unsharp" tone mapping"""
+    if value == 0:
+        return img
+
+    # HDR simulation through tone mapping
+    strength = value / 100
+
+    # Apply detail enhancement
+    img_detail = img.filter(ImageFilter.UnsharpMask(radius=2, percent=int(150 * strength)))
+
+    # Reduce contrast slightly to compress dynamic range
+    enhancer = ImageEnhance.Contrast(img_detail)
+    img_compressed = enhancer.enhance(1 - 0.2 * strength)
+
+    # Blend original with processed
+    return Image.blend(img, img_compressed, strength)
+
+
+def apply_local_tone_mapping(img, value):
+    """Apply HDR effect (0-100) with the "local" tone mapping"""
+    if value == 0:
+        return img
+    src = np.asarray(img)
+    tone = _local_tone_mapper(lambda y0, y1: src[y0:y1], img.height, img.width, value)
+    out = np.empty_like(src)
+    rows = max(1, ENGINE_CHUNK_PIXELS // img.width)
+    for y in range(0, img.height, rows):
+        out[y:y + rows] = tone(y, src[y:y + rows])
+    return Image.fromarray(out)
+
+
+def _luminance(arr):
+    """Rec. 601 luminance of a float32 RGB array, as used by the shadow/highlight masks"""
+    return arr @ np.array(LUMA_WEIGHTS, dtype=np.float32)
+
+
+def _mean_level(chunks, pixels):
+    """Mean luminance of a sequence of RGB chunks, rounded to a level like PIL's contrast pivot"""
+    total = 0.0
+    for chunk in chunks:
+        total += float(_luminance(chunk).sum(dtype=np.float64))
+    return int(total / pixels + 0.5)
+
+
+def _fused_hdr(src, detail, profile, hdr_mean):
+    """HDR blend for one chunk of rows, returned as float32"""
+    x = src.astype(np.float32)
+
+    if detail is not None:
+        strength = profile.hdr / 100
+        factor = 1 - 0.2 * strength
+        # Compress the sharpened detail layer around its mean, then blend it over the original
+        compressed = detail.astype(np.float32)
+        compressed *= factor
+        compressed += hdr_mean * (1 - factor)
+        np.clip(compressed, 0, 255, out=compressed)
+        compressed *= strength
+        x *= 1 - strength
+        x += compressed
+
+    return x
+
+
+def _fused_brightness(x, profile):
+    """Brightness on a float32 chunk, in place"""
+    if profile.brightness != 0:
+        x *= 1 + profile.brightness / 100
+        np.clip(x, 0, 255, out=x)
+    return x
+
+
+def _fused_color(x, profile, contrast_mean):
+    """Contrast, white point, shadows, saturation and warmth on a float32 chunk, in place"""
+    if profile.contrast != 0:
+        factor = 1 + profile.contrast / 100
+        x *= factor
+        x += contrast_mean * (1 - factor)
+        np.clip(x, 0, 255, out=x)
+
+    if profile.white_point != 0:
+        mask = _luminance(x)
+        mask -= 128
+        mask *= 1 / 128
+        np.clip(mask, 0, 1, out=mask)
+        mask *= profile.white_point * 0.5
+        x += mask[:, :, np.newaxis]
+        np.clip(x, 0, 255, out=x)
+
+    if profile.shadows != 0:
+        # value * 0.5 * clip(1 - luminance / 128, 0, 1), folded into one scale and clip
+        mask = _luminance(x)
+        mask *= -1 / 128
+        mask += 1
+        np.clip(mask, 0, 1, out=mask)
+        mask *= profile.shadows * 0.5
+        x += mask[:, :, np.newaxis]
+        np.clip(x, 0, 255, out=x)
+
+    if profile.saturation != 0:
+        factor = 1 + profile.saturation / 100
+        gray = _luminance(x)[:, :, np.newaxis]
+        x -= gray
+        x *= factor
+        x += gray
+        np.clip(x, 0, 255, out=x)
+
+    if profile.warmth != 0:
+        factor = profile.warmth / 100
+        x *= np.array([1 + factor * 0.3, 1, 1 - factor * 0.3], dtype=np.float32)
+        np.clip(x, 0, 255, out=x)
+
+    return x
+
+
+def _quantize(x):
+    """Round a float32 chunk to its final 0-255 levels, in place"""
+    np.clip(x, 0, 255, out=x)
+    np.rint(x, out=x)
+    return x
+
+
+# Per-chunk arithmetic of an array engine: hdr(src, detail, profile, hdr_mean) blends a
+# uint8 chunk with its unsharp detail layer (None without one) into the working type,
+# brightness(x, profile) runs in place, mean_level(chunks, pixels) gives the contrast
+# pivot and quantize(x) rounds to 0-255
+_Kernel = collections.namedtuple("_Kernel", ["hdr", "brightness", "mean_level", "quantize"])
+
+FLOAT_KERNEL = _Kernel(_fused_hdr, _fused_brightness, _mean_level, _quantize)
+
+
+def _hdr_detail(src, profile, pool=None, bands=1):
+    """Sharpened detail layer used by the HDR stage, optionally filtered in bands on a thread pool"""
+    unsharp = ImageFilter.UnsharpMask(radius=2, percent=int(150 * profile.hdr / 100))
+    with _stage("hdr_detail"):
+        if pool is None or bands <= 1:
+            return np.asarray(Image.fromarray(src).filter(unsharp))
+
+        # Like tiles, each band is filtered with a halo of HDR_HALO rows on both sides
+        detail = np.empty_like(src)
+        rows = -(-len(src) // bands)
+
+        def filter_band(y0):
+            top, bottom = max(0, y0 - HDR_HALO), min(len(src), y0 + rows + HDR_HALO)
+            band = np.asarray(Image.fromarray(src[top:bottom]).filter(unsharp))
+            detail[y0:y0 + rows] = band[y0 - top:y0 - top + rows]
+
+        list(pool.map(filter_band, range(0, len(src), rows)))
+        return detail
+
+
+def _box_mean(x, radius):
+    """Mean of x over a (2 * radius + 1)^2 window, shrunk at the borders"""
+    for axis in (0, 1):
+        padded = np.cumsum(np.insert(x, 0, 0, axis=axis), axis=axis, dtype=np.float64)
+        size = x.shape[axis]
+        low = np.clip(np.arange(size) - radius, 0, size)
+        high = np.clip(np.arange(size) + radius + 1, 0, size)
+        x = (np.take(padded, high, axis=axis) - np.take(padded, low, axis=axis))
+        x /= np.expand_dims(high - low, 1 - axis)
+    return x.astype(np.float32)
+
+
+def _log_luminance(src):
+    """Natural log of 1 + the luminance of a uint8 RGB array, as float32"""
+    return np.log1p(_luminance(src.astype(np.float32)))
+
+
+def _interpolation(size, guide_size):
+    """Indices and weights for linear upsampling of guide_size samples to size positions"""
+    position = (np.arange(size, dtype=np.float32) + 0.5) * (guide_size / size) - 0.5
+    np.clip(position, 0, guide_size - 1, out=position)
+    low = position.astype(np.intp)
+    high = np.minimum(low + 1, guide_size - 1)
+    return low, high, position - low
+
+
+def _local_tone_mapper(read, height, width, hdr):
+    """
+    Local tone mapping for HDR: compress the large-scale luminance, keep the detail
+
+    A self-guided filter on the log luminance splits an image into an edge-preserving
+    base layer and detail. The filter runs on a guide of at most TONE_GUIDE_SIZE pixels,
+    the block-averaged log luminance, and only its linear coefficients are upsampled
+    (the fast guided filter), so the full-size cost is a few operations per pixel. The
+    base is compressed by up to TONE_COMPRESSION towards its bright end, which lifts
+    shadows while highlights stay put, and the detail is boosted by up to
+    TONE_DETAIL_BOOST, both scaled by hdr (0-100); colors keep their ratios.
+
+    Args:
+        read: read(y0, y1) returns the uint8 RGB source rows [y0, y1), read in strips
+        height, width: Image size
+
+    Returns:
+        tone(y, src) mapping the uint8 rows of src, starting at row y, to new uint8 rows
+    """
+    with _stage("tone_guide"):
+        block = max(1, -(-max(height, width) // TONE_GUIDE_SIZE))
+        columns = np.arange(0, width, block)
+        guide = np.empty((-(-height // block), len(columns)), dtype=np.float32)
+        for i, y0 in enumerate(range(0, height, block)):
+            strip = _log_luminance(read(y0, min(y0 + block, height)))
+            guide[i] = np.add.reduceat(strip.sum(axis=0), columns)
+            guide[i] /= len(strip) * np.diff(columns, append=width)
+
+        # Guided filter with the guide as its own guidance image
+        mean = _box_mean(guide, TONE_RADIUS)
+        variance = np.maximum(_box_mean(guide * guide, TONE_RADIUS) - mean * mean, 0)
+        slope = variance / (variance + TONE_EPSILON)
+        offset = mean * (1 - slope)
+        slope, offset = _box_mean(slope, TONE_RADIUS), _box_mean(offset, TONE_RADIUS)
+        white = float(np.percentile(slope * guide + offset, TONE_WHITE_PERCENTILE))
+
+    strength = hdr / 100
+    compression = np.float32(1 - TONE_COMPRESSION * strength)
+    boost = np.float32(1 + TONE_DETAIL_BOOST * strength)
+    columns = _interpolation(width, guide.shape[1])
+    rows = _interpolation(height, guide.shape[0])
+
+    def upsample(coefficients, y, count):
+        low, high, weight = (part[y:y + count] for part in rows)
+        band = coefficients[low] * (1 - weight)[:, np.newaxis]
+        band += coefficients[high] * weight[:, np.newaxis]
+        low, high, weight = columns
+        result = band[:, low] * (1 - weight)
+        result += band[:, high] * weight
+        return result
+
+    def tone(y, src):
+        log_luma = _log_luminance(src)
+        base = upsample(slope, y, len(src))
+        base *= log_luma
+        base += upsample(offset, y, len(src))
+        # log gain = (base - white) * compression + white + (log_luma - base) * boost - log_luma
+        gain = log_luma * (boost - 1)
+        gain += base * (compression - boost)
+        gain += np.float32(white * (1 - compression))
+        np.exp(gain, out=gain)
+        # Scale 1 + value so black stays black and colors keep their ratios
+        x = src.astype(np.float32)
+        x += 1
+        x *= gain[:, :, np.newaxis]
+        x -= 1
+        return _quantize(x).astype(np.uint8)
+
+    return tone
+
+
+def _ordered_map(function, items, pool=None, window=1):
+    """
+    map() on a thread pool, yielding results in order
+
+    At most window items are in flight, so items is consumed lazily and only a
+    bounded number of results wait in memory. Without a pool this is plain map().
+    """
+    if pool is None:
+        yield from map(function, items)
+        return
+    pending = collections.deque()
+    for item in items:
+        pending.append(pool.submit(function, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _render(read, write, height, width, profile, finisher, tile_rows=None, kernel=FLOAT_KERNEL,
+            threads=1):
+    """
+    Drive an array engine over an image, optionally in horizontal tiles
+
+    Pixels are processed in chunks of rows small enough to stay in cache: each
+    chunk is converted to float32 once, goes through every stage and is quantized
+    once. The HDR unsharp mask is the only neighbourhood operation; in tiled mode
+    each tile is read with a halo of HDR_HALO rows so its detail layer matches the
+    untiled one exactly. The two contrast pivots are whole-image means, so the
+    chunks are visited once per pivot before the final pass (tiles are re-read
+    for each visit, a single tile is kept in memory).
+
+    With threads > 1 the chunks, and bands of the HDR detail layer, are processed
+    on a thread pool (NumPy and Pillow release the GIL). Chunks are still reduced
+    and written in order, so the result is identical to a single-threaded run.
+
+    Args:
+        read: read(y0, y1) returns the uint8 RGB source rows [y0, y1). Rows are only
+            read before they are written, so write may store into the source.
+        write: write(y, rows) stores a chunk of final, rounded values at row y
+        height, width: Image size
+        profile: PhotoProfile to apply
+        finisher: finisher(pivot) returns a function mapping an HDR-blended chunk
+            to its final values, given the contrast pivot
+        tile_rows: Rows per tile; None processes the image as a single tile
+        kernel: Chunk arithmetic, FLOAT_KERNEL or FIXED_KERNEL
+        threads: Number of threads to process chunks on
+    """
+    with (futures.ThreadPoolExecutor(threads) if threads > 1 else contextlib.nullcontext()) as pool:
+        _render_chunks(read, write, height, width, profile, finisher, tile_rows, kernel, pool, threads)
+
+
+def _render_chunks(read, write, height, width, profile, finisher, tile_rows, kernel, pool, threads):
+    """_render with an optional thread pool of the given size"""
+    rows = max(1, ENGINE_CHUNK_PIXELS // width)
+    unsharp = profile.hdr != 0 and profile.tone_mapping == "unsharp"
+    halo = HDR_HALO if unsharp else 0
+    tone = None
+    if profile.hdr != 0 and profile.tone_mapping == "local":
+        tone = _local_tone_mapper(read, height, width, profile.hdr)
+    if tile_rows is None or tile_rows >= height:
+        tile_rows = height
+    else:
+        # Whole chunks per tile keep the pivot sums identical to the untiled run
+        tile_rows = max(tile_rows // rows, -(-halo // rows), 1) * rows
+
+    def load_tiles():
+        prev_src, prev_top = None, 0
+        for y0 in range(0, height, tile_rows):
+            y1 = min(y0 + tile_rows, height)
+            top, bottom = max(0, y0 - halo), min(height, y1 + halo)
+            if prev_src is not None and top < y0:
+                # The rows above this tile may already hold output, take them from the last tile
+                src = np.concatenate([prev_src[top - prev_top:y0 - prev_top], read(y0, bottom)])
+            else:
+                src = read(top, bottom)
+            detail = _hdr_detail(src, profile, pool, threads)[y0 - top:y1 - top] if unsharp else None
+            prev_src, prev_top = src, top
+            yield y0, src[y0 - top:y1 - top], detail
+
+    tiles = load_tiles
+    if tile_rows == height:
+        single_tile = list(load_tiles())
+        tiles = lambda: single_tile
+
+    def chunks():
+        for y0, src, detail in tiles():
+            for y in range(0, len(src), rows):
+                yield (y0 + y, src[y:y + rows],
+                       None if detail is None else detail[y:y + rows])
+
+    with _stage("pixels"):
+        hdr_mean = 0
+        if unsharp:
+            # The detail layer converted to the working type like a source chunk without HDR
+            hdr_mean = kernel.mean_level((kernel.hdr(detail, None, profile, 0) for _, _, detail in chunks()),
+                                         height * width)
+
+        def hdr(y, src, detail):
+            if tone is not None:
+                src = tone(y, src)
+            return kernel.hdr(src, detail, profile, hdr_mean)
+
+        def parallel(function, items):
+            return _ordered_map(function, items, pool, 2 * threads)
+
+        pivot = 0
+        if profile.contrast != 0:
+            pivot = kernel.mean_level(parallel(lambda chunk: kernel.brightness(hdr(*chunk), profile),
+                                               chunks()), height * width)
+
+        finish = finisher(pivot)
+
+        def render(chunk):
+            y, src, detail = chunk
+            return y, kernel.quantize(finish(hdr(y, src, detail)))
+
+        for y, x in parallel(render, chunks()):
+            write(y, x)
+
+
+def _fused_finisher(profile, backend=None):
+    """Finisher for the fused engine: brightness and the color stages, computed directly"""
+    color = backend_ops(backend)["color"]
+
+    def finisher(pivot):
+        return lambda x: color(_fused_brightness(x, profile), profile, pivot)
+    return finisher
+
+
+def _render_array(src, profile, finisher, out=None, tile_rows=None, kernel=FLOAT_KERNEL, threads=1):
+    """Run an array engine from one uint8 RGB array into another"""
+    if out is None:
+        out = np.empty_like(src)
+
+    def write(y, x):
+        out[y:y + len(x)] = x
+
+    _render(lambda y0, y1: src[y0:y1], write, src.shape[0], src.shape[1], profile,
+            finisher, tile_rows, kernel, threads)
+    return out
+
+
+def _render_image(img, profile, finisher, tile_rows=None, kernel=FLOAT_KERNEL, threads=1):
+    """Run an array engine over an RGB PIL image, writing the result back into it"""
+    width, height = img.size
+
+    def read(y0, y1):
+        return np.asarray(img.crop((0, y0, width, y1)))
+
+    def write(y, x):
+        img.paste(Image.fromarray(x.astype(np.uint8)), (0, y))
+
+    _render(read, write, height, width, profile, finisher, tile_rows, kernel, threads)
+    return img
+
+
+def render_fused(src, profile, out=None, tile_rows=None, backend=None, threads=1):
+    """
+    Run every adjustment of a profile over a uint8 RGB array in one fused float32 pass
+
+    Args:
+        src: uint8 array of shape (height, width, 3)
+        profile: PhotoProfile to apply
+        out: Optional uint8 array of the same shape to write the result into
+        tile_rows: Optional tile height for bounded-memory processing
+        backend: Compute backend for the color stages (see BACKENDS)
+        threads: Number of threads to process the image on
+    """
+    return _render_array(src, profile, _fused_finisher(profile, backend), out, tile_rows,
+                         threads=threads)
+
+
+def _fixed(value, bits=None):
+    """A real number as a fixed-point integer with FIXED_FACTOR_BITS (or the given) fraction bits"""
+    if bits is None:
+        bits = FIXED_FACTOR_BITS
+    return int(round(value * (1 << bits)))
+
+
+def _fixed_store(v, w):
+    """Clip an int32 result to 0-FIXED_MAX and store it back into the uint16 chunk v"""
+    np.clip(w, 0, FIXED_MAX, out=w)
+    np.copyto(v, w, casting='unsafe')
+    return v
+
+
+def _fixed_scale(v, factor, offset=0):
+    """v * factor + offset for a uint16 fixed-point chunk, in place, rounding to nearest
+
+    The offset has FIXED_VALUE_BITS + FIXED_FACTOR_BITS fraction bits. The product is
+    formed in int32 and clipped to 0-FIXED_MAX before it is stored back.
+    """
+    w = np.multiply(v, _fixed(factor), dtype=np.int32)
+    w += offset + (1 << (FIXED_FACTOR_BITS - 1))
+    w >>= FIXED_FACTOR_BITS
+    return _fixed_store(v, w)
+
+
+def _fixed_luminance(v):
+    """Rec. 601 luminance of a fixed-point RGB chunk, as int32 in the same fixed-point format"""
+    luminance = np.multiply(v[:, :, 0], FIXED_LUMA_WEIGHTS[0], dtype=np.int32)
+    luminance += np.multiply(v[:, :, 1], FIXED_LUMA_WEIGHTS[1], dtype=np.int32)
+    luminance += np.multiply(v[:, :, 2], FIXED_LUMA_WEIGHTS[2], dtype=np.int32)
+    luminance += 1 << (FIXED_FACTOR_BITS - 1)
+    luminance >>= FIXED_FACTOR_BITS
+    return luminance
+
+
+def _fixed_mean_level(chunks, pixels):
+    """_mean_level for fixed-point chunks, summed exactly in integers"""
+    total = 0
+    for chunk in chunks:
+        total += int(_fixed_luminance(chunk).sum(dtype=np.int64))
+    unit = pixels << FIXED_VALUE_BITS
+    return (total + unit // 2) // unit
+
+
+def _fixed_hdr(src, detail, profile, hdr_mean):
+    """HDR blend for one chunk of rows, returned as uint16 fixed point"""
+    if detail is None:
+        v = src.astype(np.uint16)
+        v <<= FIXED_VALUE_BITS
+        return v
+
+    strength = profile.hdr / 100
+    factor = 1 - 0.2 * strength
+    # src * (1 - strength) + strength * (detail * factor + hdr_mean * (1 - factor)): the
+    # compressed detail is a weighted mean of two 0-255 values, so it needs no clipping
+    bits = FIXED_VALUE_BITS + FIXED_FACTOR_BITS
+    w = np.multiply(src, _fixed(1 - strength, bits), dtype=np.int32)
+    w += np.multiply(detail, _fixed(strength * factor, bits), dtype=np.int32)
+    w += _fixed(strength * (1 - factor) * hdr_mean, bits) + (1 << (FIXED_FACTOR_BITS - 1))
+    w >>= FIXED_FACTOR_BITS
+    return w.astype(np.uint16)
+
+
+def _fixed_brightness(v, profile):
+    """Brightness on a fixed-point chunk, in place"""
+    if profile.brightness != 0:
+        _fixed_scale(v, 1 + profile.brightness / 100)
+    return v
+
+
+def _fixed_mask_add(v, mask, amount):
+    """Add amount * mask to every channel, mask being a 0-1 weight in 0-128 fixed-point levels"""
+    # mask is at most 2 ** 15 and the amount at most 50 * 2 ** 9, so the product fits int32
+    mask *= _fixed(amount, FIXED_VALUE_BITS + 1)
+    mask += 1 << 15
+    mask >>= 16
+    _fixed_store(v, np.add(v, mask[:, :, np.newaxis], dtype=np.int32))
+
+
+def _fixed_color(v, profile, contrast_mean):
+    """Contrast, white point, shadows, saturation and warmth on a fixed-point chunk, in place"""
+    half = 128 << FIXED_VALUE_BITS
+
+    if profile.contrast != 0:
+        factor = 1 + profile.contrast / 100
+        _fixed_scale(v, factor, _fixed(contrast_mean * (1 - factor), FIXED_VALUE_BITS + FIXED_FACTOR_BITS))
+
+    if profile.white_point != 0:
+        mask = _fixed_luminance(v)
+        mask -= half
+        np.clip(mask, 0, half, out=mask)
+        _fixed_mask_add(v, mask, profile.white_point * 0.5)
+
+    if profile.shadows != 0:
+        mask = _fixed_luminance(v)
+        np.subtract(half, mask, out=mask)
+        np.clip(mask, 0, half, out=mask)
+        _fixed_mask_add(v, mask, profile.shadows * 0.5)
+
+    if profile.saturation != 0:
+        gray = _fixed_luminance(v)[:, :, np.newaxis]
+        w = np.subtract(v, gray, dtype=np.int32)
+        w *= _fixed(1 + profile.saturation / 100)
+        w += 1 << (FIXED_FACTOR_BITS - 1)
+        w >>= FIXED_FACTOR_BITS
+        w += gray
+        _fixed_store(v, w)
+
+    if profile.warmth != 0:
+        factor = profile.warmth / 100
+        w = np.multiply(v, np.array([_fixed(1 + factor * 0.3), 1 << FIXED_FACTOR_BITS,
+                                     _fixed(1 - factor * 0.3)], dtype=np.int32), dtype=np.int32)
+        w += 1 << (FIXED_FACTOR_BITS - 1)
+        w >>= FIXED_FACTOR_BITS
+        _fixed_store(v, w)
+
+    return v
+
+
+def _fixed_quantize(v):
+    """Round a fixed-point chunk to uint8 levels"""
+    v += 1 << (FIXED_VALUE_BITS - 1)
+    v >>= FIXED_VALUE_BITS
+    return v.astype(np.uint8)
+
+
+def _fixed_finisher(profile):
+    """Finisher for the fixed engine: the fused stages in integer arithmetic"""
+    def finisher(pivot):
+        return lambda v: _fixed_color(_fixed_brightness(v, profile), profile, pivot)
+    return finisher
+
+
+FIXED_KERNEL = _Kernel(_fixed_hdr, _fixed_brightness, _fixed_mean_level, _fixed_quantize)
+
+
+def render_fixed(src, profile, out=None, tile_rows=None, threads=1):
+    """
+    Run every adjustment of a profile over a uint8 RGB array in fixed-point integer arithmetic
+
+    Same stages as render_fused, with pixel values held as uint16 with FIXED_VALUE_BITS
+    fraction bits instead of float32 (half the memory traffic); products are formed in
+    int32 and clipped back. Results match the fused engine within one level.
+    """
+    return _render_array(src, profile, _fixed_finisher(profile), out, tile_rows, FIXED_KERNEL, threads)
+
+
+def _profile_params(profile):
+    """
+    The adjustment values of a profile, and its tone mapping unless it is the default, as a plain dict
+
+    Auto profiles have no fixed values; they add AUTO_VERSION instead.
+    """
+    params = {name: getattr(profile, name) for name in ADJUSTMENTS}
+    if isinstance(profile, AutoProfile):
+        params["auto"] = AUTO_VERSION
+    if profile.tone_mapping != TONE_MAPPINGS[0]:
+        params["tone_mapping"] = profile.tone_mapping
+    return params
+
+
+def build_lut(profile, size=None, pivot=128):
+    """
+    Evaluate the pointwise stages of a profile on a size x size x size RGB grid
+
+    Brightness, contrast, white point, shadows, saturation and warmth only depend on
+    the pixel value, apart from the contrast pivot (the image's mean level), which is
+    passed in. HDR is a neighbourhood operation and is not part of the LUT.
+
+    Returns:
+        float32 array of shape (size, size, size, 3) indexed as [r, g, b], values 0-255
+    """
+    size = size or LUT_SIZE
+    levels = np.linspace(0, 255, size, dtype=np.float32)
+    r, g, b = np.meshgrid(levels, levels, levels, indexing='ij')
+    grid = np.stack([r, g, b], axis=-1).reshape(size * size, size, 3)
+    lut = _fused_color(_fused_brightness(grid, profile), profile, pivot)
+    return lut.reshape(size, size, size, 3)
+
+
+def _lut_params(profile):
+    """The profile parameters a LUT depends on (HDR is not part of it)"""
+    return {name: value for name, value in _profile_params(profile).items()
+            if name not in ("hdr", "tone_mapping")}
+
+
+def _lut_cache_key(profile, size, pivot):
+    """Cache key built from the profile parameters, LUT size and contrast pivot"""
+    params = _lut_params(profile)
+    if profile.contrast == 0:
+        pivot = None
+    key = json.dumps({"params": params, "size": size, "pivot": pivot, "version": LUT_VERSION},
+                     sort_keys=True)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def get_lut(profile, size=None, pivot=128):
+    """
+    Return the LUT for a profile, from the memory cache, the disk cache or freshly built
+
+    The memory cache keeps the LUT_MEMORY_CACHE_SIZE most recently used LUTs. Only
+    the LUTs of built-in profiles are cached on disk: auto and custom profiles
+    change from image to image and would fill the cache with LUTs used once.
+    """
+    size = size or LUT_SIZE
+    key = _lut_cache_key(profile, size, pivot)
+    with _LUT_CACHE_LOCK:
+        lut = _LUT_CACHE.get(key)
+        if lut is not None:
+            _LUT_CACHE.move_to_end(key)
+            return lut
+
+    params = _lut_params(profile)
+    on_disk = any(params == _lut_params(builtin) for builtin in PROFILES.values())
+    cache_file = LUT_CACHE_DIR / f"{key}.npy"
+    with _stage("lut"):
+        lut = None
+        if on_disk:
+            try:
+                lut = np.load(cache_file)
+            except (OSError, ValueError):
+                pass
+        if lut is None:
+            lut = build_lut(profile, size, pivot)
+            if on_disk:
+                _save_lut(cache_file, lut)
+
+    with _LUT_CACHE_LOCK:
+        _LUT_CACHE[key] = lut
+        while len(_LUT_CACHE) > LUT_MEMORY_CACHE_SIZE:
+            _LUT_CACHE.popitem(last=False)
+    return lut
+
+
+def _save_lut(cache_file, lut):
+    """Write a LUT to the disk cache, which is only an optimisation: errors are ignored"""
+    try:
+        LUT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary name first so concurrent workers never read a partial file
+        tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_file, 'wb') as f:
+            np.save(f, lut)
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        pass
+
+
+def apply_lut(x, lut):
+    """Map a float32 RGB chunk (values 0-255) through a 3D LUT with trilinear interpolation"""
+    size = lut.shape[0]
+    flat = lut.reshape(-1, 3)
+
+    coords = x * ((size - 1) / 255)
+    index = np.minimum(coords.astype(np.int32), size - 2)
+    coords -= index
+    fr, fg, fb = coords[..., 0:1], coords[..., 1:2], coords[..., 2:3]
+    base = (index[..., 0] * size + index[..., 1]) * size + index[..., 2]
+
+    def corner(offset):
+        return np.take(flat, base + offset, axis=0)
+
+    # Interpolate along blue, then green, then red
+    step_r, step_g = size * size, size
+    c00 = corner(0)
+    c00 += (corner(1) - c00) * fb
+    c01 = corner(step_g)
+    c01 += (corner(step_g + 1) - c01) * fb
+    c10 = corner(step_r)
+    c10 += (corner(step_r + 1) - c10) * fb
+    c11 = corner(step_r + step_g)
+    c11 += (corner(step_r + step_g + 1) - c11) * fb
+    c00 += (c01 - c00) * fg
+    c10 += (c11 - c10) * fg
+    c00 += (c10 - c00) * fr
+    return c00
+
+
+def _lut_finisher(profile, size=None):
+    """Finisher for the LUT engine: one lookup in the LUT selected by the contrast pivot"""
+    def finisher(pivot):
+        lut = get_lut(profile, size, pivot)
+        return lambda x: apply_lut(x, lut)
+    return finisher
+
+
+def render_lut(src, profile, out=None, size=None, tile_rows=None, threads=1):
+    """
+    Apply a profile to a uint8 RGB array through its cached 3D LUT
+
+    HDR runs first as in the fused engine; the image mean entering the contrast
+    stage is measured and selects the LUT, which then replaces all other stages.
+    """
+    return _render_array(src, profile, _lut_finisher(profile, size), out, tile_rows, threads=threads)
+
+
+def export_cube(profile_name, output_path, size=None, pivot=128):
+    """
+    Write the LUT of a profile as an Adobe/Resolve .cube file
+
+    A .cube file cannot depend on the image, so contrast pivots on a fixed level
+    (mid-grey by default) and HDR, which is not a per-pixel operation, is left out.
+    """
+    profile = get_profile(profile_name)
+    size = size or LUT_SIZE
+    lut = get_lut(profile, size, pivot) / 255
+
+    with open(output_path, 'w') as f:
+        f.write(f'TITLE "{profile.name}"\n')
+        f.write(f"LUT_3D_SIZE {size}\n")
+        f.write("DOMAIN_MIN 0.0 0.0 0.0\n")
+        f.write("DOMAIN_MAX 1.0 1.0 1.0\n")
+        # .cube files list entries with red changing fastest
+        for rgb in lut.transpose(2, 1, 0, 3).reshape(-1, 3):
+            f.write(f"{rgb[0]:.6f} {rgb[1]:.6f} {rgb[2]:.6f}\n")
+
+
+def _numexpr_clip(x, low=0, high=255):
+    """Clip a float32 array in place with numexpr"""
+    import numexpr
+    low, high = np.float32(low), np.float32(high)
+    numexpr.evaluate("where(x < low, low, where(x > high, high, x))", out=x, casting='same_kind')
+    return x
+
+
+def _numexpr_luminance(arr):
+    """Rec. 601 luminance of a float32 RGB array with numexpr"""
+    import numexpr
+    r, g, b = arr[:, :, 0], arr[:, :, 1], arr[:, :, 2]
+    wr, wg, wb = np.array(LUMA_WEIGHTS, dtype=np.float32)
+    return numexpr.evaluate("r * wr + g * wg + b * wb")
+
+
+def _numexpr_mask_add(arr, mask):
+    """Add a per-pixel float32 amount to every channel of arr and clip, in place"""
+    import numexpr
+    mask = mask[:, :, np.newaxis]
+    numexpr.evaluate("arr + mask", out=arr, casting='same_kind')
+    return _numexpr_clip(arr)
+
+
+def _numexpr_white_point(img, value):
+    """apply_white_point with numexpr"""
+    if value == 0:
+        return img
+    import numexpr
+    img_array = np.array(img, dtype=np.float32)
+    luminance = _numexpr_luminance(img_array)
+    amount = np.float32(value * 0.5 / 128)
+    mask = numexpr.evaluate("where(luminance > 128, (luminance - 128) * amount, 0)")
+    return Image.fromarray(_numexpr_mask_add(img_array, mask).astype(np.uint8))
+
+
+def _numexpr_shadows(img, value):
+    """apply_shadows with numexpr"""
+    if value == 0:
+        return img
+    import numexpr
+    img_array = np.array(img, dtype=np.float32)
+    luminance = _numexpr_luminance(img_array)
+    amount = np.float32(value * 0.5 / 128)
+    mask = numexpr.evaluate("where(luminance < 128, (128 - luminance) * amount, 0)")
+    return Image.fromarray(_numexpr_mask_add(img_array, mask).astype(np.uint8))
+
+
+def _numexpr_warmth(img, value):
+    """apply_warmth with numexpr"""
+    if value == 0:
+        return img
+    import numexpr
+    img_array = np.array(img, dtype=np.float32)
+    factor = value / 100
+    channel_factors = np.array([1 + factor * 0.3, 1, 1 - factor * 0.3], dtype=np.float32)
+    numexpr.evaluate("img_array * channel_factors", out=img_array, casting='same_kind')
+    return Image.fromarray(_numexpr_clip(img_array).astype(np.uint8))
+
+
+def _numexpr_color(x, profile, contrast_mean):
+    """_fused_color with numexpr: each stage is a single multithreaded pass"""
+    import numexpr
+
+    if profile.contrast != 0:
+        factor = np.float32(1 + profile.contrast / 100)
+        offset = np.float32(contrast_mean * (1 - factor))
+        numexpr.evaluate("x * factor + offset", out=x, casting='same_kind')
+        _numexpr_clip(x)
+
+    if profile.white_point != 0:
+        luminance = _numexpr_luminance(x)
+        amount = np.float32(profile.white_point * 0.5 / 128)
+        numexpr.evaluate("where(luminance > 128, (luminance - 128) * amount, 0)", out=luminance,
+                         casting='same_kind')
+        _numexpr_mask_add(x, luminance)
+
+    if profile.shadows != 0:
+        luminance = _numexpr_luminance(x)
+        amount = np.float32(profile.shadows * 0.5 / 128)
+        numexpr.evaluate("where(luminance < 128, (128 - luminance) * amount, 0)", out=luminance,
+                         casting='same_kind')
+        _numexpr_mask_add(x, luminance)
+
+    if profile.saturation != 0:
+        factor = np.float32(1 + profile.saturation / 100)
+        gray = _numexpr_luminance(x)[:, :, np.newaxis]
+        numexpr.evaluate("(x - gray) * factor + gray", out=x, casting='same_kind')
+        _numexpr_clip(x)
+
+    if profile.warmth != 0:
+        factor = profile.warmth / 100
+        channel_factors = np.array([1 + factor * 0.3, 1, 1 - factor * 0.3], dtype=np.float32)
+        numexpr.evaluate("x * channel_factors", out=x, casting='same_kind')
+        _numexpr_clip(x)
+
+    return x
+
+
+# Compute backends: implementations of the pixel arithmetic behind the adjustments,
+# selectable with --backend. "ops" maps the adjustments to functions like apply_* and
+# "color" to a function like _fused_color (the color stages of the fused engine); anything
+# a backend leaves out comes from the reference backend. A backend whose "requires" module
+# is not installed falls back to the reference backend.
+BACKENDS = {
+    "numpy": {
+        "requires": None,
+        "ops": {
+            "hdr": apply_hdr,
+            "brightness": apply_brightness,
+            "contrast": apply_contrast,
+            "white_point": apply_white_point,
+            "shadows": apply_shadows,
+            "saturation": apply_saturation,
+            "warmth": apply_warmth,
+            "color": _fused_color,
+        },
+    },
+    "numexpr": {
+        "requires": "numexpr",
+        "ops": {
+            "white_point": _numexpr_white_point,
+            "shadows": _numexpr_shadows,
+            "warmth": _numexpr_warmth,
+            "color": _numexpr_color,
+        },
+    },
+}
+
+REFERENCE_BACKEND = "numpy"
+DEFAULT_BACKEND = REFERENCE_BACKEND
+
+
+def resolve_backend(backend):
+    """
+    Name of the backend that runs when the given one is requested
+
+    The backend itself, or the reference backend when an optional module it needs
+    is not installed (None also selects the reference backend).
+    """
+    if backend is None:
+        return REFERENCE_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend '{backend}' not found. Available: {list(BACKENDS.keys())}")
+    required = BACKENDS[backend]["requires"]
+    if required is not None:
+        try:
+            importlib.import_module(required)
+        except ImportError:
+            return REFERENCE_BACKEND
+    return backend
+
+
+def backend_ops(backend):
+    """Operations of a backend (after any fallback), completed with the reference ones"""
+    return {**BACKENDS[REFERENCE_BACKEND]["ops"], **BACKENDS[resolve_backend(backend)]["ops"]}
+
+
+def _enhance_fused(img, profile, tile_rows=None, backend=None, threads=1):
+    """Fused engine: decode once, apply all stages in float32, quantize once"""
+    return _render_image(img, profile, _fused_finisher(profile, backend), tile_rows, threads=threads)
+
+
+def _enhance_lut(img, profile, tile_rows=None, backend=None, threads=1):
+    """LUT engine: HDR, then a single cached 3D LUT lookup for all other stages"""
+    return _render_image(img, profile, _lut_finisher(profile), tile_rows, threads=threads)
+
+
+def _enhance_fixed(img, profile, tile_rows=None, backend=None, threads=1):
+    """Fixed engine: the fused engine in integer arithmetic"""
+    return _render_image(img, profile, _fixed_finisher(profile), tile_rows, FIXED_KERNEL, threads)
+
+
+def _apply_banded(function, img, value, pool, bands):
+    """Run a pointwise adjustment on horizontal bands of an image in a thread pool, in place"""
+    rows = -(-img.height // bands)
+    boxes = [(0, y0, img.width, min(y0 + rows, img.height)) for y0 in range(0, img.height, rows)]
+    for box, band in zip(boxes, pool.map(lambda box: function(img.crop(box), value), boxes)):
+        img.paste(band, box[:2])
+    return img
+
+
+def _enhance_legacy(img, profile, tile_rows=None, backend=None, threads=1):
+    """Reference engine: chain the individual adjustments (apply_* with the numpy backend)"""
+    if tile_rows is not None:
+        raise ValueError("The legacy engine does not support tiled processing")
+    ops = backend_ops(backend)
+    with (futures.ThreadPoolExecutor(threads) if threads > 1 else contextlib.nullcontext()) as pool:
+        for name in ADJUSTMENTS:
+            value = getattr(profile, name)
+            if value != 0:
+                with _stage(f"apply_{name}"):
+                    if name == "hdr" and profile.tone_mapping == "local":
+                        img = apply_local_tone_mapping(img, value)
+                    elif pool is not None and name in POINTWISE_ADJUSTMENTS:
+                        img = _apply_banded(ops[name], img, value, pool, threads)
+                    else:
+                        img = ops[name](img, value)
+    return img
+
+
+# Processing engines, selectable with --engine. Each takes an RGB image, a profile, an
+# optional tile height, a compute backend (used by fused and legacy) and a thread count,
+# and may reuse the input image for its result.
+ENGINES = {
+    "fused": _enhance_fused,
+    "lut": _enhance_lut,
+    "fixed": _enhance_fixed,
+    "legacy": _enhance_legacy,
+}
+
+DEFAULT_ENGINE = "fused"
+
+# Engines that also run on uint8 RGB arrays, used for memory-mapped inputs and .npy
+# outputs: the ENGINES arguments with an array instead of an image, plus an optional
+# output array. The legacy engine only works on PIL images.
+ARRAY_ENGINES = {
+    "fused": lambda src, profile, out, tile_rows, backend, threads:
+        render_fused(src, profile, out, tile_rows, backend, threads),
+    "lut": lambda src, profile, out, tile_rows, backend, threads:
+        render_lut(src, profile, out, tile_rows=tile_rows, threads=threads),
+    "fixed": lambda src, profile, out, tile_rows, backend, threads:
+        render_fixed(src, profile, out, tile_rows, threads),
+}
+
+# Pixels per chunk in the fused engine (about 768 KB of float32 RGB)
+ENGINE_CHUNK_PIXELS = 1 << 16
+
+# Measured memory use, used to plan tiles: interpreter and libraries, working memory per
+# pixel of a chunk (float32 RGB plus temporaries), per pixel of a tile (PIL crop, array
+# copies of this and the previous tile) and extra per tile pixel for the HDR detail layer
+BASE_MEMORY_MB = 56
+CHUNK_BYTES_PER_PIXEL = 72
+TILE_BYTES_PER_PIXEL = 13
+HDR_TILE_BYTES_PER_PIXEL = 8
+
+# Measured working memory per pixel of the legacy engine (PIL filters on full-size
+# copies), which has no tiling; used to estimate its peak memory in folder runs
+LEGACY_BYTES_PER_PIXEL = 52
+
+# Rows of overlap read around each tile so the HDR unsharp mask (radius 2) sees the same
+# neighbourhood as in an untiled run
+HDR_HALO = 8
+
+# Local tone mapping: longest side of the low-resolution guide in pixels, guided filter
+# radius (guide pixels) and regularization (log luminance squared), the percentile of the
+# base layer that is kept in place, and the base compression and detail boost at hdr=100
+TONE_GUIDE_SIZE = 256
+TONE_RADIUS = 8
+TONE_EPSILON = 0.05
+TONE_WHITE_PERCENTILE = 99
+TONE_COMPRESSION = 0.5
+TONE_DETAIL_BOOST = 0.5
+
+# Adjustments whose apply_* functions look at one pixel at a time, so the legacy engine can
+# run them on bands of the image in parallel (contrast and HDR use whole-image means)
+POINTWISE_ADJUSTMENTS = {"brightness", "white_point", "shadows", "saturation", "warmth"}
+
+# Rec. 601 luma weights (the same ones apply_shadows and apply_white_point use), applied in
+# float32
+LUMA_WEIGHTS = (0.299, 0.587, 0.114)
+
+# Fixed-point formats of the "fixed" engine: pixel values carry FIXED_VALUE_BITS fraction
+# bits (0-255 becomes 0-FIXED_MAX, stored as uint16), factors FIXED_FACTOR_BITS; products
+# are formed in int32
+FIXED_VALUE_BITS = 8
+FIXED_FACTOR_BITS = 12
+FIXED_MAX = 255 << FIXED_VALUE_BITS
+
+# LUMA_WEIGHTS in FIXED_FACTOR_BITS fixed point, rounded so they still sum to one
+FIXED_LUMA_WEIGHTS = (1225, 2404, 467)
+
+# Grid points per axis of the 3D LUTs used by the "lut" engine and --export-lut
+LUT_SIZE = 33
+
+# LUTs kept in memory, about 430 KB each at LUT_SIZE 33
+LUT_MEMORY_CACHE_SIZE = 16
+
+# Bump when the LUT stages change so stale disk-cached LUTs are not reused
+LUT_VERSION = 1
+
+# Version of the processing engines, recorded in output manifests. Bump it when a change
+# alters the output of an engine so incremental runs redo their outputs.
+ENGINE_VERSION = 1
+
+# Version of the auto profile's analysis and formulas, recorded in output manifests like
+# ENGINE_VERSION
+AUTO_VERSION = 1
+
+# Auto profile: longest side of the proxy image analysed, luminance below/above which a
+# pixel counts as dark/bright, and the levels the derived adjustments aim for: 99th
+# luminance percentile, mean luminance, 1st-99th percentile range, and the mean saturation
+# below which it is raised and above which it is lowered
+ANALYSIS_SIZE = 384
+AUTO_DARK_LEVEL = 48
+AUTO_BRIGHT_LEVEL = 200
+AUTO_WHITE_LEVEL = 240
+AUTO_TARGET_MEAN = 118
+AUTO_TARGET_RANGE = 220
+AUTO_TARGET_SATURATION = 0.3
+AUTO_MAX_SATURATION = 0.6
+
+# Name of the manifest file kept in each output folder by incremental runs
+MANIFEST_NAME = ".photo_enhancer_manifest.jsonl"
+
+# Deduplication in folder runs: inputs are compared by a perceptual hash of
+# DEDUP_HASH_SIZE x DEDUP_HASH_SIZE bits, computed from a DEDUP_THUMBNAIL_SIZE px decode;
+# hashes differing in at most DEDUP_NEAR_DISTANCE bits are near duplicates. The index
+# finds them by looking up each byte of a hash, so the distance must stay below 8.
+DEDUP_HASH_SIZE = 8
+DEDUP_THUMBNAIL_SIZE = 64
+DEDUP_NEAR_DISTANCE = 6
+
+# Output formats (Pillow names) and the extension of their files
+FORMAT_EXTENSIONS = {
+    "JPEG": ".jpg",
+    "PNG": ".png",
+    "WEBP": ".webp",
+    "TIFF": ".tiff",
+    "BMP": ".bmp",
+}
+
+# Formats with a quality setting, and so a target size (see EncoderOptions)
+LOSSY_FORMATS = ("JPEG", "WEBP")
+
+# Supported image formats (matched case-insensitively); .npy files hold a uint8
+# (height, width, 3) NumPy array
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp', '.npy'}
+
+# First bytes of a NumPy .npy file
+NPY_MAGIC = b"\x93NUMPY"
+
+# Discovered images buffered ahead of processing in enhance_folder
+DISCOVERY_QUEUE_SIZE = 10000
+
+# Watch mode: seconds a file must stay unchanged before it is processed, seconds between
+# rescans when polling, how often the pool and pending files are checked, and how many
+# already existing images are looked at per round while catching up
+WATCH_SETTLE_SECONDS = 2.0
+WATCH_POLL_SECONDS = 5.0
+WATCH_TICK_SECONDS = 0.2
+WATCH_BACKLOG_BATCH = 256
+
+# enhance_photo options that change the output and are therefore recorded in manifests
+OUTPUT_OPTIONS = ("max_size", "scale")
+
+# In-memory (least recently used first) and on-disk LUT caches
+_LUT_CACHE = collections.OrderedDict()
+_LUT_CACHE_LOCK = threading.Lock()
+LUT_CACHE_DIR = Path(os.environ.get("PHOTO_ENHANCER_CACHE",
+                                    Path.home() / ".cache" / "photo_enhancer")) / "luts"
+
+
+def _describe_adjustments(profile):
+    """Human-readable lines for each adjustment a profile applies, in processing order"""
+    lines = []
+    if profile.hdr != 0:
+        tone_mapping = " (local tone mapping)" if profile.tone_mapping == "local" else ""
+        lines.append(f"  - HDR: {profile.hdr}%{tone_mapping}")
+    if profile.brightness != 0:
+        lines.append(f"  - Brightness: {profile.brightness:+d}%")
+    if profile.contrast != 0:
+        lines.append(f"  - Contrast: {profile.contrast:+d}%")
+    if profile.white_point != 0:
+        lines.append(f"  - White Point: {profile.white_point}%")
+    if profile.shadows != 0:
+        lines.append(f"  - Shadows: {profile.shadows:+d}%")
+    if profile.saturation != 0:
+        lines.append(f"  - Saturation: {profile.saturation:+d}%")
+    if profile.warmth != 0:
+        lines.append(f"  - Warmth: {profile.warmth:+d}%")
+    return lines
+
+
+def plan_tile_rows(width, height, profile, max_memory_mb, threads=1):
+    """
+    Tile height that keeps processing an image within a memory ceiling
+
+    The decoded image stays resident (PIL keeps 4 bytes per pixel) and the engine
+    writes its result back into it, so only the per-tile working set is bounded.
+    With several threads up to 2 * threads chunks are in flight at once.
+
+    Returns:
+        Rows per tile, or None when the image fits the ceiling without tiling
+    """
+    if max_memory_mb is None:
+        return None
+
+    budget = ((max_memory_mb - BASE_MEMORY_MB) * 1024 * 1024 - 4 * width * height
+              - ENGINE_CHUNK_PIXELS * CHUNK_BYTES_PER_PIXEL * (2 * threads if threads > 1 else 1))
+    row_bytes = width * TILE_BYTES_PER_PIXEL
+    if profile.hdr != 0:
+        row_bytes += width * HDR_TILE_BYTES_PER_PIXEL
+    if row_bytes * height <= budget:
+        return None
+    return max(1, budget // row_bytes)
+
+
+def estimate_memory_mb(width, height, profiles, engine=DEFAULT_ENGINE, max_memory_mb=None, threads=1):
+    """
+    Estimated peak memory of enhancing a width x height image, in MB
+
+    Uses the model plan_tile_rows plans tiles with: the decoded image, its copy
+    when several profiles share it, the engine chunks and the largest tile (the
+    whole image when it is not tiled). Auto profiles are counted with HDR. The
+    model errs on the high side.
+    """
+    pixels = width * height
+    image_bytes = 4 * pixels * (2 if len(profiles) > 1 else 1)
+    if engine == "legacy":
+        return BASE_MEMORY_MB + (image_bytes + LEGACY_BYTES_PER_PIXEL * pixels) / (1024 * 1024)
+    chunk_bytes = ENGINE_CHUNK_PIXELS * CHUNK_BYTES_PER_PIXEL * (2 * threads if threads > 1 else 1)
+    tile_bytes = 0
+    for profile in profiles:
+        row_bytes = width * TILE_BYTES_PER_PIXEL
+        if profile.hdr != 0 or isinstance(profile, AutoProfile):
+            row_bytes += width * HDR_TILE_BYTES_PER_PIXEL
+        rows = plan_tile_rows(width, height, profile, max_memory_mb, threads) or height
+        tile_bytes = max(tile_bytes, row_bytes * min(rows, height))
+    return BASE_MEMORY_MB + (image_bytes + chunk_bytes + tile_bytes) / (1024 * 1024)
+
+
+def _reduced_size(size, max_size=None, scale=None):
+    """Target size for a max_size (longest side in pixels) and/or scale factor, None to keep it"""
+    width, height = size
+    if scale is not None:
+        if not 0 < scale <= 1:
+            raise ValueError(f"Scale must be between 0 and 1, got {scale}")
+        width, height = width * scale, height * scale
+    if max_size is not None and max(width, height) > max_size:
+        factor = max_size / max(width, height)
+        width, height = width * factor, height * factor
+    target = (max(1, round(width)), max(1, round(height)))
+    return None if target == tuple(size) else target
+
+
+def _decode_reduced(img, target):
+    """
+    Decode an opened image at (about) a smaller size
+
+    JPEGs are decoded with DCT scaling (draft mode) to the smallest power-of-two
+    reduction that is still at least the target size, then Image.reduce box-averages
+    by any remaining integer factor and a final Lanczos resize hits the exact size.
+    Palette, bilevel and 16-bit images are converted first: neither reduce nor
+    resize accepts those modes.
+    """
+    img.draft('RGB', target)
+    if img.mode in ('P', 'I;16'):
+        img = img.convert('RGB')
+    elif img.mode == '1':
+        img = img.convert('L')
+    factor = min(img.width // target[0], img.height // target[1])
+    if factor >= 2:
+        img = img.reduce(factor)
+    if img.size != target:
+        img = img.resize(target, Image.LANCZOS)
+    return img
+
+
+def load_image(input_path, max_size=None, scale=None):
+    """
+    Open an image, apply its EXIF orientation and convert it to RGB
+
+    Args:
+        input_path: Path or file object of the image (or of a .npy array)
+        max_size: Optional limit for the longest side in pixels
+        scale: Optional scale factor (0-1]
+
+    Returns:
+        (image, exif): the decoded image and the EXIF data to keep when saving it
+        (with the orientation tag removed), or None if it has no usable EXIF data
+    """
+    if _is_npy(input_path):
+        img, exif = Image.fromarray(np.ascontiguousarray(_load_npy(input_path))), None
+    else:
+        img = Image.open(input_path)
+
+        # Read EXIF data before decoding: it holds the orientation and is kept when saving
+        try:
+            exif = img.getexif()
+        except (AttributeError, KeyError, IndexError):
+            # No EXIF data, continue normally
+            exif = None
+
+    # Shrink while decoding when a smaller output was requested
+    target = _reduced_size(img.size, max_size, scale) if (max_size or scale) else None
+    if target is not None:
+        img = _decode_reduced(img, target)
+
+    # Handle EXIF orientation to maintain correct rotation (tag 274, 0x0112)
+    orientation = exif.get(274) if exif is not None else None
+
+    # Apply orientation transformations
+    if orientation == 2:
+        img = img.transpose(Image.FLIP_LEFT_RIGHT)
+    elif orientation == 3:
+        img = img.rotate(180, expand=True)
+    elif orientation == 4:
+        img = img.transpose(Image.FLIP_TOP_BOTTOM)
+    elif orientation == 5:
+        img = img.transpose(Image.FLIP_LEFT_RIGHT).rotate(90, expand=True)
+    elif orientation == 6:
+        img = img.rotate(270, expand=True)
+    elif orientation == 7:
+        img = img.transpose(Image.FLIP_LEFT_RIGHT).rotate(270, expand=True)
+    elif orientation == 8:
+        img = img.rotate(90, expand=True)
+
+    # Remove orientation tag since we've already applied it
+    if orientation is not None:
+        del exif[274]
+
+    # Convert to RGB if necessary
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    return img, exif
+
+
+def read_image_size(input_path):
+    """(width, height) of an image (or .npy array) read from its header, without decoding it"""
+    if _is_npy(input_path):
+        height, width = _load_npy(input_path, mmap_mode='r').shape[:2]
+        return width, height
+    with Image.open(input_path) as img:
+        return img.size
+
+
+def _is_npy(source):
+    """Whether a path (by extension) or a seekable file object (by content) holds a .npy array"""
+    if hasattr(source, "read"):
+        position = source.tell()
+        magic = source.read(len(NPY_MAGIC))
+        source.seek(position)
+        return magic == NPY_MAGIC
+    return Path(source).suffix.lower() == ".npy"
+
+
+def _load_npy(source, mmap_mode=None):
+    """Load a .npy image array, memory-mapped with mmap_mode, and check its shape and type"""
+    array = np.load(source, mmap_mode=mmap_mode, allow_pickle=False)
+    if array.dtype != np.uint8 or array.ndim != 3 or array.shape[2] != 3:
+        raise ValueError(f"Expected a uint8 array of shape (height, width, 3), "
+                         f"got {array.dtype} {array.shape}")
+    return array
+
+
+def _raw_tiff_offset(img):
+    """
+    File offset of the pixels of an opened TIFF stored as uncompressed, contiguous RGB rows
+
+    Returns None for any other layout (compression, planar or padded samples, tiles,
+    strips out of order) and for images with an EXIF orientation to apply.
+    """
+    if img.format != "TIFF" or img.mode != "RGB" or getattr(img, "n_frames", 1) != 1:
+        return None
+    if img.getexif().get(274, 1) != 1:
+        return None
+    width, height = img.size
+    # Tiles are unpacked by position: they are plain tuples before Pillow 11
+    offset = img.tile[0][2] if img.tile else None
+    y = 0
+    for codec_name, extents, tile_offset, args in img.tile:
+        x0, y0, x1, y1 = extents
+        args = args if isinstance(args, tuple) else (args,)
+        rawmode, stride, direction = (args + (0, 1))[:3]
+        if (codec_name != "raw" or rawmode != "RGB" or stride not in (0, 3 * width)
+                or direction != 1 or (x0, x1, y0) != (0, width, y)
+                or tile_offset != offset + 3 * width * y):
+            return None
+        y = y1
+    return offset if y == height else None
+
+
+def map_image(input_path):
+    """
+    Memory-map the pixels of an uncompressed image instead of decoding them
+
+    .npy files holding a row-major uint8 (height, width, 3) array and uncompressed
+    8-bit RGB TIFFs with their rows stored in order are mapped read-only: the engines read
+    the pixels straight from the page cache without a copy, and worker processes
+    mapping the same file share its pages instead of each holding a decoded copy.
+
+    Returns:
+        (array, exif) like load_image, or None when the file cannot be mapped
+    """
+    if hasattr(input_path, "read"):
+        return None
+    if _is_npy(input_path):
+        array = _load_npy(input_path, mmap_mode="r")
+        # The engines work on rows, so column-major arrays are loaded (and copied) instead
+        return (array, None) if array.flags.c_contiguous else None
+    try:
+        with Image.open(input_path) as img:
+            offset = _raw_tiff_offset(img)
+            exif = img.getexif()
+            if 274 in exif:
+                del exif[274]
+    except (OSError, SyntaxError):
+        # Not a readable image; load_image reports the error
+        return None
+    if offset is None:
+        return None
+    width, height = img.size
+    array = np.memmap(input_path, dtype=np.uint8, mode="r", offset=offset, shape=(height, width, 3))
+    return array, exif
+
+
+class EncoderOptions:
+    """Output encoding settings"""
+
+    def __init__(self, image_format=None, quality=95, progressive=False, optimize=False,
+                 subsampling=None, webp_method=None, target_kb=None):
+        if image_format is not None and image_format not in FORMAT_EXTENSIONS:
+            raise ValueError(f"Format '{image_format}' not found. Available: {list(FORMAT_EXTENSIONS.keys())}")
+        if not 1 <= quality <= 100:
+            raise ValueError(f"Quality must be between 1 and 100, got {quality}")
+        if target_kb is not None and target_kb <= 0:
+            raise ValueError(f"Target size must be positive, got {target_kb} KB")
+        self.image_format = image_format  # Pillow format name, None to keep the input's
+        self.quality = quality  # 1-100, JPEG and WebP; the upper bound for target_kb
+        self.progressive = progressive  # JPEG
+        self.optimize = optimize  # JPEG and PNG: smaller files, slower encoding
+        self.subsampling = subsampling  # JPEG chroma subsampling: "4:4:4", "4:2:2" or "4:2:0"
+        self.webp_method = webp_method  # WebP effort 0 (fast) to 6 (small), Pillow's default 4
+        self.target_kb = target_kb  # Highest quality whose file fits this many KB
+
+    def save_params(self, image_format, quality=None):
+        """Pillow save() keyword arguments for a format, optionally with another quality"""
+        params = {}
+        if image_format in LOSSY_FORMATS:
+            # TIFF rejects a quality unless it is JPEG-compressed
+            params["quality"] = self.quality if quality is None else quality
+        if image_format == "JPEG":
+            params.update(progressive=self.progressive, optimize=self.optimize)
+            if self.subsampling is not None:
+                params["subsampling"] = self.subsampling
+        elif image_format == "PNG":
+            params["optimize"] = self.optimize
+        elif image_format == "WEBP" and self.webp_method is not None:
+            params["method"] = self.webp_method
+        return params
+
+    def suffix(self, suffix):
+        """Extension of an output file, given the extension it would have otherwise"""
+        return suffix if self.image_format is None else FORMAT_EXTENSIONS[self.image_format]
+
+
+# Encoding used when no EncoderOptions are given
+DEFAULT_ENCODER = EncoderOptions()
+
+
+def save_image(img, output_path, exif=None, encoder=None):
+    """
+    Save an enhanced image, preserving EXIF data when possible
+
+    The image is written to a temporary file next to the output and renamed into
+    place, so an interrupted run never leaves a truncated file under the final name.
+    The format is the one of the file extension unless encoder (EncoderOptions)
+    names another one; with a target size the image is encoded in memory until the
+    quality is chosen. A .npy output gets the pixels as a uint8 NumPy array.
+    """
+    output_path = Path(output_path)
+    if _writes_npy(output_path, encoder):
+        with _temporary_output(output_path) as tmp_path, open(tmp_path, 'wb') as f:
+            np.save(f, np.asarray(img))
+        return
+    image_format = encoder.image_format if encoder is not None else None
+    image_format = image_format or Image.registered_extensions().get(output_path.suffix.lower())
+    if image_format is None:
+        raise ValueError(f"Unsupported output format '{output_path.suffix}'")
+
+    with _temporary_output(output_path) as tmp_path:
+        if encoder is not None and encoder.target_kb is not None:
+            with open(tmp_path, 'wb') as f:
+                f.write(encode_image(img, image_format, exif, encoder))
+        else:
+            _write_image(img, tmp_path, image_format, exif, encoder)
+
+
+def _writes_npy(output_path, encoder=None):
+    """Whether save_image writes a .npy array to output_path"""
+    return ((encoder is None or encoder.image_format is None)
+            and Path(output_path).suffix.lower() == ".npy")
+
+
+@contextlib.contextmanager
+def _temporary_output(output_path):
+    """Temporary file next to output_path, renamed into place if the block succeeds"""
+    tmp_path = output_path.with_name(
+        f".{output_path.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+    try:
+        yield tmp_path
+        os.replace(tmp_path, output_path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def _render_to_npy(render, output_path, shape):
+    """
+    Let render(out) write an image straight into a memory-mapped .npy file
+
+    The output array is pre-allocated in the file, so the result needs no separate
+    in-memory copy; the file is flushed and renamed into place afterwards.
+    """
+    with _temporary_output(Path(output_path)) as tmp_path:
+        out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.uint8, shape=shape)
+        render(out)
+        out.flush()
+        # Unmap before the rename
+        del out
+
+
+def encode_image(img, image_format, exif=None, encoder=None):
+    """Encode an enhanced image in a Pillow format (e.g. "JPEG") and return the bytes"""
+    if encoder is not None and encoder.target_kb is not None:
+        return _encode_to_size(img, image_format, exif, encoder)
+    buffer = io.BytesIO()
+    _write_image(img, buffer, image_format, exif, encoder)
+    return buffer.getvalue()
+
+
+def _encode_to_size(img, image_format, exif, encoder):
+    """
+    Encode at the highest quality (up to encoder.quality) whose output fits encoder.target_kb
+
+    File size grows with quality, so the quality is found by bisection: at most
+    log2(quality) + 1 encodes, all in memory.
+    """
+    if image_format not in LOSSY_FORMATS:
+        raise ValueError(f"A target size needs a lossy format ({', '.join(LOSSY_FORMATS)}), "
+                         f"not {image_format}")
+    limit = encoder.target_kb * 1024
+    low, high = 1, encoder.quality
+    best, smallest = None, None
+    while low <= high:
+        quality = (low + high) // 2
+        buffer = io.BytesIO()
+        _write_image(img, buffer, image_format, exif, encoder, quality)
+        size = buffer.tell()
+        if size <= limit:
+            best = buffer
+            low = quality + 1
+        else:
+            smallest = size
+            high = quality - 1
+    if best is None:
+        raise ValueError(f"Cannot fit the image in {encoder.target_kb} KB: "
+                         f"it takes {smallest / 1024:.0f} KB at quality 1")
+    return best.getvalue()
+
+
+def _write_image(img, target, image_format, exif=None, encoder=None, quality=None):
+    """Write an image to a path or file object, preserving EXIF data when possible"""
+    params = (encoder or DEFAULT_ENCODER).save_params(image_format, quality)
+    if exif is not None:
+        try:
+            # Save with preserved EXIF data
+            img.save(target, format=image_format, exif=exif, **params)
+            return
+        except Exception:
+            # If EXIF preservation fails, save normally
+            if hasattr(target, "seek"):
+                target.seek(0)
+                target.truncate()
+    img.save(target, format=image_format, **params)
+
+
+# Stage timings of the image being processed on this thread (see RunStats)
+_STAGE_TIMER = threading.local()
+
+
+@contextlib.contextmanager
+def _stage(name):
+    """
+    Time a processing stage for the image being recorded on this thread, if any
+
+    Times are exclusive: while a nested stage runs (e.g. the HDR detail layer,
+    computed lazily inside the pixel passes) its parent's clock is paused.
+    """
+    stack = getattr(_STAGE_TIMER, "stack", None)
+    if stack is None:
+        yield
+        return
+    now = time.perf_counter()
+    if stack:
+        parent = stack[-1]
+        _STAGE_TIMER.stages[parent[0]] = _STAGE_TIMER.stages.get(parent[0], 0.0) + now - parent[1]
+    stack.append([name, now])
+    try:
+        yield
+    finally:
+        now = time.perf_counter()
+        stage_name, start = stack.pop()
+        _STAGE_TIMER.stages[stage_name] = _STAGE_TIMER.stages.get(stage_name, 0.0) + now - start
+        if stack:
+            stack[-1][1] = now
+
+
+@contextlib.contextmanager
+def _recording(stages):
+    """Collect the _stage timings of this thread into the stages dict while active"""
+    _STAGE_TIMER.stack, _STAGE_TIMER.stages = [], stages
+    try:
+        yield
+    finally:
+        _STAGE_TIMER.stack = _STAGE_TIMER.stages = None
+
+
+def _reset_peak_rss():
+    """Reset the peak RSS counter of this process where the OS allows it (Linux)"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _peak_rss_mb():
+    """Peak RSS of this process in MB (since the last reset on Linux), None if unknown"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return round(peak / (1 << 20 if sys.platform == "darwin" else 1 << 10), 1)
+
+
+def _percentile(values, percent):
+    """Nearest-rank percentile of a non-empty list"""
+    values = sorted(values)
+    return values[max(0, -(-len(values) * percent // 100) - 1)]
+
+
+class RunStats:
+    """
+    Per-image telemetry of a run: stage timings, pixel count, peak memory and output size
+
+    Pass an instance as stats= to enhance_photo or enhance_folder. Each image adds
+    one record to .records (and a JSON line to path, if given, as soon as it is
+    done); summary() aggregates them. Stages are decode, hdr_detail (the unsharp
+    mask), tone_guide (the local tone mapping guide), pixels (the array engines'
+    passes), lut (LUT cache loads and builds), apply_* (legacy engine) and encode.
+    """
+
+    def __init__(self, path=None):
+        self.path = Path(path) if path else None
+        self.records = []
+        self.run = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+        self.start_time = time.perf_counter()
+
+    def add(self, record):
+        """Store one image record (also used for records sent back by worker processes)"""
+        record["run"] = self.run
+        self.records.append(record)
+        self._write(record)
+
+    def _write(self, record):
+        if self.path is not None:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(record, sort_keys=True) + "\n")
+
+    def summary(self):
+        """Aggregate the records: images/sec and p50/p95/total seconds per stage"""
+        elapsed = time.perf_counter() - self.start_time
+        done = [record for record in self.records if record["error"] is None]
+        stages = {}
+        for record in done:
+            for name, seconds in record["stages"].items():
+                stages.setdefault(name, []).append(seconds)
+        megapixels = sum(record["megapixels"] for record in done)
+        peaks = [record["peak_rss_mb"] for record in done if record["peak_rss_mb"] is not None]
+        return {
+            "type": "summary",
+            "run": self.run,
+            "images": len(done),
+            "failed": len(self.records) - len(done),
+            "seconds": round(elapsed, 3),
+            "images_per_sec": round(len(done) / elapsed, 3) if elapsed > 0 else None,
+            "megapixels_per_sec": round(megapixels / elapsed, 3) if elapsed > 0 else None,
+            "output_bytes": sum(record["output_bytes"] for record in done),
+            "peak_rss_mb": max(peaks) if peaks else None,
+            "stages": {name: {"p50": round(_percentile(times, 50), 4),
+                              "p95": round(_percentile(times, 95), 4),
+                              "total": round(sum(times), 4)}
+                       for name, times in stages.items()},
+        }
+
+    def finish(self):
+        """Write the summary record and print it"""
+        summary = self.summary()
+        self._write(summary)
+        print("\n" + "=" * 60)
+        print(f"Stage timings over {summary['images']} images (seconds per image):")
+        for name, times in summary["stages"].items():
+            print(f"  {name:<18} p50 {times['p50']:8.3f}  p95 {times['p95']:8.3f}  total {times['total']:9.2f}")
+        if summary["images_per_sec"] is not None:
+            print(f"Throughput: {summary['images_per_sec']:.2f} images/sec, "
+                  f"{summary['megapixels_per_sec']:.1f} MP/sec")
+        if summary["peak_rss_mb"] is not None:
+            print(f"Peak memory per image: {summary['peak_rss_mb']} MB")
+        if self.path is not None:
+            print(f"Stats written to: {self.path}")
+        return summary
+
+
+def _apply_profile(img, profile, verbose, engine, max_memory_mb, backend=None, threads=1, out=None):
+    """
+    Run a profile over a loaded RGB image with the selected engine
+
+    img may also be a uint8 RGB array (e.g. from map_image), processed with
+    ARRAY_ENGINES into out or a new array. An AutoProfile is turned into the
+    profile for this image first.
+    """
+    if isinstance(profile, AutoProfile):
+        with _stage("analyze"):
+            profile = profile.for_image(img)
+
+    if verbose:
+        print(f"Applying profile: {profile.name}")
+
+    is_array = isinstance(img, np.ndarray)
+    height, width = img.shape[:2] if is_array else (img.height, img.width)
+    tile_rows = plan_tile_rows(width, height, profile, max_memory_mb, threads)
+    if verbose and tile_rows is not None:
+        print(f"  Processing in tiles of {tile_rows} rows to stay under {max_memory_mb} MB")
+
+    if is_array:
+        img = ARRAY_ENGINES[engine](img, profile, out, tile_rows, backend, threads)
+    else:
+        img = ENGINES[engine](img, profile, tile_rows, backend, threads)
+
+    if verbose:
+        for line in _describe_adjustments(profile):
+            print(line)
+    return img
+
+
+def enhance_photo(input_path, output_path, profile_name, verbose=True, engine=DEFAULT_ENGINE,
+                  max_memory_mb=None, max_size=None, scale=None, stats=None, backend=DEFAULT_BACKEND,
+                  threads=1, encoder=None):
+    """
+    Apply a profile to enhance a photo
+
+    Args:
+        input_path: Path of the image to enhance
+        output_path: Path to save the enhanced image
+        profile_name: Name of the profile to apply, or a PhotoProfile
+        verbose: If True, prints the applied adjustments
+        engine: Name of the processing engine (see ENGINES)
+        max_memory_mb: Optional memory ceiling in MB; larger images are processed in tiles
+        max_size: Optional limit for the longest side of the output in pixels
+        scale: Optional output scale factor (0-1]; the image is shrunk while decoding
+            and enhanced at the smaller size
+        stats: Optional RunStats to record stage timings and memory use in
+        backend: Compute backend for the pixel arithmetic (see BACKENDS); falls back
+            to the reference backend when its optional module is not installed
+        threads: Number of threads to process the image on, in bands of rows; the
+            result is the same for any number
+        encoder: Optional EncoderOptions (format, quality, target size, ...)
+    """
+    enhance_photo_profiles(input_path, {profile_name: output_path}, verbose=verbose, engine=engine,
+                           max_memory_mb=max_memory_mb, max_size=max_size, scale=scale, stats=stats,
+                           backend=backend, threads=threads, encoder=encoder)
+
+
+def enhance_photo_profiles(input_path, outputs, verbose=True, engine=DEFAULT_ENGINE,
+                           max_memory_mb=None, max_size=None, scale=None, stats=None,
+                           backend=DEFAULT_BACKEND, threads=1, encoder=None):
+    """
+    Decode a photo once and apply several profiles to it
+
+    The file is read, decoded, EXIF-oriented and converted to RGB a single time;
+    each profile then runs on that shared image. Uncompressed TIFF and .npy inputs
+    are memory-mapped instead of decoded when no resizing is requested and the
+    engine runs on arrays (see map_image), and .npy outputs are then rendered
+    straight into a memory-mapped file.
+
+    Args:
+        input_path: Path of the image to enhance
+        outputs: Dict mapping profile names (or PhotoProfile objects) to the output path
+            for that profile
+        verbose, engine, max_memory_mb, max_size, scale, stats, backend, threads, encoder:
+            As for enhance_photo
+    """
+    profiles = [(get_profile(profile), output_path) for profile, output_path in outputs.items()]
+    if engine not in ENGINES:
+        raise ValueError(f"Engine '{engine}' not found. Available: {list(ENGINES.keys())}")
+    backend = resolve_backend(backend)
+
+    record = None
+    if stats is not None:
+        _reset_peak_rss()
+        record = {"type": "image", "input": str(getattr(input_path, "name", input_path)),
+                  "profiles": [profile.name for profile, _ in profiles], "engine": engine,
+                  "backend": backend, "threads": threads, "mapped": False,
+                  "width": None, "height": None, "megapixels": 0, "stages": {},
+                  "output_bytes": 0, "error": None}
+        start = time.perf_counter()
+
+    try:
+        with _recording(record["stages"]) if record is not None else contextlib.nullcontext():
+            with _stage("decode"):
+                mapped = None
+                if engine in ARRAY_ENGINES and not (max_size or scale):
+                    mapped = map_image(input_path)
+                if mapped is not None:
+                    img, exif = mapped
+                    width, height = img.shape[1], img.shape[0]
+                else:
+                    img, exif = load_image(input_path, max_size=max_size, scale=scale)
+                    img.load()
+                    width, height = img.size
+            if record is not None:
+                record.update(width=width, height=height, megapixels=round(width * height / 1e6, 3),
+                              mapped=mapped is not None)
+            if verbose and (max_size or scale):
+                print(f"Decoded at {width}x{height}")
+
+            for i, (profile, output_path) in enumerate(profiles):
+                if i > 0 and verbose:
+                    print()
+                if mapped is not None and _writes_npy(output_path, encoder):
+                    _render_to_npy(lambda out: _apply_profile(img, profile, verbose, engine, max_memory_mb,
+                                                              backend, threads, out),
+                                   output_path, img.shape)
+                else:
+                    # Engines may reuse their input image, so only the last profile gets the
+                    # original (mapped arrays are read-only and never reused)
+                    source = img if mapped is not None or i == len(profiles) - 1 else img.copy()
+                    result = _apply_profile(source, profile, verbose, engine, max_memory_mb, backend, threads)
+                    with _stage("encode"):
+                        save_image(Image.fromarray(result) if mapped is not None else result,
+                                   output_path, exif, encoder)
+                if record is not None:
+                    record["output_bytes"] += os.path.getsize(output_path)
+
+                if verbose:
+                    print(f"\nSaved to: {output_path}")
+    except Exception as e:
+        if record is not None:
+            record["error"] = str(e)
+        raise
+    finally:
+        if record is not None:
+            record["stages"] = {name: round(seconds, 4) for name, seconds in record["stages"].items()}
+            record["seconds"] = round(time.perf_counter() - start, 4)
+            record["peak_rss_mb"] = _peak_rss_mb()
+            stats.add(record)
+
+
+def get_profile(profile):
+    """Look up a profile by name; PhotoProfile objects are returned as they are"""
+    if isinstance(profile, PhotoProfile):
+        return profile
+    if profile == AUTO_PROFILE:
+        return AutoProfile()
+    if profile not in PROFILES:
+        raise ValueError(f"Profile '{profile}' not found. Available: {list(PROFILES.keys()) + [AUTO_PROFILE]}")
+    return PROFILES[profile]
+
+
+def analyze_image(img):
+    """
+    Luminance and color statistics of an image, measured on a small proxy
+
+    Large images are box-reduced to about ANALYSIS_SIZE pixels on the longest side
+    first (arrays in strips of rows, so a memory map is never copied whole), so the
+    analysis costs 1-2% of processing the image.
+
+    Args:
+        img: PIL RGB image or uint8 RGB array
+
+    Returns:
+        Dict with the mean and 1st/50th/99th percentiles of the luminance (0-255),
+        the fractions of dark (below AUTO_DARK_LEVEL), bright (above
+        AUTO_BRIGHT_LEVEL) and clipped (0 or 255) pixels, the mean saturation (0-1)
+        and the mean red minus blue level of the midtones (the color cast)
+    """
+    if isinstance(img, np.ndarray):
+        factor = max(img.shape[:2]) // ANALYSIS_SIZE
+        if factor >= 2:
+            # Whole blocks per strip give the same result as reducing the image at once
+            rows = factor * max(1, ENGINE_CHUNK_PIXELS // (factor * img.shape[1]))
+            strips = (Image.fromarray(np.ascontiguousarray(img[y:y + rows])) for y in range(0, len(img), rows))
+            img = np.concatenate([np.asarray(strip.reduce(factor)) for strip in strips])
+    else:
+        factor = max(img.size) // ANALYSIS_SIZE
+        if factor >= 2:
+            img = img.reduce(factor)
+    pixels = np.asarray(img, dtype=np.float32).reshape(-1, 3)
+    luma = _luminance(pixels)
+    low, median, high = np.percentile(luma, [1, 50, 99])
+    brightest, darkest = pixels.max(axis=1), pixels.min(axis=1)
+    saturation = (brightest - darkest) / np.maximum(brightest, 1)
+    midtones = pixels[(luma > AUTO_DARK_LEVEL) & (luma < AUTO_BRIGHT_LEVEL)]
+    cast = float(midtones[:, 0].mean() - midtones[:, 2].mean()) if len(midtones) else 0.0
+    return {
+        "mean": float(luma.mean()),
+        "p1": float(low),
+        "p50": float(median),
+        "p99": float(high),
+        "dark": float((luma < AUTO_DARK_LEVEL).mean()),
+        "bright": float((luma > AUTO_BRIGHT_LEVEL).mean()),
+        "clipped_low": float((brightest <= 0).mean()),
+        "clipped_high": float((darkest >= 255).mean()),
+        "saturation": float(saturation.mean()),
+        "cast": cast,
+    }
+
+
+def auto_profile(source, name=AUTO_PROFILE, tone_mapping="unsharp"):
+    """
+    Derive a PhotoProfile for an image from its statistics (see analyze_image)
+
+    Shadows are lifted by the fraction of dark pixels, the white point is raised when
+    the 99th luminance percentile falls short of AUTO_WHITE_LEVEL, brightness moves
+    the mean towards AUTO_TARGET_MEAN, contrast stretches a narrow luminance range,
+    saturation is raised below AUTO_TARGET_SATURATION and lowered above
+    AUTO_MAX_SATURATION, warmth offsets half of a color cast and HDR grows with the
+    share of both dark and bright pixels. Every value is
+    kept to a moderate range, so odd images are never pushed far.
+
+    Args:
+        source: Path of an image (decoded at reduced size, for JPEGs by DCT scaling),
+            or a loaded PIL image or uint8 RGB array
+    """
+    if isinstance(source, (str, os.PathLike)):
+        source, _ = load_image(source, max_size=ANALYSIS_SIZE)
+    stats = analyze_image(source)
+
+    def clamp(value, low, high):
+        return int(round(min(max(value, low), high)))
+
+    # Shadows and white point already brighten the image, so brightness only covers the rest
+    shadows = clamp(stats["dark"] * 80 - stats["clipped_low"] * 100, 0, 40)
+    white_point = clamp((AUTO_WHITE_LEVEL - stats["p99"]) / 2, 0, 30)
+    brightness = clamp((AUTO_TARGET_MEAN - stats["mean"]) / max(stats["mean"], 1) * 50 - shadows / 4, -15, 20)
+    contrast = clamp((AUTO_TARGET_RANGE - (stats["p99"] - stats["p1"])) / 4, -10, 25)
+    if stats["saturation"] < AUTO_TARGET_SATURATION:
+        saturation = clamp((AUTO_TARGET_SATURATION - stats["saturation"]) / AUTO_TARGET_SATURATION * 50, 0, 35)
+    else:
+        saturation = clamp((AUTO_MAX_SATURATION - stats["saturation"]) * 100, -15, 0)
+    warmth = clamp(-stats["cast"] / 2, -20, 20)
+    hdr = clamp(20 + min(stats["dark"], stats["bright"]) * 400 + stats["clipped_high"] * 100, 20, 80)
+    return PhotoProfile(name, hdr=hdr, brightness=brightness, contrast=contrast, white_point=white_point,
+                        shadows=shadows, saturation=saturation, warmth=warmth, tone_mapping=tone_mapping)
+
+
+def resolve_profiles(profile_name):
+    """
+    Expand a profile name, a PhotoProfile, 'all' or a list of those
+
+    Returns:
+        Dict mapping the output subfolder name of each profile to the PhotoProfile.
+        Named profiles use their PROFILES key, custom ones their name with
+        underscores for spaces.
+    """
+    if isinstance(profile_name, (str, PhotoProfile)):
+        profile_name = [profile_name]
+    profiles = {}
+    for entry in profile_name:
+        if entry == "all":
+            profiles.update((name, profile) for name, profile in PROFILES.items() if name not in profiles)
+        elif isinstance(entry, PhotoProfile):
+            profiles.setdefault(entry.name.replace(" ", "_"), entry)
+        else:
+            profiles.setdefault(entry, get_profile(entry))
+    return profiles
+
+
+def enhance_image(img, profile, engine=DEFAULT_ENGINE, max_memory_mb=None, backend=DEFAULT_BACKEND,
+                  threads=1):
+    """
+    Apply a profile to a loaded RGB image and return the result
+
+    Unlike the engines themselves this leaves img untouched, so it can be used
+    repeatedly on a cached image (e.g. for previews).
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Engine '{engine}' not found. Available: {list(ENGINES.keys())}")
+    return _apply_profile(img.copy(), get_profile(profile), False, engine, max_memory_mb,
+                          resolve_backend(backend), threads)
+
+
+def enhance_array(src, profile, out=None, engine=DEFAULT_ENGINE, max_memory_mb=None,
+                  backend=DEFAULT_BACKEND, threads=1):
+    """
+    Apply a profile to a uint8 RGB array of shape (height, width, 3) and return the result
+
+    src is only read, so it can be a read-only memory map (see map_image); out may
+    be any writable array of the same shape, such as a pre-allocated memory-mapped
+    .npy file (np.lib.format.open_memmap), and is returned. Arrays that are not
+    row-major are copied first, and the legacy engine copies the pixels into an image.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Engine '{engine}' not found. Available: {list(ENGINES.keys())}")
+    profile, backend = get_profile(profile), resolve_backend(backend)
+    src = np.ascontiguousarray(src)
+    if engine in ARRAY_ENGINES:
+        return _apply_profile(src, profile, False, engine, max_memory_mb, backend, threads, out)
+    result = np.asarray(_apply_profile(Image.fromarray(src), profile, False,
+                                       engine, max_memory_mb, backend, threads))
+    if out is None:
+        return result
+    out[...] = result
+    return out
+
+
+class EnhanceResult:
+    """One finished image from enhance_iter"""
+
+    def __init__(self, index, path, output_path=None, image=None, error=None):
+        self.index = index              # position of path in the input sequence
+        self.path = path
+        self.output_path = output_path  # where the result was saved, if it was
+        self.image = image              # the enhanced image when it was not saved
+        self.error = error              # error message if the image failed
+        self.timings = {}               # seconds spent per stage (read, decode, enhance, encode)
+
+
+def _output_path_for(output, path, encoder=None):
+    """Output path of an input for enhance_iter's output argument"""
+    if output is None:
+        return None
+    if callable(output):
+        return output(path)
+    path = Path(path)
+    return Path(output) / f"{path.stem}_enhanced{(encoder or DEFAULT_ENCODER).suffix(path.suffix)}"
+
+
+def _queue_put(q, item, stop):
+    """Put into a bounded queue, giving up when stop is set"""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _queue_get(q, stop):
+    """Get from a queue, returning _STOP when stop is set"""
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _STOP
+
+
+_STOP = object()
+
+
+def enhance_iter(paths, profile, output=None, readers=2, encoders=1, prefetch=2,
+                 engine=DEFAULT_ENGINE, max_memory_mb=None, max_size=None, scale=None,
+                 backend=DEFAULT_BACKEND, threads=1, encoder=None):
+    """
+    Enhance a stream of images in a pipeline, yielding results as they finish
+
+    Reading and decoding, enhancing, and encoding and writing run in separate
+    threads connected by bounded queues, so disk I/O, JPEG decoding and encoding
+    overlap with the pixel work (Pillow and numpy release the GIL while they run).
+    The queues give backpressure: at most readers + encoders + 3 * prefetch + 1
+    images are in memory at once however many paths there are, and paths is
+    consumed lazily.
+
+    Args:
+        paths: Iterable of input image paths
+        profile: Name of the profile to apply, or a PhotoProfile
+        output: None to yield the enhanced images, a folder to save them in (as
+            <name>_enhanced<ext>, like enhance_folder) or a callable mapping an
+            input path to its output path
+        readers: Number of threads reading and decoding inputs
+        encoders: Number of threads encoding and writing outputs
+        prefetch: Capacity of each queue between the stages
+        engine, max_memory_mb, max_size, scale, backend, threads, encoder: As for enhance_photo
+
+    Yields:
+        EnhanceResult for every path, in completion order (see EnhanceResult.index)
+    """
+    profile = get_profile(profile)
+    if engine not in ENGINES:
+        raise ValueError(f"Engine '{engine}' not found. Available: {list(ENGINES.keys())}")
+    backend = resolve_backend(backend)
+    if output is not None and not callable(output):
+        Path(output).mkdir(parents=True, exist_ok=True)
+
+    inputs = enumerate(paths)
+    inputs_lock = threading.Lock()
+    decoded = queue.Queue(prefetch)
+    enhanced = queue.Queue(prefetch)
+    results = queue.Queue(prefetch)
+    stop = threading.Event()
+    readers_left = [readers]
+    failure = []
+
+    def read():
+        while not stop.is_set():
+            with inputs_lock:
+                try:
+                    index, path = next(inputs)
+                except StopIteration:
+                    break
+                except Exception as e:
+                    failure.append(e)
+                    break
+            result = EnhanceResult(index, path)
+            image = exif = None
+            try:
+                start = time.perf_counter()
+                with open(path, 'rb') as f:
+                    data = f.read()
+                result.timings["read"] = time.perf_counter() - start
+                start = time.perf_counter()
+                image, exif = load_image(io.BytesIO(data), max_size=max_size, scale=scale)
+                # Decode here rather than lazily in the enhance stage
+                image.load()
+                result.timings["decode"] = time.perf_counter() - start
+            except Image.UnidentifiedImageError:
+                result.error = f"cannot identify image file '{path}'"
+            except Exception as e:
+                result.error = str(e)
+            if not _queue_put(decoded, (result, image, exif), stop):
+                return
+        with inputs_lock:
+            readers_left[0] -= 1
+            last = readers_left[0] == 0
+        if last:
+            _queue_put(decoded, _STOP, stop)
+
+    def enhance():
+        while True:
+            item = _queue_get(decoded, stop)
+            if item is _STOP:
+                break
+            result, image, exif = item
+            if result.error is None:
+                try:
+                    start = time.perf_counter()
+                    image = _apply_profile(image, profile, False, engine, max_memory_mb, backend, threads)
+                    result.timings["enhance"] = time.perf_counter() - start
+                except Exception as e:
+                    result.error = str(e)
+                    image = None
+            if not _queue_put(enhanced, (result, image, exif), stop):
+                return
+        for _ in range(encoders):
+            _queue_put(enhanced, _STOP, stop)
+
+    def encode():
+        while True:
+            item = _queue_get(enhanced, stop)
+            if item is _STOP:
+                break
+            result, image, exif = item
+            if result.error is None:
+                result.output_path = _output_path_for(output, result.path, encoder)
+                if result.output_path is None:
+                    result.image = image
+                else:
+                    try:
+                        start = time.perf_counter()
+                        save_image(image, result.output_path, exif, encoder)
+                        result.timings["encode"] = time.perf_counter() - start
+                    except Exception as e:
+                        result.error = str(e)
+            if not _queue_put(results, result, stop):
+                return
+        _queue_put(results, _STOP, stop)
+
+    stages = ([threading.Thread(target=read, daemon=True) for _ in range(readers)]
+              + [threading.Thread(target=enhance, daemon=True)]
+              + [threading.Thread(target=encode, daemon=True) for _ in range(encoders)])
+    for thread in stages:
+        thread.start()
+    try:
+        running = encoders
+        while running:
+            result = results.get()
+            if result is _STOP:
+                running -= 1
+            else:
+                yield result
+        if failure:
+            raise failure[0]
+    finally:
+        # Also reached when the caller stops iterating early: wind the stages down
+        stop.set()
+        for thread in stages:
+            thread.join()
+
+
+def list_profiles():
+    """Display all available profiles"""
+    print("\nAvailable Profiles:")
+    print("=" * 60)
+    for name, profile in PROFILES.items():
+        print(f"\n{name}: {profile.name}")
+        print(f"  HDR: {profile.hdr}%, Brightness: {profile.brightness:+d}%")
+        print(f"  Contrast: {profile.contrast:+d}%, Saturation: {profile.saturation:+d}%")
+        print(f"  Shadows: {profile.shadows:+d}%, Warmth: {profile.warmth:+d}%")
+        print(f"  White Point: {profile.white_point}%")
+    print(f"\n{AUTO_PROFILE} (--auto): adjustments derived from the histograms of each image")
+    print()
+
+
+def _matches(patterns, name, relative):
+    """Whether a file or folder name, or its path relative to the scanned folder, matches a glob"""
+    return any(fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(relative, pattern)
+               for pattern in patterns)
+
+
+def iter_images(folder, recursive=False, include=None, exclude=None, skip=()):
+    """
+    Yield the image files in a folder, in a deterministic order
+
+    Each folder is read with a single os.scandir call and its images are yielded
+    (sorted by name) before its subfolders are visited (also sorted by name), so
+    processing can start long before a large tree has been scanned. Extensions
+    are matched case-insensitively, so every file is found exactly once.
+
+    Args:
+        folder: Folder to scan
+        recursive: Also scan subfolders (symlinked folders are not followed)
+        include: Optional glob patterns; only files whose name or path relative to
+            folder matches one of them are yielded (e.g. "IMG_*", "2024-*/*.jpg")
+        exclude: Optional glob patterns for files and subfolders to leave out
+        skip: Folders not to descend into (e.g. an output folder inside the input)
+    """
+    root = os.fspath(folder)
+    skip = {_normalized(path) for path in skip}
+    include, exclude = include or (), exclude or ()
+    folders = [(root, "")]
+    while folders:
+        directory, prefix = folders.pop()
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError as e:
+            if directory == root:
+                raise
+            print(f"Warning: Skipping folder '{directory}': {e}")
+            continue
+
+        subfolders = []
+        for entry in entries:
+            relative = prefix + entry.name
+            if exclude and _matches(exclude, entry.name, relative):
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive and _normalized(entry.path) not in skip:
+                        subfolders.append((entry.path, relative + "/"))
+                    continue
+                if not entry.is_file():
+                    continue
+            except OSError:
+                continue
+            if os.path.splitext(entry.name)[1].lower() not in IMAGE_EXTENSIONS:
+                continue
+            if include and not _matches(include, entry.name, relative):
+                continue
+            yield Path(entry.path)
+        # Reversed, so the first subfolder is popped (visited) first
+        folders.extend(reversed(subfolders))
+
+
+def _file_sha256(path):
+    """SHA-256 of a file's content"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def perceptual_hash(source):
+    """
+    Perceptual hash of an image: a 64-bit difference hash of a tiny thumbnail
+
+    Each bit tells whether a pixel of a 9x8 grayscale thumbnail is brighter than
+    its right neighbour, so resized, recompressed or lightly edited copies of a
+    photo get hashes that differ in only a few bits. JPEGs are decoded at reduced
+    size, which makes this much cheaper than a full decode.
+
+    Args:
+        source: Path or file object of the image (or of a .npy array)
+
+    Returns:
+        The hash as an int
+    """
+    img, _ = load_image(source, max_size=DEDUP_THUMBNAIL_SIZE)
+    thumbnail = np.asarray(img.convert('L').resize((DEDUP_HASH_SIZE + 1, DEDUP_HASH_SIZE), Image.BOX),
+                           dtype=np.int16)
+    bits = (thumbnail[:, 1:] > thumbnail[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+class _HashIndex:
+    """
+    Perceptual hashes seen so far, searchable by Hamming distance
+
+    Two 64-bit hashes within DEDUP_NEAR_DISTANCE (< 8) bits of each other have at
+    least one of their 8 bytes in common, so only the hashes sharing a byte with
+    the one looked up are compared.
+    """
+
+    def __init__(self):
+        self.buckets = collections.defaultdict(list)
+
+    def nearest(self, value):
+        """(distance, item) of the closest hash within DEDUP_NEAR_DISTANCE bits, or None"""
+        best = None
+        for key in self._keys(value):
+            for other, item in self.buckets.get(key, ()):
+                distance = (value ^ other).bit_count()
+                if distance <= DEDUP_NEAR_DISTANCE and (best is None or distance < best[0]):
+                    best = (distance, item)
+        return best
+
+    def add(self, value, item):
+        for key in self._keys(value):
+            self.buckets[key].append((value, item))
+
+    @staticmethod
+    def _keys(value):
+        return [(i, (value >> (8 * i)) & 0xFF) for i in range(DEDUP_HASH_SIZE * DEDUP_HASH_SIZE // 8)]
+
+
+def _link_output(source, target):
+    """Replace target with a hard link to source (a copy where hard links are not supported)"""
+    tmp_path = f"{target}.{os.getpid()}.tmp"
+    try:
+        os.link(source, tmp_path)
+    except OSError:
+        shutil.copyfile(source, tmp_path)
+    os.replace(tmp_path, target)
+
+
+class OutputManifest:
+    """
+    Record of the outputs in one output folder, used to skip up-to-date inputs
+
+    Each output file has a record with the input's size, mtime and SHA-256, the
+    profile parameters and the engine that produced it. Records are appended to a
+    JSON-lines journal as soon as an output is written, so an interrupted run
+    resumes where it stopped; the journal is compacted at the end of each run.
+    """
+
+    def __init__(self, folder):
+        self.folder = Path(folder)
+        self.path = self.folder / MANIFEST_NAME
+        self.records = {}
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        self.records[record["output"]] = record
+                    except (ValueError, KeyError, TypeError):
+                        # A torn last line from a crash; the output will be redone
+                        continue
+        except FileNotFoundError:
+            pass
+
+    def is_current(self, output_file, stat, profile, settings, get_sha256):
+        """Check whether output_file is up to date for the input described by stat"""
+        record = self.records.get(self._key(output_file))
+        if (record is None or record.get("profile") != _profile_params(profile)
+                or record.get("settings") != settings or not Path(output_file).exists()):
+            return False
+        if record.get("size") == stat.st_size and record.get("mtime_ns") == stat.st_mtime_ns:
+            return True
+        # Size or mtime changed (e.g. the file was copied or touched): compare content
+        if record.get("size") != stat.st_size or record.get("sha256") != get_sha256():
+            return False
+        record["mtime_ns"] = stat.st_mtime_ns
+        self.append(record)
+        return True
+
+    def add(self, output_file, stat, sha256, profile, settings):
+        """Record a freshly written output"""
+        self.append({
+            "output": self._key(output_file),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": sha256,
+            "profile": _profile_params(profile),
+            "settings": settings,
+        })
+
+    def _key(self, output_file):
+        """Records are keyed by the output path relative to the folder, with / separators"""
+        return Path(output_file).relative_to(self.folder).as_posix()
+
+    def append(self, record):
+        self.records[record["output"]] = record
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record, sort_keys=True) + "\n")
+
+    def compact(self):
+        """Rewrite the journal with one record per existing output"""
+        tmp_path = self.path.with_name(f"{MANIFEST_NAME}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w') as f:
+            for name, record in sorted(self.records.items()):
+                if (self.folder / name).exists():
+                    f.write(json.dumps(record, sort_keys=True) + "\n")
+        os.replace(tmp_path, self.path)
+
+
+def _output_settings(options):
+    """
+    The options besides the profile that affect an output, as stored in manifests
+
+    The engine is recorded with ENGINE_VERSION so engine changes invalidate outputs.
+    """
+    settings = {"engine": f"{options.get('engine', DEFAULT_ENGINE)}/{ENGINE_VERSION}"}
+    backend = resolve_backend(options.get("backend"))
+    if backend != REFERENCE_BACKEND:
+        settings["backend"] = backend
+    for name in OUTPUT_OPTIONS:
+        if options.get(name) is not None:
+            settings[name] = options[name]
+    encoder = options.get("encoder")
+    if encoder is not None and vars(encoder) != vars(DEFAULT_ENCODER):
+        settings["encoder"] = vars(encoder)
+    return settings
+
+
+def _enhance_task(task):
+    """
+    Enhance one batch entry, capturing its output so it can be reported in order
+
+    Returns:
+        (log, error, sha256, records, phash): the captured output, the error message
+        if it failed, the input's SHA-256 when requested (hashed from the same read),
+        the RunStats records when stats were requested and the input's
+        perceptual_hash when requested
+    """
+    input_file, outputs, verbose, want_sha256, want_stats, want_phash, options = task
+    log = io.StringIO()
+    sha256 = None
+    phash = None
+    # Records are collected here and added to the caller's RunStats, which may be in another process
+    stats = RunStats() if want_stats else None
+    error = None
+    try:
+        source = input_file
+        if want_sha256:
+            with open(input_file, 'rb') as f:
+                data = f.read()
+            sha256 = hashlib.sha256(data).hexdigest()
+            source = io.BytesIO(data)
+        with contextlib.redirect_stdout(log):
+            enhance_photo_profiles(source, outputs, verbose=verbose, stats=stats, **options)
+    except Image.UnidentifiedImageError:
+        # Name the file rather than the in-memory copy it may have been read into
+        error = f"cannot identify image file '{input_file}'"
+    except Exception as e:
+        error = str(e)
+
+    if want_phash and error is None:
+        # The outputs are written by now: without a hash the image is only left out of dedup
+        try:
+            if hasattr(source, "seek"):
+                source.seek(0)
+            phash = perceptual_hash(source)
+        except Exception as e:
+            print(f"  Warning: Cannot hash {os.path.basename(input_file)} for dedup: {e}", file=log)
+
+    records = None
+    if stats is not None:
+        records = stats.records
+        for record in records:
+            record["input"] = input_file
+    return log.getvalue(), error, sha256, records, phash
+
+
+class BatchProgress:
+    """
+    Progress of an enhance_folder run, passed to its progress callback
+
+    The callback is called once before the first image (with current=None) and
+    then after every image, whether it was processed, failed or skipped. Images
+    are discovered while earlier ones are processed, so total grows until
+    discovering turns False (the ETA is a lower bound until then).
+    """
+
+    def __init__(self):
+        self.total = 0                  # images found so far
+        self.discovering = True         # whether the input folder is still being scanned
+        self.succeeded = 0
+        self.failed = 0
+        self.skipped = 0
+        self.duplicates = 0             # succeeded images whose outputs were linked (with dedup)
+        self.near_duplicates = []       # (image, similar earlier image, differing hash bits)
+        self.bytes_processed = 0        # size of the processed input files
+        self.current = None             # name of the last finished image
+        self.error = None               # error message of the last image, if it failed
+        self.cancelled = False
+        self.start_time = time.perf_counter()
+
+    @property
+    def pending(self):
+        """Images that need processing (found minus skipped)"""
+        return self.total - self.skipped
+
+    @property
+    def processed(self):
+        return self.succeeded + self.failed
+
+    @property
+    def done(self):
+        return self.processed + self.skipped
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.start_time
+
+    @property
+    def images_per_sec(self):
+        elapsed = self.elapsed
+        return self.processed / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def bytes_per_sec(self):
+        elapsed = self.elapsed
+        return self.bytes_processed / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self):
+        """Estimated seconds left, or None until the first image has been processed"""
+        if not self.processed:
+            return None
+        return (self.pending - self.processed) / self.images_per_sec
+
+
+class _FolderRun:
+    """
+    Output folders, manifests and progress of one enhance_folder or watch_folder run
+
+    Plans the outputs of each image (skipping up-to-date ones in incremental mode),
+    builds the worker tasks and reports their results. With dedup, an image with
+    the same content as an earlier one gets hard links to that image's outputs
+    instead of being processed, which needs the results in planning order.
+    """
+
+    def __init__(self, input_path, output_folder, profiles, create_subfolder, verbose, incremental,
+                 progress, stats, options, dedup=False):
+        self.input_path = input_path
+        self.output_folder = Path(output_folder)
+        self.profiles = profiles
+        self.verbose = verbose
+        self.incremental = incremental
+        self.dedup = dedup
+        self.originals = {}             # SHA-256 -> (relative path, output paths) of its first image
+        self.failed_originals = set()   # SHA-256 of the originals that failed
+        self.hashes = _HashIndex()
+        self.output_names = {}          # lower-cased output name (relative) -> relative path of its image
+        self.progress = progress
+        self.stats = stats
+        self.options = options
+        self.settings = _output_settings(options)
+        self.status = BatchProgress()
+
+        self.output_paths = {}
+        for name in profiles:
+            self.output_paths[name] = self.output_folder / name if create_subfolder else self.output_folder
+            self.output_paths[name].mkdir(parents=True, exist_ok=True)
+        self.manifests = ({name: OutputManifest(path) for name, path in self.output_paths.items()}
+                          if incremental else {})
+        self.created_folders = set()
+
+    def print_header(self, message):
+        print(f"\n{message}")
+        if len(self.profiles) == 1:
+            name = next(iter(self.profiles))
+            print(f"Profile: {self.profiles[name].name}")
+            print(f"Output folder: {self.output_paths[name]}")
+        else:
+            print(f"Profiles: {', '.join(profile.name for profile in self.profiles.values())}")
+            print(f"Output folder: {self.output_folder}")
+        print("-" * 60)
+
+    def plan(self, img_file):
+        """
+        Work out the outputs an image needs; in incremental mode up-to-date ones are skipped
+
+        Returns:
+            (img_file, relative, outputs, stat, sha256, original): outputs maps the
+            profile names still to be produced to their paths; sha256 is the input's
+            hash if it was needed and original the entry of an earlier image with the
+            same content (with dedup), whose outputs are then linked instead
+        """
+        relative = img_file.relative_to(self.input_path)
+        suffix = (self.options.get("encoder") or DEFAULT_ENCODER).suffix(img_file.suffix)
+        file_name = self._output_name(relative, suffix)
+        targets = {name: str(path / relative.parent / file_name) for name, path in self.output_paths.items()}
+        outputs = targets
+        stat = None
+        sha256 = []
+
+        def get_sha256():
+            if not sha256:
+                sha256.append(_file_sha256(img_file))
+            return sha256[0]
+
+        if self.incremental or self.dedup:
+            stat = img_file.stat()
+        if self.incremental:
+            outputs = {name: output_file for name, output_file in outputs.items()
+                       if not self.manifests[name].is_current(output_file, stat, self.profiles[name],
+                                                              self.settings, get_sha256)}
+        original = None
+        if self.dedup:
+            # Registered even when up to date, as its outputs exist for later copies to link
+            original = self.originals.setdefault(get_sha256(), (relative, targets))
+            if original[0] == relative:
+                original = None
+        # The output tree mirrors the input tree
+        for output_file in outputs.values():
+            folder = Path(output_file).parent
+            if folder not in self.created_folders:
+                folder.mkdir(parents=True, exist_ok=True)
+                self.created_folders.add(folder)
+        return img_file, relative, outputs, stat, sha256[0] if sha256 else None, original
+
+    def _output_name(self, relative, suffix):
+        """
+        File name of an image's outputs, unique among the images of the run
+
+        With --format, images that only differ in their extension (shot.jpg and
+        shot.png) would write the same file; every image after the first keeps its
+        extension in the name instead (shot_png_enhanced.jpg).
+        """
+        stem = relative.stem
+        base = f"{stem}_{relative.suffix[1:].lower()}"
+        number = 1
+        # Compared case-insensitively, as the output folder may be on such a file system
+        while self.output_names.setdefault(str(relative.parent / f"{stem}_enhanced{suffix}").lower(),
+                                           relative) != relative:
+            stem = base if number == 1 else f"{base}_{number}"
+            number += 1
+        return f"{stem}_enhanced{suffix}"
+
+    def task(self, entry):
+        """The _enhance_task argument for a planned image, None if it is up to date or a duplicate"""
+        img_file, _, outputs, _, sha256, original = entry
+        if not outputs or original is not None:
+            return None
+        # Profiles are sent to the workers as objects, so custom profiles work with any start method
+        return (str(img_file), {self.profiles[name]: output_file for name, output_file in outputs.items()},
+                self.verbose, self.incremental and sha256 is None, self.stats is not None, self.dedup,
+                self.options)
+
+    def finish(self, entry, result):
+        """
+        Report a finished image
+
+        result is the _enhance_task result, or None if the image was up to date or
+        is a duplicate, whose outputs are linked here.
+        """
+        img_file, relative, outputs, stat, sha256, original = entry
+        status = self.status
+        number = status.done + 1
+        status.current = str(relative)
+        status.error = None
+        if result is None and outputs and original is not None:
+            self._link_duplicate(number, entry)
+        elif result is None:
+            status.skipped += 1
+            if self.verbose:
+                print(f"\n[{number}] Up to date: {relative}")
+        else:
+            log, error, result_sha256, records, phash = result
+            sha256 = sha256 or result_sha256
+            for record in records or ():
+                self.stats.add(record)
+            print(f"\n[{number}] Processing: {relative}")
+            print(log, end="")
+            status.bytes_processed += stat.st_size if stat else img_file.stat().st_size
+            if error is not None:
+                print(f"  ERROR: Failed to process {relative}: {error}")
+                status.failed += 1
+                status.error = error
+                if self.dedup:
+                    self.failed_originals.add(sha256)
+            else:
+                status.succeeded += 1
+                self._add_outputs(outputs, stat, sha256)
+                if phash is not None:
+                    self._report_near_duplicate(relative, phash)
+        if self.progress:
+            self.progress(status)
+
+    def estimate_mb(self, entry):
+        """Estimated peak memory of processing a planned image (see estimate_memory_mb)"""
+        img_file, _, outputs, _, _, _ = entry
+        try:
+            size = read_image_size(img_file)
+        except (OSError, ValueError, Image.DecompressionBombError):
+            # Unreadable: the worker fails early and reports why
+            return BASE_MEMORY_MB
+        size = _reduced_size(size, self.options.get("max_size"), self.options.get("scale")) or size
+        return estimate_memory_mb(*size, [self.profiles[name] for name in outputs],
+                                  self.options.get("engine", DEFAULT_ENGINE),
+                                  self.options.get("max_memory_mb"), self.options.get("threads", 1))
+
+    def _link_duplicate(self, number, entry):
+        """Give an image the outputs of the earlier image with the same content"""
+        _, relative, outputs, stat, sha256, (original, original_outputs) = entry
+        status = self.status
+        print(f"\n[{number}] Duplicate of {original}: {relative}")
+        error = None
+        if sha256 in self.failed_originals:
+            error = f"{original} failed"
+        else:
+            try:
+                for name, output_file in outputs.items():
+                    if _normalized(output_file) != _normalized(original_outputs[name]):
+                        _link_output(original_outputs[name], output_file)
+                    if self.verbose:
+                        print(f"  Linked: {output_file}")
+            except OSError as e:
+                error = str(e)
+        if error is not None:
+            print(f"  ERROR: Failed to process {relative}: {error}")
+            status.failed += 1
+            status.error = error
+        else:
+            status.succeeded += 1
+            status.duplicates += 1
+            self._add_outputs(outputs, stat, sha256)
+
+    def _add_outputs(self, outputs, stat, sha256):
+        if self.incremental:
+            for name, output_file in outputs.items():
+                self.manifests[name].add(output_file, stat, sha256, self.profiles[name], self.settings)
+
+    def _report_near_duplicate(self, relative, phash):
+        match = self.hashes.nearest(phash)
+        if match is not None:
+            distance, other = match
+            print(f"  Near duplicate of {other} ({distance} of {DEDUP_HASH_SIZE ** 2} hash bits differ)")
+            self.status.near_duplicates.append((str(relative), str(other), distance))
+        self.hashes.add(phash, relative)
+
+    def close(self):
+        for manifest in self.manifests.values():
+            manifest.compact()
+
+    def print_summary(self, title):
+        status = self.status
+        print("\n" + "=" * 60)
+        print(title)
+        print(f"Successfully enhanced: {status.succeeded}/{status.pending} images")
+        if self.incremental:
+            print(f"Skipped (already up to date): {status.skipped}")
+        if self.dedup:
+            print(f"Duplicates (outputs linked): {status.duplicates}")
+            print(f"Near duplicates: {len(status.near_duplicates)}")
+            for image, other, distance in status.near_duplicates:
+                print(f"  {image} ~ {other} ({distance} bits)")
+        if len(self.profiles) == 1:
+            print(f"Output location: {self.output_paths[next(iter(self.profiles))]}")
+        else:
+            print(f"Output location: {self.output_folder} ({len(self.profiles)} profile subfolders)")
+
+
+def _limit_backend_threads():
+    """Pool workers: there is already a process per core, so multithreaded backends use one thread"""
+    os.environ["NUMEXPR_NUM_THREADS"] = "1"
+    numexpr = sys.modules.get("numexpr")
+    if numexpr is not None:
+        numexpr.set_num_threads(1)
+
+
+def _run_within_budget(run, images, jobs, memory_budget_mb, cancel_event):
+    """
+    Process the images of a folder run largest first, within a memory budget
+
+    Every image is planned and its peak memory estimated from its header before
+    any is started. Workers then take the largest waiting image whose estimate
+    fits in what is left of memory_budget_mb, or any image when none is running
+    (so one larger than the budget runs on its own), and results are reported
+    as they finish. Duplicates (with dedup) are linked at the end, when their
+    originals are done.
+    """
+    status = run.status
+    queued = []             # (estimated MB, entry, task), largest first
+    duplicates = []
+    for img_file in images:
+        status.total += 1
+        entry = run.plan(img_file)
+        _, _, outputs, _, _, original = entry
+        task = run.task(entry)
+        if task is not None:
+            queued.append((run.estimate_mb(entry), entry, task))
+        elif outputs and original is not None:
+            duplicates.append(entry)
+        else:
+            run.finish(entry, None)
+    status.discovering = False
+    queued.sort(key=lambda item: item[0], reverse=True)
+
+    running = {}            # future -> (estimated MB, entry)
+    in_use = 0
+    with contextlib.ExitStack() as stack:
+        executor = None
+        if jobs > 1:
+            executor = stack.enter_context(_WorkerPool(jobs, _limit_backend_threads))
+        while queued or running:
+            i = 0
+            while i < len(queued) and len(running) < jobs:
+                if cancel_event is not None and cancel_event.is_set():
+                    status.cancelled = True
+                    queued.clear()
+                    break
+                estimate, entry, task = queued[i]
+                if running and in_use + estimate > memory_budget_mb:
+                    i += 1
+                    continue
+                del queued[i]
+                if estimate > memory_budget_mb and run.verbose:
+                    print(f"\nNote: {entry[1]} needs about {estimate:.0f} MB, more than the "
+                          f"{memory_budget_mb} MB budget; it runs on its own")
+                if executor is None:
+                    run.finish(entry, _enhance_task(task))
+                else:
+                    running[executor.submit(task)] = (estimate, entry)
+                    in_use += estimate
+            if running:
+                finished, _ = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+                for future in finished:
+                    estimate, entry = running.pop(future)
+                    in_use -= estimate
+                    run.finish(entry, executor.result(future))
+
+    if not status.cancelled:
+        for entry in duplicates:
+            run.finish(entry, None)
+
+
+class _WorkerPool:
+    """
+    Process pool that outlives its workers, running _enhance_task (or another function)
+
+    A worker that dies (killed when out of memory, or a crash in native code)
+    breaks a ProcessPoolExecutor, and every task still in it fails. Each of those
+    tasks is run again on its own in a fresh process, so only the one that kills
+    its worker fails; new tasks go to a new pool. Such an _enhance_task is reported
+    as a failed image, other functions raise BrokenProcessPool. Tasks may be
+    submitted and collected from several threads.
+    """
+
+    def __init__(self, jobs, initializer, function=None):
+        self.jobs = jobs
+        self.initializer = initializer
+        self.function = function or _enhance_task
+        self.executor = futures.ProcessPoolExecutor(max_workers=jobs, initializer=initializer)
+        self.restarts = 0       # pools replaced after a worker died
+        self.lock = threading.Lock()
+        self.tasks = {}         # future -> (arguments, executor it was submitted to), until collected
+
+    def start(self):
+        """Start every worker now rather than on the first task"""
+        for future in [self.executor.submit(int) for _ in range(self.jobs)]:
+            future.result()
+
+    def submit(self, *args):
+        from concurrent.futures.process import BrokenProcessPool
+        with self.lock:
+            executor = self.executor
+            try:
+                future = executor.submit(self.function, *args)
+            except BrokenProcessPool:
+                executor = self._replace(executor)
+                future = executor.submit(self.function, *args)
+            self.tasks[future] = (args, executor)
+        return future
+
+    def result(self, future):
+        """The result of a submitted task, waiting for it if needed"""
+        from concurrent.futures.process import BrokenProcessPool
+        with self.lock:
+            args, executor = self.tasks.pop(future)
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            with self.lock:
+                self._replace(executor)
+        with futures.ProcessPoolExecutor(max_workers=1, initializer=self.initializer) as alone:
+            try:
+                return alone.submit(self.function, *args).result()
+            except BrokenProcessPool:
+                if self.function is not _enhance_task:
+                    raise
+                return "", "The worker process died (out of memory or crashed)", None, None, None
+
+    def _replace(self, broken):
+        """Replace the pool if it is still the broken one (called with the lock held)"""
+        if self.executor is broken:
+            # The pool terminates its other workers with SIGTERM, which _init_pool_worker
+            # ignores; left alive they would block the pool's cleanup and interpreter exit
+            for process in list((getattr(broken, "_processes", None) or {}).values()):
+                process.kill()
+            broken.shutdown(wait=False)
+            self.executor = futures.ProcessPoolExecutor(max_workers=self.jobs, initializer=self.initializer)
+            self.restarts += 1
+        return self.executor
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+
+def _check_folder_arguments(input_folder, profiles, create_subfolder):
+    if len(profiles) > 1 and not create_subfolder:
+        raise ValueError("Several profiles need one subfolder each; remove --no-subfolder")
+    if not Path(input_folder).exists():
+        raise ValueError(f"Input folder '{input_folder}' does not exist")
+
+
+def enhance_folder(input_folder, output_folder, profile_name, create_subfolder=True, verbose=True,
+                   jobs=None, incremental=False, progress=None, cancel_event=None, stats=None,
+                   recursive=False, include=None, exclude=None, dedup=False, memory_budget_mb=None,
+                   **options):
+    """
+    Apply one or more profiles to all images in a folder
+
+    Each image is decoded once and every requested profile is applied to it.
+    Images are found with iter_images and processed in its order while the scan
+    continues; with recursive the output folders mirror the input tree.
+
+    With dedup, an image whose content is identical to an earlier one is not
+    processed again: its outputs are hard links to the earlier image's outputs.
+    Images that merely look alike (by perceptual_hash) are processed as usual
+    and listed in BatchProgress.near_duplicates.
+
+    With memory_budget_mb, the whole folder is scanned first and images are
+    processed largest first, as many at a time as their estimated peak memory
+    (see estimate_memory_mb) fits in the budget, and reported as they finish.
+
+    Args:
+        input_folder: Path to folder containing images
+        output_folder: Path to save enhanced images
+        profile_name: Name of the profile to apply (or a PhotoProfile), a list of those, or "all"
+        create_subfolder: If True, creates a subfolder named after each profile
+        verbose: If True, prints detailed progress
+        jobs: Number of worker processes (defaults to the CPU count, 1 disables the pool)
+        incremental: If True, skip outputs that are up to date according to the manifest
+            kept in each output folder (same input content, profile and engine)
+        progress: Optional callable receiving a BatchProgress after every image
+        cancel_event: Optional threading.Event; when set, no further images are started
+            and the images already being processed are finished
+        stats: Optional RunStats to record per-image stage timings and memory use in
+        recursive: If True, also process the images in subfolders
+        include: Optional glob patterns selecting the images to process (see iter_images)
+        exclude: Optional glob patterns for images and subfolders to leave out
+        dedup: If True, link the outputs of exact duplicates and report near duplicates
+        memory_budget_mb: Optional limit in MB for the estimated memory of the images
+            processed at the same time
+        **options: Extra keyword arguments passed to enhance_photo (e.g. engine)
+
+    Returns:
+        The final BatchProgress (None if there were no images)
+    """
+    profiles = resolve_profiles(profile_name)
+    _check_folder_arguments(input_folder, profiles, create_subfolder)
+    input_path = Path(input_folder)
+
+    run = _FolderRun(input_path, output_folder, profiles, create_subfolder, verbose, incremental,
+                     progress, stats, options, dedup=dedup)
+    run.print_header(f"Scanning '{input_folder}'{' and its subfolders' if recursive else ''} for images")
+    status = run.status
+    if progress:
+        progress(status)
+    jobs = jobs or os.cpu_count() or 1
+
+    if memory_budget_mb is not None:
+        images = iter_images(input_path, recursive=recursive, include=include, exclude=exclude,
+                             skip=[output_folder, *run.output_paths.values()])
+        _run_within_budget(run, images, jobs, memory_budget_mb, cancel_event)
+        return _end_folder_run(run, input_folder)
+
+    # Discovery runs in its own thread, a bounded number of files ahead of processing, so
+    # the first images are processed while a large tree is still being scanned.
+    # Output folders inside the input tree are not scanned.
+    found = queue.Queue(DISCOVERY_QUEUE_SIZE)
+    stop = threading.Event()
+    discovery_error = []
+
+    def discover():
+        try:
+            for img_file in iter_images(input_path, recursive=recursive, include=include, exclude=exclude,
+                                        skip=[output_folder, *run.output_paths.values()]):
+                status.total += 1
+                if not _queue_put(found, img_file, stop):
+                    return
+        except Exception as e:
+            discovery_error.append(e)
+        finally:
+            status.discovering = False
+            _queue_put(found, _STOP, stop)
+
+    # Process the images, fanning out to worker processes when there is more than one job.
+    # Results are reported in discovery order with at most 2 * jobs images in flight, and a
+    # failure only affects its own file.
+    in_flight = 2 * jobs if jobs > 1 else 0
+
+    discovery = threading.Thread(target=discover, daemon=True)
+    discovery.start()
+    with contextlib.ExitStack() as stack:
+        stack.callback(discovery.join)
+        stack.callback(stop.set)
+        executor = None
+        if jobs > 1:
+            executor = stack.enter_context(_WorkerPool(jobs, _limit_backend_threads))
+        pending = collections.deque()
+        while True:
+            img_file = _queue_get(found, stop)
+            if img_file is not _STOP:
+                entry = run.plan(img_file)
+                work = run.task(entry)
+                if work is not None and executor is not None:
+                    work = executor.submit(work)
+                pending.append((entry, work))
+
+            while pending and (img_file is _STOP or len(pending) > in_flight):
+                if cancel_event is not None and cancel_event.is_set():
+                    break
+                entry, work = pending.popleft()
+                if work is not None:
+                    work = executor.result(work) if executor is not None else _enhance_task(work)
+                run.finish(entry, work)
+
+            if cancel_event is not None and cancel_event.is_set():
+                status.cancelled = True
+                # Drop the queued images; the ones already running are finished
+                for _, work in pending:
+                    if executor is not None and work is not None:
+                        work.cancel()
+                break
+            if img_file is _STOP:
+                break
+
+    if discovery_error:
+        raise discovery_error[0]
+    return _end_folder_run(run, input_folder)
+
+
+def _end_folder_run(run, input_folder):
+    """Close an enhance_folder run and print its summary; returns its BatchProgress (None if empty)"""
+    run.close()
+    status = run.status
+
+    if status.total == 0:
+        print(f"No images found in '{input_folder}'")
+        return
+
+    run.print_summary("Batch processing cancelled!" if status.cancelled else "Batch processing complete!")
+    return status
+
+
+class _PollingWatcher:
+    """Finds new and modified files by rescanning a folder every interval seconds"""
+
+    def __init__(self, scan, interval):
+        self.scan = scan
+        self.interval = interval
+        self.snapshot = None
+        self.next_poll = 0
+
+    def changes(self, timeout):
+        """Files added or modified since the last poll, waiting up to timeout seconds for the next one"""
+        wait = self.next_poll - time.monotonic()
+        if wait > 0:
+            time.sleep(min(wait, timeout))
+            if wait > timeout:
+                return []
+        self.next_poll = time.monotonic() + self.interval
+
+        snapshot = {}
+        for path in self.scan():
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+        # The first scan only records the files that are already there
+        previous, self.snapshot = self.snapshot, snapshot
+        if previous is None:
+            return []
+        return [path for path, key in snapshot.items() if previous.get(path) != key]
+
+    def close(self):
+        pass
+
+
+class _InotifyWatcher:
+    """
+    Finds new and rewritten files with Linux inotify (called through ctypes)
+
+    inotify only sees changes made through the local kernel; writes from other
+    machines to a network share are not reported, use polling for those.
+    """
+
+    # From <sys/inotify.h>
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+    EVENT = struct.Struct("iIII")
+
+    def __init__(self, root, recursive, skip):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+        import ctypes.util
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, f"inotify_init1: {os.strerror(error)}")
+        self.recursive = recursive
+        self.skip = skip
+        self.folders = {}
+        try:
+            self._watch_tree(Path(root))
+        except OSError:
+            self.close()
+            raise
+
+    def _watch_tree(self, folder):
+        import ctypes
+        for directory, subfolders, _ in os.walk(folder):
+            wd = self.libc.inotify_add_watch(
+                self.fd, os.fsencode(directory),
+                self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE | self.IN_ONLYDIR)
+            if wd < 0:
+                error = ctypes.get_errno()
+                raise OSError(error, f"Cannot watch '{directory}': {os.strerror(error)}")
+            self.folders[wd] = Path(directory)
+            if not self.recursive:
+                break
+            subfolders[:] = [name for name in subfolders
+                             if _normalized(os.path.join(directory, name)) not in self.skip]
+
+    def _files(self, folder):
+        for directory, subfolders, files in os.walk(folder):
+            for name in files:
+                yield Path(directory) / name
+            subfolders[:] = [name for name in subfolders
+                             if _normalized(os.path.join(directory, name)) not in self.skip]
+
+    def changes(self, timeout):
+        """Files created, moved in or closed after writing, waiting up to timeout seconds"""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        changed = []
+        while True:
+            try:
+                data = os.read(self.fd, 1 << 16)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+                name = os.fsdecode(data[offset + self.EVENT.size:offset + self.EVENT.size + length].rstrip(b"\0"))
+                offset += self.EVENT.size + length
+                if mask & self.IN_Q_OVERFLOW:
+                    # Events were dropped: look at everything again
+                    for folder in list(self.folders.values()):
+                        try:
+                            changed.extend(path for path in folder.iterdir() if path.is_file())
+                        except OSError:
+                            pass
+                    continue
+                if mask & self.IN_IGNORED:
+                    self.folders.pop(wd, None)
+                    continue
+                folder = self.folders.get(wd)
+                if folder is None:
+                    continue
+                path = folder / name
+                if not mask & self.IN_ISDIR:
+                    changed.append(path)
+                elif self.recursive and _normalized(path) not in self.skip:
+                    # Files can land in a new folder before its watch is added, so list them too
+                    try:
+                        self._watch_tree(path)
+                    except OSError as e:
+                        print(f"Warning: {e}")
+                    changed.extend(self._files(path))
+        return changed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def _normalized(path):
+    """Absolute, case-normalized form of a path for comparisons"""
+    return os.path.normcase(os.path.abspath(path))
+
+
+def _is_wanted(root, path, recursive, include, exclude, skip):
+    """Whether iter_images(root, ...) would yield path (used for change notifications)"""
+    try:
+        parts = path.relative_to(root).parts
+    except ValueError:
+        return False
+    if not parts or (len(parts) > 1 and not recursive):
+        return False
+    if path.suffix.lower() not in IMAGE_EXTENSIONS:
+        return False
+    for i in range(1, len(parts)):
+        relative = "/".join(parts[:i])
+        if (_normalized(Path(root, *parts[:i])) in skip
+                or (exclude and _matches(exclude, parts[i - 1], relative))):
+            return False
+    relative = "/".join(parts)
+    if exclude and _matches(exclude, parts[-1], relative):
+        return False
+    return not include or _matches(include, parts[-1], relative)
+
+
+def _init_pool_worker():
+    """Long-running pools: workers leave SIGINT and SIGTERM to the parent, which finishes their work"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    _limit_backend_threads()
+
+
+def watch_folder(input_folder, output_folder, profile_name, create_subfolder=True, verbose=True,
+                 jobs=None, recursive=False, include=None, exclude=None, poll_interval=None,
+                 settle_time=WATCH_SETTLE_SECONDS, stop_event=None, progress=None, stats=None, **options):
+    """
+    Keep enhancing the images added to or changed in a folder until stopped
+
+    Images already in the folder are processed first, incrementally (see
+    enhance_folder), so a restart only redoes what changed. New and modified
+    files are then picked up through inotify on Linux, or by rescanning every
+    poll_interval seconds elsewhere or when poll_interval is given (inotify does
+    not see writes made by other machines to a network share). A file is only
+    processed once its size and modification time have been stable for
+    settle_time seconds, so files still being copied are left alone.
+
+    The worker processes are started once and stay up, and at most 2 * jobs
+    images are queued in the pool, so a new file waits for at most that many.
+    SIGTERM and SIGINT (or setting stop_event) stop the watch: the images in
+    progress are finished and the manifests are written before returning.
+
+    Args:
+        input_folder, output_folder, profile_name, create_subfolder, verbose, jobs,
+        recursive, include, exclude, progress, stats, **options: As for enhance_folder
+        poll_interval: Seconds between rescans; None uses inotify where available
+        settle_time: Seconds a file must stay unchanged before it is processed
+        stop_event: Optional threading.Event that ends the watch when set
+
+    Returns:
+        The BatchProgress of the session
+    """
+    profiles = resolve_profiles(profile_name)
+    _check_folder_arguments(input_folder, profiles, create_subfolder)
+    input_path = Path(input_folder)
+    stop_event = stop_event or threading.Event()
+    jobs = jobs or os.cpu_count() or 1
+
+    run = _FolderRun(input_path, output_folder, profiles, create_subfolder, verbose, True,
+                     progress, stats, options)
+    skip = {_normalized(path) for path in [output_folder, *run.output_paths.values()]}
+
+    def scan():
+        return iter_images(input_path, recursive=recursive, include=include, exclude=exclude, skip=skip)
+
+    watcher = None
+    if poll_interval is None:
+        try:
+            watcher = _InotifyWatcher(input_path, recursive, skip)
+        except OSError as e:
+            print(f"Change notifications unavailable ({e}), polling every {WATCH_POLL_SECONDS} seconds")
+    if watcher is None:
+        watcher = _PollingWatcher(scan, poll_interval or WATCH_POLL_SECONDS)
+
+    run.print_header(f"Watching '{input_folder}'{' and its subfolders' if recursive else ''} "
+                     f"(Ctrl+C or SIGTERM to stop)")
+
+    # Stop cleanly on SIGTERM (e.g. from a service manager) as well as on Ctrl+C
+    previous_handlers = {}
+    if threading.current_thread() is threading.main_thread():
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            previous_handlers[signum] = signal.signal(signum, lambda *_: stop_event.set())
+
+    backlog = scan()        # images already there, processed lazily as the pool has room
+    candidates = {}         # changed file -> ((size, mtime_ns), time it was last seen changing)
+    running = {}            # future -> planned entry
+    capacity = 2 * jobs
+
+    def submit(path):
+        run.status.total += 1
+        entry = run.plan(path)
+        task = run.task(entry)
+        if task is None:
+            run.finish(entry, None)
+        else:
+            running[executor.submit(task)] = entry
+
+    try:
+        with _WorkerPool(jobs, _init_pool_worker) as executor:
+            # Start every worker now rather than when the first files arrive
+            executor.start()
+
+            while not stop_event.is_set():
+                busy = backlog is not None and len(running) < capacity
+                timeout = 0 if busy else WATCH_TICK_SECONDS if candidates or running else 1.0
+                for path in watcher.changes(timeout):
+                    if _is_wanted(input_path, path, recursive, include, exclude, skip):
+                        candidates[path] = None
+
+                # Files are ready once their size and mtime have been stable for settle_time
+                now = time.monotonic()
+                ready = []
+                for path, seen in list(candidates.items()):
+                    try:
+                        stat = path.stat()
+                    except OSError:
+                        del candidates[path]
+                        continue
+                    key = (stat.st_size, stat.st_mtime_ns)
+                    if seen is None or seen[0] != key:
+                        candidates[path] = (key, now)
+                    elif now - seen[1] >= settle_time:
+                        ready.append(path)
+                for path in sorted(ready):
+                    if len(running) >= capacity:
+                        break
+                    del candidates[path]
+                    submit(path)
+
+                # Then the existing images, a limited number per round to keep watching
+                for _ in range(WATCH_BACKLOG_BATCH):
+                    if backlog is None or len(running) >= capacity:
+                        break
+                    path = next(backlog, None)
+                    if path is None:
+                        backlog = None
+                        break
+                    try:
+                        recent = time.time() - path.stat().st_mtime < settle_time
+                    except OSError:
+                        continue
+                    if recent or path in candidates:
+                        # Possibly still being written: treat it like a new file
+                        candidates.setdefault(path, None)
+                    else:
+                        submit(path)
+
+                for future in [future for future in running if future.done()]:
+                    run.finish(running.pop(future), executor.result(future))
+
+            # Finish the images in progress before shutting down
+            for future, entry in running.items():
+                run.finish(entry, executor.result(future))
+    finally:
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+        watcher.close()
+        run.close()
+
+    run.print_summary("Watch stopped")
+    return run.status
+
+
+def main():
+    """Main CLI entry point"""
+    parser = argparse.ArgumentParser(
+        description='Photo Enhancement CLI Tool - Enhance photos with predefined profiles',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog='''
+Examples:
+  # List all available profiles
+  python photo_enhancer.py --list-profiles
+
+  # Enhance a single photo
+  python photo_enhancer.py -i photo.jpg -o enhanced.jpg -p HDR_Boost
+
+  # Enhance all photos in a folder
+  python photo_enhancer.py -f photos -o enhanced -p HDR_Boost
+
+  # Enhance folder without creating subfolders
+  python photo_enhancer.py -f photos -o enhanced -p Natural_Enhance --no-subfolder
+
+  # Quiet mode (less output)
+  python photo_enhancer.py -f photos -o enhanced -p Vibrant --quiet
+
+  # Apply several profiles (or "all") while decoding each photo only once
+  python photo_enhancer.py -f photos -o enhanced -p HDR_Boost Vibrant
+  python photo_enhancer.py -f photos -o enhanced -p all
+
+  # Process a tree of dated folders, skipping thumbnails; the output mirrors the tree
+  python photo_enhancer.py -f dumps -o enhanced -p HDR_Boost --recursive --exclude "thumbs" "*_small.*"
+
+  # Run as an ingest service: enhance photos as soon as they are dropped into a folder
+  python photo_enhancer.py -f ingest -o enhanced -p HDR_Boost --watch --recursive
+
+  # Only process new or changed photos since the last run
+  python photo_enhancer.py -f photos -o enhanced -p HDR_Boost --incremental
+
+  # Process camera dumps with repeated copies only once, and list near-identical shots
+  python photo_enhancer.py -f dumps -o enhanced -p HDR_Boost --recursive --dedup
+
+  # Mixed phone and medium-format files: keep the images in flight under 6 GB, largest first
+  python photo_enhancer.py -f shoot -o enhanced -p HDR_Boost --memory-budget 6000
+
+  # Use 8 worker processes for a large folder
+  python photo_enhancer.py -f photos -o enhanced -p HDR_Boost --jobs 8
+
+  # Web export: longest side 2048 px, decoded at reduced size for speed
+  python photo_enhancer.py -f photos -o web -p Vibrant --max-size 2048
+
+  # Keep memory use of very large panoramas under 600 MB per image
+  python photo_enhancer.py -i panorama.tif -o enhanced.tif -p HDR_Boost --max-memory 600
+
+  # Let each photo's histograms choose its adjustments
+  python photo_enhancer.py -f photos -o enhanced --auto
+
+  # Local tone mapping for high-contrast scenes (bright windows, backlit subjects)
+  python photo_enhancer.py -f photos -o enhanced -p HDR_Boost --tone-mapping local
+
+  # Upload-ready WebP files of at most 400 KB each
+  python photo_enhancer.py -f photos -o upload -p Vibrant --format webp --target-kb 400
+
+  # Record where the time goes (decode, HDR, pixel passes, encode) per image
+  python photo_enhancer.py -f photos -o enhanced -p HDR_Boost --stats stats.jsonl
+
+  # Export a profile as a 3D LUT for other editors
+  python photo_enhancer.py -p Vibrant --export-lut vibrant.cube
+        '''
+    )
+
+    parser.add_argument('-i', '--input',
+                        help='Input image file')
+    parser.add_argument('-o', '--output',
+                        help='Output image file or folder')
+    parser.add_argument('-f', '--folder',
+                        help='Input folder containing images to process')
+    parser.add_argument('-p', '--profile',
+                        nargs='+',
+                        choices=list(PROFILES.keys()) + ['all'],
+                        help='Enhancement profile(s) to apply; "all" applies every profile '
+                             '(several profiles need --folder)')
+    parser.add_argument('--auto',
+                        action='store_true',
+                        help='Derive the adjustments from the histograms of each image instead of '
+                             f'using a fixed profile (may be combined with --profile; folder outputs '
+                             f'go to an "{AUTO_PROFILE}" subfolder)')
+    parser.add_argument('--list-profiles',
+                        action='store_true',
+                        help='List all available profiles')
+    parser.add_argument('--no-subfolder',
+                        action='store_true',
+                        help='Do not create profile subfolders when processing folders')
+    parser.add_argument('-r', '--recursive',
+                        action='store_true',
+                        help='Also process images in subfolders of --folder; the output mirrors the folder tree')
+    parser.add_argument('--include',
+                        nargs='+',
+                        metavar='PATTERN',
+                        help='Only process images whose name or relative path matches one of these glob patterns')
+    parser.add_argument('--exclude',
+                        nargs='+',
+                        metavar='PATTERN',
+                        help='Skip images and subfolders whose name or relative path matches one of these patterns')
+    parser.add_argument('--watch',
+                        action='store_true',
+                        help='Keep running and enhance images as they are added to or changed in --folder '
+                             '(implies --incremental; stop with Ctrl+C or SIGTERM)')
+    parser.add_argument('--poll',
+                        type=float,
+                        nargs='?',
+                        const=WATCH_POLL_SECONDS,
+                        metavar='SECONDS',
+                        help='With --watch, rescan the folder every SECONDS instead of using inotify '
+                             '(needed for network shares; default interval: %(const)s)')
+    parser.add_argument('--settle',
+                        type=float,
+                        default=WATCH_SETTLE_SECONDS,
+                        metavar='SECONDS',
+                        help='With --watch, wait until a file has not changed for SECONDS before '
+                             'processing it (default: %(default)s)')
+    parser.add_argument('--incremental',
+                        action='store_true',
+                        help='Skip images whose outputs are already up to date (tracked in a manifest '
+                             'in the output folder)')
+    parser.add_argument('--dedup',
+                        action='store_true',
+                        help='Hard-link the outputs of images identical to an earlier one instead of '
+                             'processing them again, and report near-identical images')
+    parser.add_argument('--memory-budget',
+                        type=int,
+                        metavar='MB',
+                        help='With --folder, limit the estimated memory of the images processed at once '
+                             'to MB; images are processed largest first')
+    parser.add_argument('--max-size',
+                        type=int,
+                        metavar='PX',
+                        help='Limit the longest side of the output to PX pixels (shrinks while decoding)')
+    parser.add_argument('--scale',
+                        type=float,
+                        help='Scale the output by a factor between 0 and 1 (shrinks while decoding)')
+    parser.add_argument('--max-memory',
+                        type=int,
+                        metavar='MB',
+                        help='Memory ceiling per image in MB; larger images are processed in tiles')
+    parser.add_argument('--export-lut',
+                        metavar='FILE',
+                        help='Export the selected profile as a .cube 3D LUT file and exit')
+    parser.add_argument('--lut-size',
+                        type=int,
+                        default=LUT_SIZE,
+                        help='Grid points per axis for --export-lut (default: %(default)s)')
+    parser.add_argument('--stats',
+                        metavar='FILE',
+                        help='Append per-image stage timings, memory use and output size to FILE '
+                             '(JSON lines) and print a summary at the end')
+    parser.add_argument('-q', '--quiet',
+                        action='store_true',
+                        help='Quiet mode - minimal output')
+    parser.add_argument('-j', '--jobs',
+                        type=int,
+                        default=None,
+                        help='Number of worker processes for folder processing (default: CPU count)')
+    parser.add_argument('--engine',
+                        choices=list(ENGINES.keys()),
+                        default=DEFAULT_ENGINE,
+                        help='Processing engine: "fused" runs all adjustments in a single float32 pass, '
+                             '"lut" maps pixels through a cached 3D LUT, '
+                             '"fixed" is the fused pass in integer fixed-point arithmetic, '
+                             '"legacy" chains the individual adjustments (default: %(default)s)')
+    parser.add_argument('--backend',
+                        choices=list(BACKENDS.keys()),
+                        default=DEFAULT_BACKEND,
+                        help='Compute backend for the fused and legacy engines: "numpy" is the reference, '
+                             '"numexpr" evaluates the adjustments multithreaded if numexpr is installed '
+                             '(default: %(default)s)')
+    parser.add_argument('--tone-mapping',
+                        choices=TONE_MAPPINGS,
+                        help='How the profiles apply HDR: "unsharp" boosts detail and lowers the global '
+                             'contrast, "local" compresses bright and dark areas separately '
+                             f'(default: the profile\'s own, {TONE_MAPPINGS[0]} for the built-in ones)')
+    parser.add_argument('--format',
+                        choices=[image_format.lower() for image_format in FORMAT_EXTENSIONS],
+                        help='Output format (default: the format of each input; with --input, the file '
+                             'named by --output is written in this format)')
+    parser.add_argument('--quality',
+                        type=int,
+                        help='JPEG/WebP quality 1-100, the highest one tried with --target-kb '
+                             f'(default: {DEFAULT_ENCODER.quality})')
+    parser.add_argument('--progressive',
+                        action='store_true',
+                        help='Write progressive JPEGs')
+    parser.add_argument('--optimize',
+                        action='store_true',
+                        help='Optimize JPEG Huffman tables and PNG compression (smaller, slower)')
+    parser.add_argument('--subsampling',
+                        choices=['4:4:4', '4:2:2', '4:2:0'],
+                        help='JPEG chroma subsampling (default: 4:2:0)')
+    parser.add_argument('--webp-method',
+                        type=int,
+                        choices=range(7),
+                        metavar='0-6',
+                        help='WebP compression effort, 0 fast to 6 smallest (default: 4)')
+    parser.add_argument('--target-kb',
+                        type=float,
+                        metavar='KB',
+                        help='Use the highest quality whose file fits in KB kilobytes (JPEG/WebP)')
+    parser.add_argument('--threads',
+                        type=int,
+                        default=None,
+                        help='Threads per image, each processing a band of rows (default: CPU count '
+                             'for a single image, 1 with --folder, which runs images in parallel)')
+
+    args = parser.parse_args()
+
+    # Handle list profiles
+    if args.list_profiles:
+        list_profiles()
+        return 0
+
+    if args.auto:
+        args.profile = (args.profile or []) + [AUTO_PROFILE]
+    profile_names = list(resolve_profiles(args.profile)) if args.profile else []
+
+    # Handle LUT export
+    if args.export_lut:
+        if len(profile_names) != 1 or args.auto:
+            print("Error: Must specify a single --profile")
+            return 1
+        export_cube(profile_names[0], args.export_lut, size=args.lut_size)
+        if not args.quiet:
+            print(f"Saved {args.lut_size}^3 LUT for {profile_names[0]} to: {args.export_lut}")
+        return 0
+
+    # Validate arguments
+    if args.folder and args.input:
+        print("Error: Cannot use both --input and --folder at the same time")
+        return 1
+
+    if not args.folder and not args.input:
+        print("Error: Must specify either --input or --folder")
+        parser.print_help()
+        return 1
+
+    if not args.profile:
+        print("Error: Must specify --profile or --auto")
+        parser.print_help()
+        return 1
+
+    if args.input and len(profile_names) > 1:
+        print("Error: Several profiles can only be applied with --folder")
+        return 1
+
+    if args.tone_mapping:
+        # Copies keep the names, so outputs still go to the profiles' subfolders
+        profile_names = [type(profile)(**{**vars(profile), "tone_mapping": args.tone_mapping})
+                         for profile in resolve_profiles(args.profile).values()]
+
+    if not args.output:
+        print("Error: Must specify --output")
+        return 1
+
+    verbose = not args.quiet
+    stats = RunStats(args.stats) if args.stats else None
+
+    encoder_options = {"image_format": args.format.upper() if args.format else None, "quality": args.quality,
+                       "progressive": args.progressive, "optimize": args.optimize,
+                       "subsampling": args.subsampling, "webp_method": args.webp_method,
+                       "target_kb": args.target_kb}
+    encoder_options = {name: value for name, value in encoder_options.items()
+                       if value is not None and value is not False}
+    encoder = None
+    if encoder_options:
+        try:
+            encoder = EncoderOptions(**encoder_options)
+        except ValueError as e:
+            print(f"Error: {e}")
+            return 1
+
+    backend = resolve_backend(args.backend)
+    if backend != args.backend and verbose:
+        print(f"Note: {BACKENDS[args.backend]['requires']} is not installed, using the {backend} backend")
+
+    if args.watch and not args.folder:
+        print("Error: --watch needs --folder")
+        return 1
+    if args.dedup and (args.watch or not args.folder):
+        print("Error: --dedup needs --folder and does not work with --watch")
+        return 1
+    if args.memory_budget is not None and (args.watch or not args.folder):
+        print("Error: --memory-budget needs --folder and does not work with --watch")
+        return 1
+
+    try:
+        # Watch folder
+        if args.watch:
+            watch_folder(
+                args.folder,
+                args.output,
+                profile_names,
+                create_subfolder=not args.no_subfolder,
+                verbose=verbose,
+                jobs=args.jobs,
+                recursive=args.recursive,
+                include=args.include,
+                exclude=args.exclude,
+                poll_interval=args.poll,
+                settle_time=args.settle,
+                stats=stats,
+                engine=args.engine,
+                backend=backend,
+                threads=args.threads or 1,
+                encoder=encoder,
+                max_memory_mb=args.max_memory,
+                max_size=args.max_size,
+                scale=args.scale
+            )
+        # Process folder
+        elif args.folder:
+            enhance_folder(
+                args.folder,
+                args.output,
+                profile_names,
+                create_subfolder=not args.no_subfolder,
+                verbose=verbose,
+                jobs=args.jobs,
+                incremental=args.incremental,
+                recursive=args.recursive,
+                dedup=args.dedup,
+                memory_budget_mb=args.memory_budget,
+                include=args.include,
+                exclude=args.exclude,
+                engine=args.engine,
+                backend=backend,
+                threads=args.threads or 1,
+                encoder=encoder,
+                max_memory_mb=args.max_memory,
+                max_size=args.max_size,
+                scale=args.scale,
+                stats=stats
+            )
+        # Process single file
+        else:
+            enhance_photo(args.input, args.output, profile_names[0], verbose=verbose, engine=args.engine,
+                          max_memory_mb=args.max_memory, max_size=args.max_size, scale=args.scale,
+                          stats=stats, backend=backend, threads=args.threads or os.cpu_count() or 1,
+                          encoder=encoder)
+
+        if stats is not None:
+            stats.finish()
+        return 0
+
+    except Exception as e:
+        print(f"\nError: {str(e)}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
     sys.exit(main())
\ No newline at end of file
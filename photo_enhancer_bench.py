@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+"""
+Photo Enhancer Benchmarks
+Times the adjustment stages, the profiles on every engine, enhance_photo and
+enhance_folder on reproducible synthetic images, and stores the results as JSON
+so runs can be compared against a baseline. --startup checks the start-up time
+of the command-line tool instead. Backend parity is checked by tests/test_backends.py.
+"""
+
+from PIL import Image
+import numpy as np
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import compileall
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import PIL
+import photo_enhancer
+from photo_enhancer import (apply_brightness, apply_contrast, apply_hdr, apply_local_tone_mapping,
+                            apply_saturation, apply_shadows, apply_warmth, apply_white_point, backend_ops,
+                            enhance_folder, enhance_image, enhance_photo, resolve_backend, BACKENDS,
+                            DEFAULT_BACKEND, ENGINES, PROFILES, REFERENCE_BACKEND)
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows: peak memory is not reported there
+    resource = None
+
+
+# Image sizes in megapixels
+DEFAULT_SIZES = [1, 12, 24, 50, 100]
+QUICK_SIZES = [1, 12]
+
+# Image modes and the file format their fixtures are stored in
+MODES = {
+    "RGB": ".jpg",
+    "L": ".jpg",
+    "RGBA": ".png",
+}
+
+# Adjustment stages, each timed at a typical strength
+STAGES = {
+    "apply_hdr": (apply_hdr, 50),
+    "apply_local_tone_mapping": (apply_local_tone_mapping, 50),
+    "apply_brightness": (apply_brightness, 10),
+    "apply_contrast": (apply_contrast, 15),
+    "apply_white_point": (apply_white_point, 10),
+    "apply_shadows": (apply_shadows, 20),
+    "apply_saturation": (apply_saturation, 20),
+    "apply_warmth": (apply_warmth, 10),
+}
+
+# Profile used for the enhance_photo and enhance_folder benchmarks
+BATCH_PROFILE = "HDR_Boost"
+
+# Size of the images in the enhance_folder benchmark
+BATCH_MEGAPIXELS = 12
+
+# Bump when the synthetic images change, so cached fixtures are regenerated
+FIXTURE_VERSION = 1
+
+# Start-up check: the ways of running the tool that skip compiling it (the launcher and
+# python -m run the cached bytecode), command lines that never touch pixels, the time they
+# may add to the interpreter's own start-up, runs per command (the fastest counts) and the
+# modules that importing photo_enhancer must leave to the first use
+STARTUP_LAUNCHERS = {
+    "enhance.py": ["enhance.py"],
+    "python -m photo_enhancer": ["-m", "photo_enhancer"],
+}
+STARTUP_COMMANDS = {
+    "--list-profiles": ["--list-profiles"],
+    "--help": ["--help"],
+    "argument error": ["--input", "photo.jpg"],
+}
+STARTUP_BUDGET_MS = 50
+STARTUP_RUNS = 10
+LAZY_MODULES = ("numpy", "PIL", "concurrent.futures", "ctypes", "hashlib", "shutil")
+
+
+def synthetic_image(megapixels, mode="RGB", seed=0):
+    """
+    Generate a reproducible 4:3 test image of about the given size
+
+    Smooth color gradients (an upscaled random 64x48 image) with per-pixel noise,
+    so the image has both large tonal areas and fine detail like a photo.
+    """
+    width = round((megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = round(width * 3 / 4)
+    rng = np.random.default_rng(seed)
+
+    base = Image.fromarray(rng.integers(0, 256, (48, 64, 3), dtype=np.uint8))
+    arr = np.array(base.resize((width, height), Image.BICUBIC))
+    # Add the noise a band of rows at a time to keep the temporaries small
+    rows = max(1, (1 << 20) // width)
+    for top in range(0, height, rows):
+        band = arr[top:top + rows]
+        noise = rng.integers(-12, 13, band.shape, dtype=np.int16)
+        band[:] = np.clip(band + noise, 0, 255)
+
+    img = Image.fromarray(arr)
+    if mode == "RGBA":
+        img.putalpha(255)
+    elif mode != "RGB":
+        img = img.convert(mode)
+    return img
+
+
+def fixture_path(workdir, megapixels, mode):
+    """Path of the cached synthetic image file for a size and mode"""
+    return Path(workdir) / f"bench_v{FIXTURE_VERSION}_{megapixels}mp_{mode}{MODES[mode]}"
+
+
+def make_fixture(workdir, megapixels, mode):
+    """Write the synthetic image file for a size and mode unless it is already cached"""
+    path = fixture_path(workdir, megapixels, mode)
+    if not path.exists():
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        synthetic_image(megapixels, mode).save(tmp_path, format=Image.registered_extensions()[path.suffix],
+                                               quality=95)
+        os.replace(tmp_path, path)
+    return path
+
+
+def _peak_rss_mb(who=None):
+    """Peak resident memory of this process (or its children) in MB, None if unknown"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(who if who is not None else resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return round(peak / (1 << 20 if sys.platform == "darwin" else 1 << 10), 1)
+
+
+def _time_runs(run, repeat, setup=None):
+    """Time run() repeat times, calling setup() untimed before each run to get its argument"""
+    runs = []
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        start = time.perf_counter()
+        run(arg)
+        runs.append(time.perf_counter() - start)
+    return runs
+
+
+def _startup_ms(args, cwd):
+    """Fastest wall-clock time of STARTUP_RUNS runs of python with args, in ms"""
+    runs = []
+    for _ in range(STARTUP_RUNS):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *args], cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        runs.append(time.perf_counter() - start)
+    return min(runs) * 1000
+
+
+def check_startup(budget_ms=STARTUP_BUDGET_MS, verbose=True):
+    """
+    Check that command lines which never touch pixels start fast
+
+    Each of STARTUP_COMMANDS is run through each of STARTUP_LAUNCHERS and compared
+    with the bare interpreter, and python -X importtime lists the modules importing
+    photo_enhancer loads, which must not include any of LAZY_MODULES. The module is
+    compiled first, as any run that can write its __pycache__ leaves it.
+
+    Returns:
+        List of (check, problem) for every command over budget_ms and every lazy
+        module that was imported
+    """
+    module_file = Path(photo_enhancer.__file__).resolve()
+    cwd = module_file.parent
+    compileall.compile_file(module_file, quiet=1)
+    failures = []
+    interpreter = _startup_ms(["-c", "pass"], cwd)
+    if verbose:
+        print(f"python: {interpreter:.0f} ms")
+    for launcher, launcher_args in STARTUP_LAUNCHERS.items():
+        for command, args in STARTUP_COMMANDS.items():
+            name = f"{launcher} {command}"
+            extra = _startup_ms([*launcher_args, *args], cwd) - interpreter
+            if verbose:
+                print(f"{name}: +{extra:.0f} ms")
+            if extra > budget_ms:
+                failures.append((name, f"adds {extra:.0f} ms to the interpreter start-up "
+                                       f"(budget {budget_ms} ms)"))
+
+    trace = subprocess.run([sys.executable, "-X", "importtime", "-c", "import photo_enhancer"],
+                           cwd=cwd, capture_output=True, text=True, check=True).stderr
+    # Lines look like "import time: <self us> | <cumulative us> | <indented module name>"
+    imported = {}
+    for line in trace.splitlines():
+        fields = line.removeprefix("import time:").split("|")
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            imported[fields[2].strip()] = int(fields[1])
+    if verbose:
+        print(f"import photo_enhancer: {imported.get('photo_enhancer', 0) / 1000:.0f} ms")
+    for module in LAZY_MODULES:
+        if module in imported:
+            failures.append(("import photo_enhancer", f"imports {module} ({imported[module] / 1000:.0f} ms)"))
+    return failures
+
+
+def _run_case(case, workdir, repeat):
+    """
+    Run one benchmark case and return its result record
+
+    Called in a fresh process per case (see run_benchmarks), so the peak RSS
+    belongs to that case alone.
+    """
+    kind, megapixels, mode, target = case["kind"], case["megapixels"], case["mode"], case["target"]
+    backend = case.get("backend", DEFAULT_BACKEND)
+    images = 1
+    quiet = contextlib.redirect_stdout(io.StringIO())
+
+    if kind == "stage":
+        img = Image.open(make_fixture(workdir, megapixels, mode)).convert("RGB")
+        function, value = STAGES[target]
+        if backend != REFERENCE_BACKEND:
+            function = backend_ops(backend).get(target[len("apply_"):], function)
+        runs = _time_runs(lambda _: function(img, value), repeat)
+    elif kind == "profile":
+        engine, profile_name = target.split("/")
+        img = Image.open(make_fixture(workdir, megapixels, mode)).convert("RGB")
+        # Engines may reuse their input, so each run gets a fresh (untimed) copy
+        runs = _time_runs(lambda copy: ENGINES[engine](copy, PROFILES[profile_name], None, backend),
+                          repeat, img.copy)
+    elif kind == "enhance_photo":
+        source = make_fixture(workdir, megapixels, mode)
+        output = Path(workdir) / f"out_{os.getpid()}{source.suffix}"
+        runs = _time_runs(lambda _: enhance_photo(source, output, BATCH_PROFILE, verbose=False,
+                                                         backend=backend), repeat)
+        output.unlink()
+    elif kind == "enhance_folder":
+        images = case["images"]
+        source = make_fixture(workdir, megapixels, mode)
+        with tempfile.TemporaryDirectory(dir=workdir) as folder:
+            input_folder = Path(folder) / "in"
+            input_folder.mkdir()
+            for i in range(images):
+                os.link(source, input_folder / f"img{i:03d}{source.suffix}")
+            with quiet:
+                runs = _time_runs(lambda _: enhance_folder(input_folder, Path(folder) / "out", BATCH_PROFILE,
+                                                           verbose=False, jobs=int(target),
+                                                           backend=backend), repeat)
+    else:
+        raise ValueError(f"Benchmark kind '{kind}' not found. "
+                         f"Available: ['stage', 'profile', 'enhance_photo', 'enhance_folder']")
+
+    seconds = statistics.median(runs)
+    record = dict(case)
+    record.update({
+        "seconds": round(seconds, 4),
+        "runs": [round(run, 4) for run in runs],
+        "mpix_per_sec": round(megapixels * images / seconds, 2),
+        "peak_rss_mb": _peak_rss_mb(),
+    })
+    if kind == "enhance_folder":
+        record["images_per_sec"] = round(images / seconds, 2)
+        record["children_peak_rss_mb"] = _peak_rss_mb(resource.RUSAGE_CHILDREN) if resource else None
+    return record
+
+
+def plan_cases(sizes, modes, jobs, batch_images, name_filter=None, backend=DEFAULT_BACKEND):
+    """List the benchmark cases for the given sizes, image modes, worker counts and compute backend"""
+    cases = []
+
+    def add(kind, target, megapixels, mode="RGB", **extra):
+        name = f"{kind}/{target}/{megapixels}mp/{mode}"
+        if name_filter is None or name_filter in name:
+            cases.append(dict(name=name, kind=kind, target=target, megapixels=megapixels, mode=mode,
+                              backend=backend, **extra))
+
+    for megapixels in sizes:
+        for stage in STAGES:
+            add("stage", stage, megapixels)
+        for engine in ENGINES:
+            for profile_name in PROFILES:
+                add("profile", f"{engine}/{profile_name}", megapixels)
+        for mode in modes:
+            add("enhance_photo", BATCH_PROFILE, megapixels, mode)
+    for job_count in jobs:
+        add("enhance_folder", str(job_count), BATCH_MEGAPIXELS, images=batch_images)
+    return cases
+
+
+def run_benchmarks(cases, workdir, repeat, isolate=True, verbose=True):
+    """
+    Run benchmark cases and return their result records
+
+    With isolate (the default) every case runs in a fresh process, so peak RSS
+    is measured per case and one case's caches and heap don't affect the next.
+    """
+    results = []
+    for i, case in enumerate(cases, 1):
+        if verbose:
+            print(f"[{i}/{len(cases)}] {case['name']} ...", end=" ", flush=True)
+        if isolate:
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                record = executor.submit(_run_case, case, str(workdir), repeat).result()
+        else:
+            record = _run_case(case, str(workdir), repeat)
+        results.append(record)
+        if verbose:
+            print(f"{record['seconds']:.3f}s, {record['mpix_per_sec']:.1f} MP/s, "
+                  f"peak {record['peak_rss_mb']} MB")
+    return results
+
+
+def environment():
+    """Describe the machine and library versions the benchmarks ran with"""
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pillow": PIL.__version__,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "engine_version": photo_enhancer.ENGINE_VERSION,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare results to a baseline run
+
+    Returns:
+        List of (name, metric, baseline value, current value) for every case
+        whose throughput dropped or peak memory grew by more than tolerance
+    """
+    previous = {record["name"]: record for record in baseline["results"]}
+    regressions = []
+    for record in results:
+        old = previous.get(record["name"])
+        if old is None:
+            continue
+        if record["mpix_per_sec"] < old["mpix_per_sec"] * (1 - tolerance):
+            regressions.append((record["name"], "mpix_per_sec", old["mpix_per_sec"], record["mpix_per_sec"]))
+        if (record.get("peak_rss_mb") and old.get("peak_rss_mb")
+                and record["peak_rss_mb"] > old["peak_rss_mb"] * (1 + tolerance)):
+            regressions.append((record["name"], "peak_rss_mb", old["peak_rss_mb"], record["peak_rss_mb"]))
+    return regressions
+
+
+def main():
+    """Benchmark CLI entry point"""
+    parser = argparse.ArgumentParser(
+        description='Photo Enhancer benchmarks - time stages, profiles and batch processing',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog='''
+Examples:
+  # Quick run (1 and 12 MP) saved as a baseline
+  python photo_enhancer_bench.py --quick -o baseline.json
+
+  # Later: compare against it, exit code 1 on a regression of more than 15%
+  python photo_enhancer_bench.py --quick -o current.json --baseline baseline.json
+
+  # Only the HDR stage at 24 and 50 MP
+  python photo_enhancer_bench.py --sizes 24 50 --filter stage/apply_hdr
+
+  # Check that --help and --list-profiles start within budget, without NumPy or Pillow
+  python photo_enhancer_bench.py --startup
+        '''
+    )
+
+    parser.add_argument('--sizes',
+                        type=float,
+                        nargs='+',
+                        default=DEFAULT_SIZES,
+                        metavar='MP',
+                        help='Image sizes in megapixels (default: %(default)s)')
+    parser.add_argument('--quick',
+                        action='store_true',
+                        help=f'Only use {" and ".join(map(str, QUICK_SIZES))} MP images')
+    parser.add_argument('--modes',
+                        nargs='+',
+                        choices=list(MODES.keys()),
+                        default=list(MODES.keys()),
+                        help='Image modes for the enhance_photo benchmarks (default: all)')
+    parser.add_argument('--jobs',
+                        type=int,
+                        nargs='+',
+                        help='Worker counts for the enhance_folder benchmarks (default: 1 and the CPU count)')
+    parser.add_argument('--batch-images',
+                        type=int,
+                        default=8,
+                        help='Images in the enhance_folder benchmarks (default: %(default)s)')
+    parser.add_argument('--repeat',
+                        type=int,
+                        default=3,
+                        help='Runs per case; the median is reported (default: %(default)s)')
+    parser.add_argument('--filter',
+                        help='Only run cases whose name contains this text (e.g. "stage/", "fused/")')
+    parser.add_argument('--workdir',
+                        default=Path(tempfile.gettempdir()) / "photo_enhancer_bench",
+                        help='Folder for the cached synthetic images (default: %(default)s)')
+    parser.add_argument('--backend',
+                        choices=list(BACKENDS.keys()),
+                        default=DEFAULT_BACKEND,
+                        help='Compute backend to benchmark (default: %(default)s)')
+    parser.add_argument('--startup',
+                        action='store_true',
+                        help=f'Instead of timing, check that command lines which never touch pixels add '
+                             f'at most {STARTUP_BUDGET_MS} ms to the interpreter start-up and that '
+                             f'importing photo_enhancer leaves {", ".join(LAZY_MODULES)} unloaded')
+    parser.add_argument('--no-isolate',
+                        action='store_true',
+                        help='Run all cases in this process (faster, but peak RSS is cumulative)')
+    parser.add_argument('-o', '--output',
+                        help='Write the results to this JSON file')
+    parser.add_argument('--baseline',
+                        help='JSON results of an earlier run to compare against')
+    parser.add_argument('--tolerance',
+                        type=float,
+                        default=0.15,
+                        help='Allowed slowdown or memory growth against the baseline (default: %(default)s)')
+
+    args = parser.parse_args()
+
+    if args.startup:
+        failures = check_startup()
+        for check, problem in failures:
+            print(f"  {check}: {problem}")
+        return 1 if failures else 0
+
+    if resolve_backend(args.backend) != args.backend:
+        print(f"Error: {BACKENDS[args.backend]['requires']} is not installed")
+        return 1
+
+    sizes = QUICK_SIZES if args.quick else [int(size) if size == int(size) else size for size in args.sizes]
+    jobs = args.jobs or sorted({1, os.cpu_count() or 1})
+    workdir = Path(args.workdir)
+    workdir.mkdir(parents=True, exist_ok=True)
+
+    cases = plan_cases(sizes, args.modes, jobs, args.batch_images, args.filter, args.backend)
+    if not cases:
+        print("Error: No benchmark cases match --filter")
+        return 1
+
+    results = run_benchmarks(cases, workdir, args.repeat, isolate=not args.no_isolate)
+    report = {"environment": environment(), "backend": args.backend, "repeat": args.repeat,
+              "results": results}
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved results to: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        print("\n" + "=" * 60)
+        if not regressions:
+            print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+            return 0
+        print(f"{len(regressions)} regression(s) against {args.baseline} (tolerance {args.tolerance:.0%}):")
+        for name, metric, old, new in regressions:
+            print(f"  {name}: {metric} {old} -> {new}")
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
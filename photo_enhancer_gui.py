@@ -1,357 +1,615 @@
-#!/usr/bin/env python3
-"""
-Photo Enhancement GUI
-A desktop GUI for the photo enhancement tool
-"""
-
-import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
-from pathlib import Path
-import threading
-from photo_enhancer import enhance_photo, enhance_folder, PROFILES, list_profiles
-import sys
-
-
-class PhotoEnhancerGUI:
-    def __init__(self, root):
-        self.root = root
-        self.root.title("Photo Enhancer")
-        self.root.geometry("700x600")
-        self.root.resizable(True, True)
-
-        # Variables
-        self.input_path = tk.StringVar()
-        self.output_path = tk.StringVar()
-        self.selected_profile = tk.StringVar(value=list(PROFILES.keys())[0])
-        self.mode = tk.StringVar(value="folder")  # "file" or "folder"
-        self.create_subfolder = tk.BooleanVar(value=True)
-        self.processing = False
-
-        self.setup_ui()
-
-    def setup_ui(self):
-        """Setup the user interface"""
-        # Main container with padding
-        main_frame = ttk.Frame(self.root, padding="20")
-        main_frame.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
-
-        # Configure grid weights for responsiveness
-        self.root.columnconfigure(0, weight=1)
-        self.root.rowconfigure(0, weight=1)
-        main_frame.columnconfigure(1, weight=1)
-
-        row = 0
-
-        # Title
-        title_label = ttk.Label(main_frame, text="Photo Enhancement Tool",
-                                font=('Arial', 18, 'bold'))
-        title_label.grid(row=row, column=0, columnspan=3, pady=(0, 20))
-        row += 1
-
-        # Mode selection
-        mode_frame = ttk.LabelFrame(main_frame, text="Processing Mode", padding="10")
-        mode_frame.grid(row=row, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=(0, 15))
-
-        ttk.Radiobutton(mode_frame, text="Single Image", variable=self.mode,
-                        value="file", command=self.update_ui_mode).pack(side=tk.LEFT, padx=10)
-        ttk.Radiobutton(mode_frame, text="Folder (Batch)", variable=self.mode,
-                        value="folder", command=self.update_ui_mode).pack(side=tk.LEFT, padx=10)
-        row += 1
-
-        # Input selection
-        ttk.Label(main_frame, text="Input:", font=('Arial', 10, 'bold')).grid(
-            row=row, column=0, sticky=tk.W, pady=(0, 5))
-        row += 1
-
-        input_frame = ttk.Frame(main_frame)
-        input_frame.grid(row=row, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=(0, 15))
-        input_frame.columnconfigure(0, weight=1)
-
-        self.input_entry = ttk.Entry(input_frame, textvariable=self.input_path, state='readonly')
-        self.input_entry.grid(row=0, column=0, sticky=(tk.W, tk.E), padx=(0, 10))
-
-        self.input_button = ttk.Button(input_frame, text="Browse...", command=self.browse_input)
-        self.input_button.grid(row=0, column=1)
-        row += 1
-
-        # Output selection
-        ttk.Label(main_frame, text="Output:", font=('Arial', 10, 'bold')).grid(
-            row=row, column=0, sticky=tk.W, pady=(0, 5))
-        row += 1
-
-        output_frame = ttk.Frame(main_frame)
-        output_frame.grid(row=row, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=(0, 15))
-        output_frame.columnconfigure(0, weight=1)
-
-        self.output_entry = ttk.Entry(output_frame, textvariable=self.output_path, state='readonly')
-        self.output_entry.grid(row=0, column=0, sticky=(tk.W, tk.E), padx=(0, 10))
-
-        ttk.Button(output_frame, text="Browse...", command=self.browse_output).grid(row=0, column=1)
-        row += 1
-
-        # Profile selection
-        ttk.Label(main_frame, text="Enhancement Profile:", font=('Arial', 10, 'bold')).grid(
-            row=row, column=0, sticky=tk.W, pady=(0, 5))
-        row += 1
-
-        profile_frame = ttk.Frame(main_frame)
-        profile_frame.grid(row=row, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=(0, 15))
-        profile_frame.columnconfigure(0, weight=1)
-
-        self.profile_combo = ttk.Combobox(profile_frame, textvariable=self.selected_profile,
-                                          values=list(PROFILES.keys()), state='readonly', width=30)
-        self.profile_combo.grid(row=0, column=0, sticky=tk.W, padx=(0, 10))
-        self.profile_combo.bind('<<ComboboxSelected>>', self.show_profile_details)
-
-        ttk.Button(profile_frame, text="View All Profiles",
-                   command=self.show_all_profiles).grid(row=0, column=1)
-        row += 1
-
-        # Profile details display
-        self.profile_details_frame = ttk.LabelFrame(main_frame, text="Profile Details", padding="10")
-        self.profile_details_frame.grid(row=row, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=(0, 15))
-
-        self.profile_details_label = ttk.Label(self.profile_details_frame, text="",
-                                               justify=tk.LEFT, wraplength=600)
-        self.profile_details_label.pack(anchor=tk.W)
-        self.show_profile_details()
-        row += 1
-
-        # Options
-        options_frame = ttk.LabelFrame(main_frame, text="Options", padding="10")
-        options_frame.grid(row=row, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=(0, 15))
-
-        self.subfolder_check = ttk.Checkbutton(options_frame,
-                                               text="Create subfolder for each profile (recommended for batch)",
-                                               variable=self.create_subfolder)
-        self.subfolder_check.pack(anchor=tk.W)
-        row += 1
-
-        # Progress section
-        progress_frame = ttk.LabelFrame(main_frame, text="Progress", padding="10")
-        progress_frame.grid(row=row, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=(0, 15))
-
-        self.progress_bar = ttk.Progressbar(progress_frame, mode='indeterminate', length=600)
-        self.progress_bar.pack(fill=tk.X, pady=(0, 5))
-
-        self.status_label = ttk.Label(progress_frame, text="Ready to process", foreground="green")
-        self.status_label.pack(anchor=tk.W)
-        row += 1
-
-        # Action buttons
-        button_frame = ttk.Frame(main_frame)
-        button_frame.grid(row=row, column=0, columnspan=3, pady=(10, 0))
-
-        self.process_button = ttk.Button(button_frame, text="Start Processing",
-                                         command=self.start_processing, style='Accent.TButton')
-        self.process_button.pack(side=tk.LEFT, padx=5)
-
-        ttk.Button(button_frame, text="Clear", command=self.clear_fields).pack(side=tk.LEFT, padx=5)
-        ttk.Button(button_frame, text="Exit", command=self.root.quit).pack(side=tk.LEFT, padx=5)
-
-        # Configure button style
-        style = ttk.Style()
-        style.configure('Accent.TButton', font=('Arial', 10, 'bold'))
-
-    def update_ui_mode(self):
-        """Update UI based on selected mode"""
-        # Just update the button text hint
-        mode = self.mode.get()
-        if mode == "file":
-            self.input_button.configure(text="Browse File...")
-        else:
-            self.input_button.configure(text="Browse Folder...")
-
-    def browse_input(self):
-        """Browse for input file or folder"""
-        if self.mode.get() == "file":
-            path = filedialog.askopenfilename(
-                title="Select Image",
-                filetypes=[
-                    ("Image files", "*.jpg *.jpeg *.png *.bmp *.tiff *.webp"),
-                    ("All files", "*.*")
-                ]
-            )
-        else:
-            path = filedialog.askdirectory(title="Select Input Folder")
-
-        if path:
-            self.input_path.set(path)
-
-            # Auto-suggest output path
-            if not self.output_path.get():
-                if self.mode.get() == "file":
-                    input_file = Path(path)
-                    suggested_output = input_file.parent / f"{input_file.stem}_enhanced{input_file.suffix}"
-                    self.output_path.set(str(suggested_output))
-                else:
-                    input_folder = Path(path)
-                    suggested_output = input_folder.parent / "enhanced"
-                    self.output_path.set(str(suggested_output))
-
-    def browse_output(self):
-        """Browse for output location"""
-        if self.mode.get() == "file":
-            path = filedialog.asksaveasfilename(
-                title="Save Enhanced Image As",
-                defaultextension=".jpg",
-                filetypes=[
-                    ("JPEG", "*.jpg"),
-                    ("PNG", "*.png"),
-                    ("All files", "*.*")
-                ]
-            )
-        else:
-            path = filedialog.askdirectory(title="Select Output Folder")
-
-        if path:
-            self.output_path.set(path)
-
-    def show_profile_details(self, event=None):
-        """Display details of selected profile"""
-        profile_name = self.selected_profile.get()
-        if profile_name in PROFILES:
-            profile = PROFILES[profile_name]
-            details = f"{profile.name}\n"
-            details += f"HDR: {profile.hdr}%  |  Brightness: {profile.brightness:+d}%  |  Contrast: {profile.contrast:+d}%\n"
-            details += f"Saturation: {profile.saturation:+d}%  |  Warmth: {profile.warmth:+d}%\n"
-            details += f"Shadows: {profile.shadows:+d}%  |  White Point: {profile.white_point}%"
-            self.profile_details_label.config(text=details)
-
-    def show_all_profiles(self):
-        """Show all profiles in a popup window"""
-        popup = tk.Toplevel(self.root)
-        popup.title("All Enhancement Profiles")
-        popup.geometry("600x500")
-
-        # Add scrollbar
-        frame = ttk.Frame(popup, padding="10")
-        frame.pack(fill=tk.BOTH, expand=True)
-
-        scrollbar = ttk.Scrollbar(frame)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-
-        text = tk.Text(frame, wrap=tk.WORD, yscrollcommand=scrollbar.set, font=('Courier', 10))
-        text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        scrollbar.config(command=text.yview)
-
-        # Add profile information
-        for name, profile in PROFILES.items():
-            text.insert(tk.END, f"{name}: {profile.name}\n", "header")
-            text.insert(tk.END, f"  HDR: {profile.hdr}%, Brightness: {profile.brightness:+d}%\n")
-            text.insert(tk.END, f"  Contrast: {profile.contrast:+d}%, Saturation: {profile.saturation:+d}%\n")
-            text.insert(tk.END, f"  Shadows: {profile.shadows:+d}%, Warmth: {profile.warmth:+d}%\n")
-            text.insert(tk.END, f"  White Point: {profile.white_point}%\n\n")
-
-        text.tag_config("header", font=('Courier', 10, 'bold'))
-        text.config(state=tk.DISABLED)
-
-        ttk.Button(popup, text="Close", command=popup.destroy).pack(pady=10)
-
-    def clear_fields(self):
-        """Clear all input fields"""
-        self.input_path.set("")
-        self.output_path.set("")
-
-    def validate_inputs(self):
-        """Validate user inputs"""
-        if not self.input_path.get():
-            messagebox.showerror("Error", "Please select an input file or folder")
-            return False
-
-        if not self.output_path.get():
-            messagebox.showerror("Error", "Please select an output location")
-            return False
-
-        if not Path(self.input_path.get()).exists():
-            messagebox.showerror("Error", "Input file or folder does not exist")
-            return False
-
-        return True
-
-    def start_processing(self):
-        """Start the processing in a separate thread"""
-        if self.processing:
-            messagebox.showwarning("Warning", "Processing already in progress")
-            return
-
-        if not self.validate_inputs():
-            return
-
-        # Start processing in a thread to keep UI responsive
-        self.processing = True
-        self.process_button.config(state=tk.DISABLED)
-        self.progress_bar.start(10)
-        self.status_label.config(text="Processing...", foreground="blue")
-
-        thread = threading.Thread(target=self.process_photos)
-        thread.daemon = True
-        thread.start()
-
-    def process_photos(self):
-        """Process photos (runs in separate thread)"""
-        try:
-            input_path = self.input_path.get()
-            output_path = self.output_path.get()
-            profile = self.selected_profile.get()
-
-            if self.mode.get() == "file":
-                # Single file processing
-                enhance_photo(input_path, output_path, profile, verbose=False)
-                success_msg = f"Photo enhanced successfully!\n\nSaved to:\n{output_path}"
-            else:
-                # Folder processing
-                enhance_folder(
-                    input_path,
-                    output_path,
-                    profile,
-                    create_subfolder=self.create_subfolder.get(),
-                    verbose=False
-                )
-                output_location = Path(output_path)
-                if self.create_subfolder.get():
-                    output_location = output_location / profile
-                success_msg = f"Batch processing complete!\n\nEnhanced photos saved to:\n{output_location}"
-
-            # Update UI on success (must be done in main thread)
-            self.root.after(0, lambda: self.processing_complete(success_msg))
-
-        except Exception as e:
-            # Update UI on error (must be done in main thread)
-            self.root.after(0, lambda: self.processing_error(str(e)))
-
-    def processing_complete(self, message):
-        """Called when processing completes successfully"""
-        self.processing = False
-        self.progress_bar.stop()
-        self.process_button.config(state=tk.NORMAL)
-        self.status_label.config(text="Processing complete!", foreground="green")
-        messagebox.showinfo("Success", message)
-
-    def processing_error(self, error_msg):
-        """Called when processing encounters an error"""
-        self.processing = False
-        self.progress_bar.stop()
-        self.process_button.config(state=tk.NORMAL)
-        self.status_label.config(text="Error occurred", foreground="red")
-        messagebox.showerror("Error", f"An error occurred:\n\n{error_msg}")
-
-
-def main():
-    """Main entry point for GUI"""
-    root = tk.Tk()
-    app = PhotoEnhancerGUI(root)
-
-    # Center window on screen
-    root.update_idletasks()
-    width = root.winfo_width()
-    height = root.winfo_height()
-    x = (root.winfo_screenwidth() // 2) - (width // 2)
-    y = (root.winfo_screenheight() // 2) - (height // 2)
-    root.geometry(f'{width}x{height}+{x}+{y}')
-
-    root.mainloop()
-
-
-if __name__ == "__main__":
+#!/usr/bin/env python3
+"""
+Photo Enhancement GUI
+A desktop GUI for the photo enhancement tool
+"""
+
+import tkinter as tk
+from tkinter import ttk, filedialog, messagebox
+from pathlib import Path
+import os
+import threading
+import time
+from photo_enhancer import (enhance_photo, enhance_folder, enhance_image, iter_images, load_image,
+                            resolve_profiles, PhotoProfile, PROFILES, ADJUSTMENTS, list_profiles)
+import sys
+
+
+# Longest side of the cached preview proxy, in pixels
+PREVIEW_SIZE = 640
+
+# Quiet time after the last slider movement before the preview is re-rendered
+PREVIEW_DEBOUNCE_MS = 40
+
+
+def format_duration(seconds):
+    """Format a number of seconds as m:ss (or h:mm:ss)"""
+    if seconds is None:
+        return "--:--"
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+class PhotoEnhancerGUI:
+    def __init__(self, root):
+        self.root = root
+        self.root.title("Photo Enhancer")
+        self.root.geometry("1200x720")
+        self.root.resizable(True, True)
+
+        # Variables
+        self.input_path = tk.StringVar()
+        self.output_path = tk.StringVar()
+        self.selected_profile = tk.StringVar(value=list(PROFILES.keys())[0])
+        self.mode = tk.StringVar(value="folder")  # "file" or "folder"
+        self.create_subfolder = tk.BooleanVar(value=True)
+        self.recursive = tk.BooleanVar(value=False)
+        self.adjustments = {name: tk.IntVar(value=0) for name in ADJUSTMENTS}
+        self.local_tone_mapping = tk.BooleanVar(value=False)
+        self.processing = False
+        self.cancel_event = threading.Event()
+
+        # Preview state: a low-resolution proxy of the input is decoded once and cached,
+        # renders run on a worker thread and only the latest request is shown
+        self.preview_path = None
+        self.preview_name = None
+        self.preview_proxy = None
+        self.preview_photo = None
+        self.preview_job = None
+        self.preview_generation = 0
+        self._preview_executor = None
+
+        self.setup_ui()
+        self.reset_adjustments()
+
+    def setup_ui(self):
+        """Setup the user interface"""
+        # Main container with padding
+        main_frame = ttk.Frame(self.root, padding="20")
+        main_frame.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+
+        # Configure grid weights for responsiveness
+        self.root.columnconfigure(0, weight=1)
+        self.root.rowconfigure(0, weight=1)
+        main_frame.columnconfigure(1, weight=1)
+
+        row = 0
+
+        # Title
+        title_label = ttk.Label(main_frame, text="Photo Enhancement Tool",
+                                font=('Arial', 18, 'bold'))
+        title_label.grid(row=row, column=0, columnspan=3, pady=(0, 20))
+        row += 1
+
+        # Mode selection
+        mode_frame = ttk.LabelFrame(main_frame, text="Processing Mode", padding="10")
+        mode_frame.grid(row=row, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=(0, 15))
+
+        ttk.Radiobutton(mode_frame, text="Single Image", variable=self.mode,
+                        value="file", command=self.update_ui_mode).pack(side=tk.LEFT, padx=10)
+        ttk.Radiobutton(mode_frame, text="Folder (Batch)", variable=self.mode,
+                        value="folder", command=self.update_ui_mode).pack(side=tk.LEFT, padx=10)
+        row += 1
+
+        # Input selection
+        ttk.Label(main_frame, text="Input:", font=('Arial', 10, 'bold')).grid(
+            row=row, column=0, sticky=tk.W, pady=(0, 5))
+        row += 1
+
+        input_frame = ttk.Frame(main_frame)
+        input_frame.grid(row=row, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=(0, 15))
+        input_frame.columnconfigure(0, weight=1)
+
+        self.input_entry = ttk.Entry(input_frame, textvariable=self.input_path, state='readonly')
+        self.input_entry.grid(row=0, column=0, sticky=(tk.W, tk.E), padx=(0, 10))
+
+        self.input_button = ttk.Button(input_frame, text="Browse...", command=self.browse_input)
+        self.input_button.grid(row=0, column=1)
+        row += 1
+
+        # Output selection
+        ttk.Label(main_frame, text="Output:", font=('Arial', 10, 'bold')).grid(
+            row=row, column=0, sticky=tk.W, pady=(0, 5))
+        row += 1
+
+        output_frame = ttk.Frame(main_frame)
+        output_frame.grid(row=row, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=(0, 15))
+        output_frame.columnconfigure(0, weight=1)
+
+        self.output_entry = ttk.Entry(output_frame, textvariable=self.output_path, state='readonly')
+        self.output_entry.grid(row=0, column=0, sticky=(tk.W, tk.E), padx=(0, 10))
+
+        ttk.Button(output_frame, text="Browse...", command=self.browse_output).grid(row=0, column=1)
+        row += 1
+
+        # Profile selection
+        ttk.Label(main_frame, text="Enhancement Profile:", font=('Arial', 10, 'bold')).grid(
+            row=row, column=0, sticky=tk.W, pady=(0, 5))
+        row += 1
+
+        profile_frame = ttk.Frame(main_frame)
+        profile_frame.grid(row=row, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=(0, 15))
+        profile_frame.columnconfigure(0, weight=1)
+
+        self.profile_combo = ttk.Combobox(profile_frame, textvariable=self.selected_profile,
+                                          values=list(PROFILES.keys()), state='readonly', width=30)
+        self.profile_combo.grid(row=0, column=0, sticky=tk.W, padx=(0, 10))
+        self.profile_combo.bind('<<ComboboxSelected>>', self.on_profile_selected)
+
+        ttk.Button(profile_frame, text="View All Profiles",
+                   command=self.show_all_profiles).grid(row=0, column=1)
+        row += 1
+
+        # Profile details display
+        self.profile_details_frame = ttk.LabelFrame(main_frame, text="Profile Details", padding="10")
+        self.profile_details_frame.grid(row=row, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=(0, 15))
+
+        self.profile_details_label = ttk.Label(self.profile_details_frame, text="",
+                                               justify=tk.LEFT, wraplength=600)
+        self.profile_details_label.pack(anchor=tk.W)
+        self.show_profile_details()
+        row += 1
+
+        # Options
+        options_frame = ttk.LabelFrame(main_frame, text="Options", padding="10")
+        options_frame.grid(row=row, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=(0, 15))
+
+        self.subfolder_check = ttk.Checkbutton(options_frame,
+                                               text="Create subfolder for each profile (recommended for batch)",
+                                               variable=self.create_subfolder)
+        self.subfolder_check.pack(anchor=tk.W)
+
+        self.recursive_check = ttk.Checkbutton(options_frame,
+                                               text="Include subfolders (output mirrors the folder tree)",
+                                               variable=self.recursive)
+        self.recursive_check.pack(anchor=tk.W)
+        row += 1
+
+        # Progress section
+        progress_frame = ttk.LabelFrame(main_frame, text="Progress", padding="10")
+        progress_frame.grid(row=row, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=(0, 15))
+
+        self.progress_bar = ttk.Progressbar(progress_frame, mode='determinate', length=600)
+        self.progress_bar.pack(fill=tk.X, pady=(0, 5))
+
+        self.status_label = ttk.Label(progress_frame, text="Ready to process", foreground="green")
+        self.status_label.pack(anchor=tk.W)
+        row += 1
+
+        # Action buttons
+        button_frame = ttk.Frame(main_frame)
+        button_frame.grid(row=row, column=0, columnspan=3, pady=(10, 0))
+
+        self.process_button = ttk.Button(button_frame, text="Start Processing",
+                                         command=self.start_processing, style='Accent.TButton')
+        self.process_button.pack(side=tk.LEFT, padx=5)
+
+        self.cancel_button = ttk.Button(button_frame, text="Cancel", command=self.cancel_processing,
+                                        state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.LEFT, padx=5)
+
+        ttk.Button(button_frame, text="Clear", command=self.clear_fields).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Exit", command=self.root.quit).pack(side=tk.LEFT, padx=5)
+
+        self.setup_preview_ui(main_frame, row)
+
+        # Configure button style
+        style = ttk.Style()
+        style.configure('Accent.TButton', font=('Arial', 10, 'bold'))
+
+    def setup_preview_ui(self, main_frame, rows):
+        """Setup the preview pane and adjustment sliders to the right of the main controls"""
+        side_frame = ttk.Frame(main_frame, padding=(20, 0, 0, 0))
+        side_frame.grid(row=0, column=3, rowspan=rows + 1, sticky=(tk.W, tk.E, tk.N, tk.S))
+        side_frame.columnconfigure(0, weight=1)
+
+        preview_frame = ttk.LabelFrame(side_frame, text="Preview", padding="10")
+        preview_frame.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(0, 15))
+
+        self.preview_label = ttk.Label(preview_frame, text="Select an input to see a preview",
+                                       anchor=tk.CENTER, width=60)
+        self.preview_label.pack(fill=tk.BOTH, expand=True)
+
+        self.preview_status = ttk.Label(preview_frame, text="", foreground="gray")
+        self.preview_status.pack(anchor=tk.W, pady=(5, 0))
+
+        adjustments_frame = ttk.LabelFrame(side_frame, text="Adjustments", padding="10")
+        adjustments_frame.grid(row=1, column=0, sticky=(tk.W, tk.E))
+        adjustments_frame.columnconfigure(1, weight=1)
+
+        self.adjustment_labels = {}
+        for i, (name, (label, low, high)) in enumerate(ADJUSTMENTS.items()):
+            ttk.Label(adjustments_frame, text=f"{label}:").grid(row=i, column=0, sticky=tk.W)
+            ttk.Scale(adjustments_frame, from_=low, to=high, variable=self.adjustments[name],
+                      command=lambda value, name=name: self.on_adjustment_changed(name)).grid(
+                row=i, column=1, sticky=(tk.W, tk.E), padx=10)
+            self.adjustment_labels[name] = ttk.Label(adjustments_frame, width=5, anchor=tk.E)
+            self.adjustment_labels[name].grid(row=i, column=2, sticky=tk.E)
+
+        ttk.Checkbutton(adjustments_frame, text="Local tone mapping for HDR",
+                        variable=self.local_tone_mapping, command=self.schedule_preview).grid(
+            row=len(ADJUSTMENTS), column=0, columnspan=3, sticky=tk.W, pady=(5, 0))
+
+        ttk.Button(adjustments_frame, text="Reset to Profile", command=self.reset_adjustments).grid(
+            row=len(ADJUSTMENTS) + 1, column=0, columnspan=3, pady=(10, 0))
+
+    def on_profile_selected(self, event=None):
+        """Show the selected profile and load its values into the sliders"""
+        self.show_profile_details()
+        self.reset_adjustments()
+
+    def reset_adjustments(self):
+        """Set the sliders to the values of the selected profile"""
+        profile = PROFILES[self.selected_profile.get()]
+        for name, variable in self.adjustments.items():
+            variable.set(getattr(profile, name))
+            self.adjustment_labels[name].config(text=str(variable.get()))
+        self.local_tone_mapping.set(profile.tone_mapping == "local")
+        self.schedule_preview()
+
+    def on_adjustment_changed(self, name):
+        """Snap a slider to whole values and re-render the preview once it settles"""
+        variable = self.adjustments[name]
+        variable.set(round(variable.get()))
+        self.adjustment_labels[name].config(text=str(variable.get()))
+        self.schedule_preview()
+
+    def current_profile(self):
+        """The profile to apply: the selected one, or a custom copy when sliders were moved"""
+        name = self.selected_profile.get()
+        base = PROFILES[name]
+        values = {adjustment: variable.get() for adjustment, variable in self.adjustments.items()}
+        values["tone_mapping"] = "local" if self.local_tone_mapping.get() else "unsharp"
+        if all(getattr(base, adjustment) == value for adjustment, value in values.items()):
+            return name
+        return PhotoProfile(name=f"{base.name} Custom", **values)
+
+    @property
+    def preview_executor(self):
+        """The preview worker thread, started on first use so the window opens sooner"""
+        if self._preview_executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            self._preview_executor = ThreadPoolExecutor(max_workers=1)
+        return self._preview_executor
+
+    def load_preview(self, path):
+        """Decode a screen-sized proxy of the input (or first image of a folder) in the background"""
+        path = Path(path)
+        if path == self.preview_path:
+            return
+
+        self.preview_path = path
+        self.preview_proxy = None
+        self.preview_status.config(text=f"Loading {path.name}...")
+
+        def load():
+            # Folders are scanned here too, as a large or slow tree would freeze the window
+            try:
+                image_path = next(iter_images(path), None) if path.is_dir() else path
+                if image_path is None:
+                    self.root.after(0, lambda: self.preview_status.config(text="No images to preview"))
+                    return
+                proxy, _ = load_image(str(image_path), max_size=PREVIEW_SIZE)
+            except Exception as e:
+                msg = f"Cannot preview: {e}"
+                self.root.after(0, lambda msg=msg: self.preview_status.config(text=msg))
+                return
+            self.root.after(0, self.preview_loaded, path, image_path.name, proxy)
+
+        self.preview_executor.submit(load)
+
+    def preview_loaded(self, path, name, proxy):
+        """Called on the Tk thread when a proxy has been decoded"""
+        if path != self.preview_path:
+            return
+        self.preview_name = name
+        self.preview_proxy = proxy
+        self.schedule_preview(delay=0)
+
+    def schedule_preview(self, delay=PREVIEW_DEBOUNCE_MS):
+        """Debounce preview renders: restart the timer on every change"""
+        if self.preview_job is not None:
+            self.root.after_cancel(self.preview_job)
+        self.preview_job = self.root.after(delay, self.render_preview)
+
+    def render_preview(self):
+        """Render the proxy with the current adjustments on the worker thread"""
+        self.preview_job = None
+        if self.preview_proxy is None:
+            return
+
+        self.preview_generation += 1
+        generation = self.preview_generation
+        proxy = self.preview_proxy
+        profile = self.current_profile()
+
+        def render():
+            # Skip requests that were superseded while waiting for the worker
+            if generation != self.preview_generation:
+                return
+            start = time.perf_counter()
+            try:
+                result = enhance_image(proxy, profile)
+            except Exception as e:
+                msg = f"Preview failed: {e}"
+                self.root.after(0, lambda msg=msg: self.preview_status.config(text=msg))
+                return
+            elapsed = time.perf_counter() - start
+            self.root.after(0, self.show_preview, generation, result, elapsed)
+
+        self.preview_executor.submit(render)
+
+    def show_preview(self, generation, image, elapsed):
+        """Display a rendered preview if it is still the latest one"""
+        if generation != self.preview_generation:
+            return
+        # Imported on first use so Pillow does not delay the window (see photo_enhancer._LazyModule)
+        from PIL import ImageTk
+        self.preview_photo = ImageTk.PhotoImage(image)
+        self.preview_label.config(image=self.preview_photo, text="")
+        self.preview_status.config(
+            text=f"{self.preview_name} ({image.width}x{image.height}) - rendered in {elapsed * 1000:.0f} ms")
+
+    def update_ui_mode(self):
+        """Update UI based on selected mode"""
+        # Just update the button text hint
+        mode = self.mode.get()
+        if mode == "file":
+            self.input_button.configure(text="Browse File...")
+        else:
+            self.input_button.configure(text="Browse Folder...")
+
+    def browse_input(self):
+        """Browse for input file or folder"""
+        if self.mode.get() == "file":
+            path = filedialog.askopenfilename(
+                title="Select Image",
+                filetypes=[
+                    ("Image files", "*.jpg *.jpeg *.png *.bmp *.tif *.tiff *.webp *.npy"),
+                    ("All files", "*.*")
+                ]
+            )
+        else:
+            path = filedialog.askdirectory(title="Select Input Folder")
+
+        if path:
+            self.input_path.set(path)
+            self.load_preview(path)
+
+            # Auto-suggest output path
+            if not self.output_path.get():
+                if self.mode.get() == "file":
+                    input_file = Path(path)
+                    suggested_output = input_file.parent / f"{input_file.stem}_enhanced{input_file.suffix}"
+                    self.output_path.set(str(suggested_output))
+                else:
+                    input_folder = Path(path)
+                    suggested_output = input_folder.parent / "enhanced"
+                    self.output_path.set(str(suggested_output))
+
+    def browse_output(self):
+        """Browse for output location"""
+        if self.mode.get() == "file":
+            path = filedialog.asksaveasfilename(
+                title="Save Enhanced Image As",
+                defaultextension=".jpg",
+                filetypes=[
+                    ("JPEG", "*.jpg"),
+                    ("PNG", "*.png"),
+                    ("All files", "*.*")
+                ]
+            )
+        else:
+            path = filedialog.askdirectory(title="Select Output Folder")
+
+        if path:
+            self.output_path.set(path)
+
+    def show_profile_details(self, event=None):
+        """Display details of selected profile"""
+        profile_name = self.selected_profile.get()
+        if profile_name in PROFILES:
+            profile = PROFILES[profile_name]
+            details = f"{profile.name}\n"
+            details += f"HDR: {profile.hdr}%  |  Brightness: {profile.brightness:+d}%  |  Contrast: {profile.contrast:+d}%\n"
+            details += f"Saturation: {profile.saturation:+d}%  |  Warmth: {profile.warmth:+d}%\n"
+            details += f"Shadows: {profile.shadows:+d}%  |  White Point: {profile.white_point}%"
+            self.profile_details_label.config(text=details)
+
+    def show_all_profiles(self):
+        """Show all profiles in a popup window"""
+        popup = tk.Toplevel(self.root)
+        popup.title("All Enhancement Profiles")
+        popup.geometry("600x500")
+
+        # Add scrollbar
+        frame = ttk.Frame(popup, padding="10")
+        frame.pack(fill=tk.BOTH, expand=True)
+
+        scrollbar = ttk.Scrollbar(frame)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        text = tk.Text(frame, wrap=tk.WORD, yscrollcommand=scrollbar.set, font=('Courier', 10))
+        text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.config(command=text.yview)
+
+        # Add profile information
+        for name, profile in PROFILES.items():
+            text.insert(tk.END, f"{name}: {profile.name}\n", "header")
+            text.insert(tk.END, f"  HDR: {profile.hdr}%, Brightness: {profile.brightness:+d}%\n")
+            text.insert(tk.END, f"  Contrast: {profile.contrast:+d}%, Saturation: {profile.saturation:+d}%\n")
+            text.insert(tk.END, f"  Shadows: {profile.shadows:+d}%, Warmth: {profile.warmth:+d}%\n")
+            text.insert(tk.END, f"  White Point: {profile.white_point}%\n\n")
+
+        text.tag_config("header", font=('Courier', 10, 'bold'))
+        text.config(state=tk.DISABLED)
+
+        ttk.Button(popup, text="Close", command=popup.destroy).pack(pady=10)
+
+    def clear_fields(self):
+        """Clear all input fields"""
+        self.input_path.set("")
+        self.output_path.set("")
+        self.preview_path = None
+        self.preview_proxy = None
+        self.preview_photo = None
+        self.preview_label.config(image="", text="Select an input to see a preview")
+        self.preview_status.config(text="")
+
+    def validate_inputs(self):
+        """Validate user inputs"""
+        if not self.input_path.get():
+            messagebox.showerror("Error", "Please select an input file or folder")
+            return False
+
+        if not self.output_path.get():
+            messagebox.showerror("Error", "Please select an output location")
+            return False
+
+        if not Path(self.input_path.get()).exists():
+            messagebox.showerror("Error", "Input file or folder does not exist")
+            return False
+
+        return True
+
+    def start_processing(self):
+        """Start the processing in a separate thread"""
+        if self.processing:
+            messagebox.showwarning("Warning", "Processing already in progress")
+            return
+
+        if not self.validate_inputs():
+            return
+
+        # Start processing in a thread to keep UI responsive
+        self.processing = True
+        self.process_button.config(state=tk.DISABLED)
+        self.cancel_event.clear()
+        if self.mode.get() == "file":
+            self.progress_bar.config(mode='indeterminate')
+            self.progress_bar.start(10)
+        else:
+            self.progress_bar.config(mode='determinate', value=0)
+            self.cancel_button.config(state=tk.NORMAL)
+        self.status_label.config(text="Processing...", foreground="blue")
+
+        # Read the sliders here: Tk variables must only be touched from the main thread
+        thread = threading.Thread(target=self.process_photos, args=(self.current_profile(),))
+        thread.daemon = True
+        thread.start()
+
+    def process_photos(self, profile):
+        """Process photos (runs in separate thread)"""
+        try:
+            input_path = self.input_path.get()
+            output_path = self.output_path.get()
+
+            if self.mode.get() == "file":
+                # Single file processing, on every core
+                enhance_photo(input_path, output_path, profile, verbose=False, threads=os.cpu_count() or 1)
+                success_msg = f"Photo enhanced successfully!\n\nSaved to:\n{output_path}"
+            else:
+                # Folder processing
+                status = enhance_folder(
+                    input_path,
+                    output_path,
+                    profile,
+                    create_subfolder=self.create_subfolder.get(),
+                    recursive=self.recursive.get(),
+                    verbose=False,
+                    progress=self.report_progress,
+                    cancel_event=self.cancel_event
+                )
+                output_location = Path(output_path)
+                if self.create_subfolder.get():
+                    output_location = output_location / list(resolve_profiles(profile))[0]
+                if status is None:
+                    success_msg = "No images found in the input folder"
+                elif status.cancelled:
+                    self.root.after(0, lambda: self.processing_cancelled(status))
+                    return
+                else:
+                    success_msg = (f"Batch processing complete!\n\n"
+                                   f"Enhanced {status.succeeded} of {status.pending} photos "
+                                   f"in {format_duration(status.elapsed)}"
+                                   + (f" ({status.failed} failed)" if status.failed else "")
+                                   + f"\n\nSaved to:\n{output_location}")
+
+            # Update UI on success (must be done in main thread)
+            self.root.after(0, lambda: self.processing_complete(success_msg))
+
+        except Exception as e:
+            # Update UI on error (must be done in main thread)
+            # e is unbound once the except block ends, so pass the message by value
+            msg = str(e)
+            self.root.after(0, lambda msg=msg: self.processing_error(msg))
+
+    def report_progress(self, status):
+        """Progress callback for enhance_folder (runs in the processing thread)"""
+        text = f"{status.done}/{status.total}{'+' if status.discovering else ''} images"
+        if status.processed:
+            text += (f"  -  {status.images_per_sec:.1f} images/s, "
+                     f"{status.bytes_per_sec / 1e6:.1f} MB/s  -  ETA {format_duration(status.eta)}")
+        if status.failed:
+            text += f"  -  {status.failed} failed"
+        self.root.after(0, self.update_progress, status.done, status.total, text)
+
+    def update_progress(self, done, total, text):
+        """Show batch progress (main thread)"""
+        if not self.processing or self.cancel_event.is_set():
+            return
+        self.progress_bar.config(maximum=max(total, 1), value=done)
+        self.status_label.config(text=text, foreground="blue")
+
+    def cancel_processing(self):
+        """Ask the running batch to stop after the current image"""
+        self.cancel_event.set()
+        self.cancel_button.config(state=tk.DISABLED)
+        self.status_label.config(text="Cancelling after the current image...", foreground="orange")
+
+    def processing_finished(self):
+        """Reset the controls once processing has stopped"""
+        self.processing = False
+        self.progress_bar.stop()
+        self.process_button.config(state=tk.NORMAL)
+        self.cancel_button.config(state=tk.DISABLED)
+
+    def processing_complete(self, message):
+        """Called when processing completes successfully"""
+        self.processing_finished()
+        self.progress_bar.config(value=self.progress_bar['maximum'])
+        self.status_label.config(text="Processing complete!", foreground="green")
+        messagebox.showinfo("Success", message)
+
+    def processing_cancelled(self, status):
+        """Called when a batch was cancelled"""
+        self.processing_finished()
+        self.status_label.config(
+            text=f"Cancelled after {status.done}/{status.total} images", foreground="orange")
+
+    def processing_error(self, error_msg):
+        """Called when processing encounters an error"""
+        self.processing_finished()
+        self.status_label.config(text="Error occurred", foreground="red")
+        messagebox.showerror("Error", f"An error occurred:\n\n{error_msg}")
+
+
+def main():
+    """Main entry point for GUI"""
+    root = tk.Tk()
+    app = PhotoEnhancerGUI(root)
+
+    # Center window on screen
+    root.update_idletasks()
+    width = root.winfo_width()
+    height = root.winfo_height()
+    x = (root.winfo_screenwidth() // 2) - (width // 2)
+    y = (root.winfo_screenheight() // 2) - (height // 2)
+    root.geometry(f'{width}x{height}+{x}+{y}')
+
+    root.mainloop()
+
+
+if __name__ == "__main__":
     main()
\ No newline at end of file
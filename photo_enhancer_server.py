@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+Photo Enhancer HTTP Service
+Enhances images posted over HTTP with a pool of warm worker processes, so callers
+don't pay interpreter start-up and import time for every image
+"""
+
+from PIL import Image, UnidentifiedImageError
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import argparse
+import collections
+import io
+import json
+import os
+import signal
+import sys
+import threading
+import time
+
+from photo_enhancer import (_apply_profile, _init_pool_worker, _percentile, _WorkerPool, encode_image, get_profile,
+                            load_image, resolve_backend, EncoderOptions, BACKENDS, DEFAULT_BACKEND, DEFAULT_ENCODER,
+                            DEFAULT_ENGINE, ENGINES, PROFILES)
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8080
+
+# Requests waiting for a worker on top of the ones being processed; more get a 503
+DEFAULT_QUEUE_SIZE = 16
+
+# Largest accepted request body
+MAX_REQUEST_MB = 200
+
+# Recent request latencies kept for the p50/p95 in /metrics
+LATENCY_WINDOW = 1000
+
+# Output formats that can be requested with ?format=
+OUTPUT_FORMATS = {"jpeg": "JPEG", "jpg": "JPEG", "png": "PNG", "webp": "WEBP", "tiff": "TIFF", "bmp": "BMP"}
+
+
+def _enhance_bytes(data, profile_name, engine, backend, max_memory_mb, max_size, scale, output_format,
+                   encoder=None):
+    """
+    Worker: decode posted image bytes, apply a profile and encode the result
+
+    Returns:
+        (bytes, Pillow format name, (width, height))
+    """
+    img, exif = load_image(io.BytesIO(data), max_size=max_size, scale=scale)
+    input_format = Image.open(io.BytesIO(data)).format
+    image_format = output_format or (input_format if input_format in OUTPUT_FORMATS.values() else "JPEG")
+    result = _apply_profile(img, get_profile(profile_name), False, engine, max_memory_mb, backend)
+    return encode_image(result, image_format, exif, encoder), image_format, result.size
+
+
+class _Metrics:
+    """Request counters and latencies for /metrics (updated from the handler threads)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.requests = collections.Counter()       # by status code
+        self.rejected = 0
+        self.images = 0
+        self.megapixels = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+
+    def record(self, status, seconds=None, bytes_in=0, bytes_out=0, size=None):
+        with self.lock:
+            self.requests[status] += 1
+            if status == 503:
+                self.rejected += 1
+            if seconds is not None:
+                self.latencies.append(seconds)
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            if size is not None:
+                self.images += 1
+                self.megapixels += size[0] * size[1] / 1e6
+
+    def snapshot(self):
+        with self.lock:
+            uptime = time.time() - self.start_time
+            latencies = list(self.latencies)
+            return {
+                "uptime_seconds": round(uptime, 1),
+                "requests": {str(status): count for status, count in sorted(self.requests.items())},
+                "rejected": self.rejected,
+                "images": self.images,
+                "images_per_sec": round(self.images / uptime, 3) if uptime > 0 else None,
+                "megapixels": round(self.megapixels, 1),
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "latency_seconds": {
+                    "p50": round(_percentile(latencies, 50), 4) if latencies else None,
+                    "p95": round(_percentile(latencies, 95), 4) if latencies else None,
+                },
+            }
+
+
+class EnhanceServer(ThreadingHTTPServer):
+    """
+    HTTP server that hands images to a persistent worker pool
+
+    Every connection is handled in its own thread, which waits for its image on
+    the pool. Up to jobs + queue_size enhance requests are accepted at a time;
+    further ones are answered with 503 right away, so a saturated service sheds
+    load instead of queueing without bound.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, jobs=None, queue_size=DEFAULT_QUEUE_SIZE, engine=DEFAULT_ENGINE,
+                 max_memory_mb=None, verbose=True, backend=DEFAULT_BACKEND):
+        if engine not in ENGINES:
+            raise ValueError(f"Engine '{engine}' not found. Available: {list(ENGINES.keys())}")
+        self.backend = resolve_backend(backend)
+        self.jobs = jobs or os.cpu_count() or 1
+        self.capacity = self.jobs + queue_size
+        self.slots = threading.BoundedSemaphore(self.capacity)
+        self.engine = engine
+        self.max_memory_mb = max_memory_mb
+        self.verbose = verbose
+        self.metrics = _Metrics()
+        Image.init()    # load every format plugin so Image.MIME is complete
+        self.active = 0
+        self.active_lock = threading.Lock()
+        # A worker that dies is replaced, and the requests it had are retried once
+        self.executor = _WorkerPool(self.jobs, _init_pool_worker, _enhance_bytes)
+        # Start every worker now so the first requests don't wait for them
+        self.executor.start()
+        super().__init__(address, _EnhanceHandler)
+
+    def server_close(self):
+        super().server_close()
+        # Let the images in progress finish
+        self.executor.shutdown(wait=True)
+
+
+class _EnhanceHandler(BaseHTTPRequestHandler):
+    """Routes: POST /enhance, GET /health, GET /metrics, GET /profiles"""
+
+    server_version = "PhotoEnhancer/1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, indent=2).encode() + b"\n"
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, message, headers=None):
+        self.server.metrics.record(status)
+        self._send_json(status, {"error": message}, headers)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        server = self.server
+        if path == "/health":
+            # A broken pool is replaced on the next request, so the service stays usable
+            self._send_json(200, {"status": "ok", "workers": server.jobs,
+                                  "restarts": server.executor.restarts})
+        elif path == "/metrics":
+            metrics = server.metrics.snapshot()
+            metrics.update(workers=server.jobs, capacity=server.capacity, in_progress=server.active,
+                           engine=server.engine, backend=server.backend)
+            self._send_json(200, metrics)
+        elif path == "/profiles":
+            self._send_json(200, {name: vars(profile) for name, profile in PROFILES.items()})
+        else:
+            self._error(404, f"Unknown path '{path}'")
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/enhance":
+            self._error(404, f"Unknown path '{url.path}'")
+            return
+        server = self.server
+
+        # Reject before reading the body when saturated; the connection is closed
+        # instead of draining an upload nobody will process
+        if not server.slots.acquire(blocking=False):
+            self.close_connection = True
+            self._error(503, "Server busy, retry later", {"Retry-After": "1", "Connection": "close"})
+            return
+        with server.active_lock:
+            server.active += 1
+        try:
+            self._enhance(url)
+        finally:
+            with server.active_lock:
+                server.active -= 1
+            server.slots.release()
+
+    def _enhance(self, url):
+        server = self.server
+        start = time.perf_counter()
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+
+        length = self.headers.get("Content-Length")
+        if length is None:
+            self.close_connection = True
+            self._error(411, "Content-Length required")
+            return
+        try:
+            length = int(length)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.close_connection = True
+            self._error(400, "Invalid Content-Length")
+            return
+        if length > MAX_REQUEST_MB << 20:
+            self.close_connection = True
+            self._error(413, f"Image larger than {MAX_REQUEST_MB} MB")
+            return
+        data = self.rfile.read(length)
+
+        try:
+            profile_name = query.get("profile", "")
+            get_profile(profile_name)
+            output_format = query.get("format")
+            if output_format is not None:
+                if output_format.lower() not in OUTPUT_FORMATS:
+                    raise ValueError(f"Format '{output_format}' not found. "
+                                     f"Available: {list(OUTPUT_FORMATS.keys())}")
+                output_format = OUTPUT_FORMATS[output_format.lower()]
+            max_size = int(query["max_size"]) if "max_size" in query else None
+            scale = float(query["scale"]) if "scale" in query else None
+            encoder = EncoderOptions(quality=int(query.get("quality", DEFAULT_ENCODER.quality)),
+                                     target_kb=int(query["target_kb"]) if "target_kb" in query else None)
+        except ValueError as e:
+            self._error(400, str(e))
+            return
+
+        try:
+            body, image_format, size = server.executor.result(server.executor.submit(
+                data, profile_name, server.engine, server.backend, server.max_memory_mb,
+                max_size, scale, output_format, encoder))
+        except BrokenProcessPool:
+            # The retry on a fresh worker died too: this image kills its worker
+            self._error(500, "The worker process died processing this image")
+            return
+        except UnidentifiedImageError:
+            self._error(400, "Request body is not a supported image")
+            return
+        except (ValueError, OSError, Image.DecompressionBombError) as e:
+            # Undecodable images and invalid sizes are the caller's fault
+            self._error(400, str(e))
+            return
+        except Exception as e:
+            self.log_error("Enhancing failed: %r", e)
+            self._error(500, f"Internal error: {e}")
+            return
+
+        seconds = time.perf_counter() - start
+        server.metrics.record(200, seconds, len(data), len(body), size)
+        self.send_response(200)
+        self.send_header("Content-Type", Image.MIME.get(image_format, "application/octet-stream"))
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-Image-Size", f"{size[0]}x{size[1]}")
+        self.send_header("X-Processing-Time", f"{seconds:.3f}")
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, jobs=None, queue_size=DEFAULT_QUEUE_SIZE,
+          engine=DEFAULT_ENGINE, max_memory_mb=None, verbose=True, backend=DEFAULT_BACKEND):
+    """
+    Run the enhancement service until SIGTERM or Ctrl+C
+
+    POST /enhance?profile=NAME with the image bytes as the body returns the enhanced
+    image (same format as the input unless ?format= is given; ?max_size= and
+    ?scale= shrink it and ?quality= / ?target_kb= set the encoder as on the command
+    line). GET /health, /metrics and /profiles return JSON.
+    """
+    server = EnhanceServer((host, port), jobs=jobs, queue_size=queue_size, engine=engine,
+                           max_memory_mb=max_memory_mb, verbose=verbose, backend=backend)
+
+    def stop(*_):
+        # shutdown() waits for serve_forever, so it cannot run in the signal handler's thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    previous_handlers = {}
+    if threading.current_thread() is threading.main_thread():
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            previous_handlers[signum] = signal.signal(signum, stop)
+
+    print(f"Serving on http://{server.server_address[0]}:{server.server_address[1]} "
+          f"with {server.jobs} workers (queue: {server.capacity - server.jobs})")
+    try:
+        server.serve_forever()
+    finally:
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+        server.server_close()
+    print("Server stopped")
+
+
+def main():
+    """Server CLI entry point"""
+    parser = argparse.ArgumentParser(
+        description='Photo Enhancer HTTP service - enhance images posted over HTTP',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog='''
+Examples:
+  # Start the service on localhost:8080 with one worker per CPU
+  python photo_enhancer_server.py
+
+  # Enhance an image
+  curl --data-binary @photo.jpg "http://localhost:8080/enhance?profile=HDR_Boost" -o enhanced.jpg
+
+  # Health and metrics
+  curl http://localhost:8080/health
+  curl http://localhost:8080/metrics
+        '''
+    )
+
+    parser.add_argument('--host',
+                        default=DEFAULT_HOST,
+                        help='Address to listen on (default: %(default)s)')
+    parser.add_argument('--port',
+                        type=int,
+                        default=DEFAULT_PORT,
+                        help='Port to listen on (default: %(default)s)')
+    parser.add_argument('-j', '--jobs',
+                        type=int,
+                        default=None,
+                        help='Number of worker processes (default: CPU count)')
+    parser.add_argument('--queue-size',
+                        type=int,
+                        default=DEFAULT_QUEUE_SIZE,
+                        help='Requests that may wait for a worker before new ones get a 503 '
+                             '(default: %(default)s)')
+    parser.add_argument('--engine',
+                        choices=list(ENGINES.keys()),
+                        default=DEFAULT_ENGINE,
+                        help='Processing engine (default: %(default)s)')
+    parser.add_argument('--backend',
+                        choices=list(BACKENDS.keys()),
+                        default=DEFAULT_BACKEND,
+                        help='Compute backend (default: %(default)s)')
+    parser.add_argument('--max-memory',
+                        type=int,
+                        metavar='MB',
+                        help='Memory ceiling per image in MB; larger images are processed in tiles')
+    parser.add_argument('-q', '--quiet',
+                        action='store_true',
+                        help='Do not log every request')
+
+    args = parser.parse_args()
+
+    try:
+        serve(args.host, args.port, jobs=args.jobs, queue_size=args.queue_size, engine=args.engine,
+              max_memory_mb=args.max_memory, verbose=not args.quiet, backend=args.backend)
+        return 0
+    except Exception as e:
+        print(f"\nError: {str(e)}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""
+Compute backend tests
+Every optional backend must match the reference backend within PARITY_TOLERANCE
+levels, for each adjustment and for every profile through every engine; a backend
+that is not installed is skipped
+"""
+
+from pathlib import Path
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from photo_enhancer import (backend_ops, enhance_image, resolve_backend, ADJUSTMENTS, BACKENDS, ENGINES,
+                            PROFILES, REFERENCE_BACKEND, PhotoProfile)
+from photo_enhancer_bench import synthetic_image
+
+# Largest difference, in levels, allowed between a backend and the reference
+PARITY_TOLERANCE = 1
+
+# Size of the synthetic test image
+PARITY_MEGAPIXELS = 0.5
+
+
+def installed(backend):
+    """Whether the optional modules a backend needs are installed"""
+    return resolve_backend(backend) == backend
+
+
+def max_difference(a, b):
+    """Largest per-channel difference between two images, in levels"""
+    return int(np.abs(np.asarray(a, dtype=np.int16) - np.asarray(b, dtype=np.int16)).max())
+
+
+class BackendParity:
+    """Checks for one backend against REFERENCE_BACKEND; subclasses set backend"""
+
+    backend = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.img = synthetic_image(PARITY_MEGAPIXELS)
+        cls.profiles = dict(PROFILES)
+        cls.profiles["lowest"] = PhotoProfile("Lowest", **{name: low for name, (_, low, _) in ADJUSTMENTS.items()})
+        cls.profiles["highest"] = PhotoProfile("Highest",
+                                               **{name: high for name, (_, _, high) in ADJUSTMENTS.items()})
+        cls.profiles["highest_local"] = PhotoProfile("Highest Local", tone_mapping="local",
+                                                     **{name: high for name, (_, _, high) in ADJUSTMENTS.items()})
+
+    def test_adjustments(self):
+        # Both ends and the middle of the range of every adjustment the backend implements
+        for name, (_, low, high) in ADJUSTMENTS.items():
+            if name not in BACKENDS[self.backend]["ops"]:
+                continue
+            for value in sorted({low, (low + high) // 2, high} - {0}):
+                with self.subTest(adjustment=name, value=value):
+                    expected = backend_ops(REFERENCE_BACKEND)[name](self.img, value)
+                    result = backend_ops(self.backend)[name](self.img, value)
+                    self.assertLessEqual(max_difference(result, expected), PARITY_TOLERANCE)
+
+    def test_engines(self):
+        for engine in ENGINES:
+            for profile_name, profile in self.profiles.items():
+                with self.subTest(engine=engine, profile=profile_name):
+                    expected = enhance_image(self.img, profile, engine, backend=REFERENCE_BACKEND)
+                    result = enhance_image(self.img, profile, engine, backend=self.backend)
+                    self.assertLessEqual(max_difference(result, expected), PARITY_TOLERANCE)
+
+
+@unittest.skipUnless(installed("numexpr"), "numexpr is not installed")
+class NumexprParityTest(BackendParity, unittest.TestCase):
+    backend = "numexpr"
+
+
+if __name__ == "__main__":
+    unittest.main()
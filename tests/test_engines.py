@@ -0,0 +1,57 @@
+"""
+Processing engine tests
+The fixed engine must stay within FIXED_TOLERANCE levels of the fused engine, for
+every profile, tiled or not
+"""
+
+from pathlib import Path
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from photo_enhancer import render_fixed, render_fused, ADJUSTMENTS, PROFILES, PhotoProfile
+from photo_enhancer_bench import synthetic_image
+
+# Largest difference, in levels, allowed between the fixed and the fused engine
+FIXED_TOLERANCE = 1
+
+# Size of the synthetic test image
+ENGINE_MEGAPIXELS = 0.5
+
+# Tile height for the tiled runs, small enough to give several tiles
+TILE_ROWS = 128
+
+
+class FixedEngineTest(unittest.TestCase):
+    """The fixed-point engine against the float32 fused engine"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.src = np.asarray(synthetic_image(ENGINE_MEGAPIXELS))
+        cls.profiles = dict(PROFILES)
+        cls.profiles["lowest"] = PhotoProfile("Lowest", **{name: low for name, (_, low, _) in ADJUSTMENTS.items()})
+        cls.profiles["highest"] = PhotoProfile("Highest",
+                                               **{name: high for name, (_, _, high) in ADJUSTMENTS.items()})
+        cls.profiles["highest_local"] = PhotoProfile("Highest Local", tone_mapping="local",
+                                                     **{name: high for name, (_, _, high) in ADJUSTMENTS.items()})
+
+    def test_matches_fused(self):
+        for profile_name, profile in self.profiles.items():
+            for tile_rows in (None, TILE_ROWS):
+                with self.subTest(profile=profile_name, tile_rows=tile_rows):
+                    expected = render_fused(self.src, profile, tile_rows=tile_rows).astype(np.int16)
+                    result = render_fixed(self.src, profile, tile_rows=tile_rows).astype(np.int16)
+                    self.assertLessEqual(int(np.abs(result - expected).max()), FIXED_TOLERANCE)
+
+    def test_tiles_match_untiled(self):
+        for profile_name, profile in self.profiles.items():
+            with self.subTest(profile=profile_name):
+                np.testing.assert_array_equal(render_fixed(self.src, profile, tile_rows=TILE_ROWS),
+                                              render_fixed(self.src, profile))
+
+
+if __name__ == "__main__":
+    unittest.main()
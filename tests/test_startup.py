@@ -0,0 +1,56 @@
+"""
+Start-up tests for the command-line tool
+enhance.py must behave like photo_enhancer.py, and importing photo_enhancer must
+leave NumPy, Pillow and the process pools unloaded. The timing budget is checked by
+photo_enhancer_bench.py --startup, as wall-clock times are too noisy for a unit test
+"""
+
+from pathlib import Path
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def run(*args, cwd=ROOT):
+    """Run python with args and return the completed process"""
+    return subprocess.run([sys.executable, *args], cwd=cwd, capture_output=True, text=True)
+
+
+class LauncherTest(unittest.TestCase):
+    """enhance.py behaves like photo_enhancer.py"""
+
+    def test_list_profiles(self):
+        launcher = run("enhance.py", "--list-profiles")
+        script = run("photo_enhancer.py", "--list-profiles")
+        self.assertEqual(launcher.returncode, 0, launcher.stderr)
+        self.assertEqual(launcher.stdout, script.stdout)
+
+    def test_exit_codes(self):
+        for args in (["--help"], ["--input", "photo.jpg"], ["--profile", "Unknown"]):
+            with self.subTest(args=args):
+                self.assertEqual(run("enhance.py", *args).returncode,
+                                 run("photo_enhancer.py", *args).returncode)
+
+    def test_other_working_directory(self):
+        with tempfile.TemporaryDirectory() as cwd:
+            result = run(str(ROOT / "enhance.py"), "--list-profiles", cwd=cwd)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn("HDR_Boost", result.stdout)
+
+
+class LazyImportTest(unittest.TestCase):
+    """Quick commands do not load the modules only image processing needs"""
+
+    def test_lazy_imports(self):
+        result = run("-c", "import sys, photo_enhancer; print(' '.join(sys.modules))")
+        self.assertEqual(result.returncode, 0, result.stderr)
+        loaded = set(result.stdout.split())
+        for module in ("numpy", "PIL", "concurrent.futures", "ctypes", "hashlib", "shutil"):
+            self.assertNotIn(module, loaded)
+
+
+if __name__ == "__main__":
+    unittest.main()